@@ -4,12 +4,14 @@ from PyQt5.QtWidgets import QMainWindow, QVBoxLayout, QHBoxLayout, QPushButton,
     QMessageBox
 from PyQt5.QtGui import QIntValidator, QIcon
 import qtawesome as qta
-from data_processing import load_and_plot_file, update_plot
-from backend import show_controls, validate_input, apply_time_range, update_pan, update_zoom, validate_custom_filter, save_data, state_change, \
-    handle_bandpass_apply_toggle, validate_bandpass_values, handle_filter_toggle
+from data_processing import load_and_plot_file
+from backend import show_controls, validate_input, apply_time_range, validate_custom_filter, save_data, state_change, \
+    handle_bandpass_apply_toggle, validate_bandpass_values, handle_filter_toggle, RedrawScheduler, handle_threaded_rendering_toggle, \
+    update_theme
 from qtrangeslider import QLabeledDoubleRangeSlider
 from live_visualization import RealTimePlotWindow
 from backend import IMAGES_DIR, DOT_BLACK_PATH, DOT_WHITE_PATH
+from tile_cache import ViewportTileCache
 
 
 class MainWindow(QMainWindow):
@@ -18,6 +20,12 @@ class MainWindow(QMainWindow):
             state_change(self)
         super().changeEvent(event)
 
+    def closeEvent(self, event):
+        canvas = getattr(self, 'canvas', None)
+        if canvas is not None:
+            canvas.stop_rendering()
+        super().closeEvent(event)
+
     def __init__(self):
         super().__init__()
 
@@ -29,9 +37,13 @@ class MainWindow(QMainWindow):
         self.layout = QVBoxLayout()
         self.layout.setAlignment(Qt.AlignTop)
 
+        self.original_data = None
         self.data = None
+        self.display_data = None
         self.current_time_from = None
         self.current_time_to = None
+        self.redraw_scheduler = RedrawScheduler(self)
+        self.tile_cache = ViewportTileCache(self)
 
         self.top_layout = QHBoxLayout()
         self.top_layout.setSpacing(0)
@@ -66,6 +78,15 @@ class MainWindow(QMainWindow):
         self.theme_label = QLabel("Dark Mode")
         self.theme_label.setStyleSheet("font-size: 14px; padding-bottom: 1px;")
 
+        self.threaded_rendering = QCheckBox()
+        self.threaded_rendering.setStyleSheet(self.toggle_theme.styleSheet())
+        self.threaded_rendering.stateChanged.connect(lambda: handle_threaded_rendering_toggle(self))
+
+        self.threaded_rendering_label = QLabel("Background rendering")
+        self.threaded_rendering_label.setStyleSheet("font-size: 14px; padding-bottom: 1px; padding-right: 15px;")
+
+        self.top_layout.addWidget(self.threaded_rendering, alignment=Qt.AlignRight)
+        self.top_layout.addWidget(self.threaded_rendering_label, alignment=Qt.AlignRight)
         self.top_layout.addWidget(self.toggle_theme, alignment=Qt.AlignRight)
         self.top_layout.addWidget(self.theme_label, alignment=Qt.AlignRight)
         self.layout.addLayout(self.top_layout)
@@ -387,7 +408,7 @@ class MainWindow(QMainWindow):
         self.pan_slider.setValue(0)
         self.pan_slider.setEnabled(False)
         self.pan_slider.setFixedWidth(200)
-        self.pan_slider.valueChanged.connect(lambda value: update_pan(self, value))
+        self.pan_slider.valueChanged.connect(self.redraw_scheduler.request_pan)
         self.slider_layout.addWidget(self.pan_slider, alignment=Qt.AlignLeft)
         self.pan_slider.hide()
 
@@ -406,7 +427,7 @@ class MainWindow(QMainWindow):
         self.zoom_slider.setMaximum(100)
         self.zoom_slider.setValue(1)
         self.zoom_slider.setFixedWidth(200)
-        self.zoom_slider.valueChanged.connect(lambda value: update_zoom(self, value))
+        self.zoom_slider.valueChanged.connect(self.redraw_scheduler.request_zoom)
         self.slider_layout.addWidget(self.zoom_slider, alignment=Qt.AlignLeft)
         self.zoom_slider.hide()
 
@@ -605,8 +626,4 @@ class MainWindow(QMainWindow):
                     }
                 """)
 
-        if self.current_time_from is not None and self.current_time_to is not None:
-            filtered_data = self.data[(self.data['time'] >= self.current_time_from) & (self.data['time'] <= self.current_time_to)]
-            update_plot(self, filtered_data)
-        elif self.data is not None:
-            update_plot(self, self.data)
\ No newline at end of file
+        update_theme(self)
\ No newline at end of file
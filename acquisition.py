@@ -0,0 +1,257 @@
+import os
+import time
+import queue
+import itertools
+import collections
+import numpy as np
+import serial
+import tio
+from slip_decoder import SlipDecoder
+from ring_buffer import SharedMemoryRingBuffer, SAMPLE_RECORD
+from streaming_filters import LiveFilterChain, resample_ratio
+from backend import detect_sensor_port
+
+# "thread" runs the sensor session inside the GUI process; "process" moves the session and the
+# streaming filters into a child process that publishes through a shared-memory ring; "asyncio"
+# drives the serial port from one event loop without the TIOSession threads.
+ACQUISITION_MODE = os.environ.get("MKG_ACQUISITION", "thread").lower()
+
+# MKG_SAMPLE_RATE lowers the rate the live pipeline, its filters and recordings run at (the
+# sensor streams SENSOR_RATE). MKG_DECIMATION picks where: "host" (default) streams at full
+# rate and resamples with an anti-aliased polyphase filter, to any rate; "device" has the
+# sensor decimate by the nearest integer factor, which also cuts the serial traffic.
+SENSOR_RATE = 480
+SAMPLE_RATE = float(os.environ.get("MKG_SAMPLE_RATE", SENSOR_RATE))
+DECIMATION_MODE = os.environ.get("MKG_DECIMATION", "host").lower()
+
+STRUCT_TO_NUMPY = {'b': 'i1', 'B': 'u1', 'h': 'i2', 'H': 'u2', 'i': 'i4', 'I': 'u4', 'l': 'i4', 'L': 'u4',
+                   'q': 'i8', 'Q': 'u8', 'e': 'f2', 'f': 'f4', 'd': 'f8'}
+
+
+def device_decimation(sample_rate, source_rate=SENSOR_RATE):
+    return max(1, int(round(source_rate / sample_rate)))
+
+
+def effective_sample_rate(sample_rate=SAMPLE_RATE, decimation=DECIMATION_MODE, source_rate=SENSOR_RATE):
+    # The rate samples actually arrive at for a requested sample_rate.
+    if decimation == "device":
+        return source_rate / device_decimation(sample_rate, source_rate)
+    up, down = resample_ratio(sample_rate, source_rate)
+    return source_rate * up / down
+
+
+def row_dtype(fmt):
+    # TIOProtocol builds one struct code per column ("<fff"), which maps onto a packed numpy record.
+    byte_order = fmt[0] if fmt and fmt[0] in "<>=!" else "<"
+    byte_order = ">" if byte_order == "!" else byte_order
+    codes = fmt[1:] if fmt and fmt[0] in "<>=!@" else fmt
+    try:
+        return np.dtype([(f"c{i}", byte_order + STRUCT_TO_NUMPY[code]) for i, code in enumerate(codes)])
+    except KeyError:
+        return None
+
+
+def drain_queue(pub_queue, timeout=1):
+    # Waits for the first packet, then takes everything else that is queued under a single lock.
+    try:
+        packets = [pub_queue.get(timeout=timeout)]
+    except queue.Empty:
+        return []
+    with pub_queue.mutex:
+        packets.extend(pub_queue.queue)
+        pub_queue.queue.clear()
+        pub_queue.not_full.notify_all()
+    return packets
+
+
+class StreamBlockDecoder:
+    def __init__(self, protocol, stream_type):
+        self.protocol = protocol
+        self.stream_type = stream_type
+        self.dtypes = {}
+
+    def dtype(self, packet_bytes):
+        fmt = self.protocol.rowunpackByBytes.get(packet_bytes)
+        if fmt is None:
+            return None
+        key = (packet_bytes, fmt)
+        if key not in self.dtypes:
+            dtype = row_dtype(fmt)
+            self.dtypes[key] = dtype if dtype is not None and dtype.itemsize == packet_bytes else None
+        return self.dtypes[key]
+
+    def decode(self, packets, column_index):
+        # Returns (times, values) for one column of every stream packet in the batch, in arrival order.
+        packets = [packet for packet in packets if packet["type"] == self.stream_type]
+        if not packets:
+            return np.empty(0), np.empty(0)
+
+        time_blocks = []
+        value_blocks = []
+        for packet_bytes, run in itertools.groupby(packets, key=lambda packet: len(packet["rawdata"])):
+            run = list(run)
+            dtype = self.dtype(packet_bytes)
+            if dtype is None or column_index >= len(dtype.names):
+                continue
+            rows = np.frombuffer(b"".join(packet["rawdata"] for packet in run), dtype=dtype)
+            value_blocks.append(rows[dtype.names[column_index]].astype(np.float64))
+            time_blocks.append(np.fromiter((packet["sampleNumber"] for packet in run), dtype=np.float64, count=len(run)))
+
+        if not value_blocks:
+            return np.empty(0), np.empty(0)
+        stream = self.protocol.streams[0]
+        times = np.concatenate(time_blocks) / stream['stream_Fs'] + stream['stream_start_time_sec']
+        return times, np.concatenate(value_blocks)
+
+
+class SessionClosed(Exception):
+    pass
+
+
+class CustomTIOSession(tio.TIOSession):
+    def __init__(self, *args, **kwargs):
+        # The receive thread starts inside TIOSession.__init__, so the decoder has to exist first.
+        self.slip_decoder = SlipDecoder()
+        self.recv_packets = collections.deque()
+        super().__init__(*args, **kwargs)
+
+    def recv_thread(self):
+        # TIOSession.recv_thread never returns and exits the interpreter on I/O errors;
+        # let it end quietly once shutdown() has been called.
+        try:
+            super().recv_thread()
+        except SessionClosed:
+            pass
+
+    def send_thread(self):
+        try:
+            super().send_thread()
+        except (serial.SerialException, OSError):
+            if self.alive:
+                raise
+
+    def recv_slip_packets(self):
+        # Blocks until at least one frame is complete, then returns every complete frame read so far.
+        while self.alive and self.serial.is_open:
+            try:
+                data = self.serial.read(self.serial.in_waiting or 1)
+            except (serial.SerialException, TypeError, OSError) as e:
+                if not self.alive:
+                    break
+                raise IOError(f"serial error: {e}")
+            else:
+                if data:
+                    errors = self.slip_decoder.errors
+                    packets = self.slip_decoder.feed(data)
+                    if self.slip_decoder.errors != errors:
+                        self.logger.debug(f"Dropped {self.slip_decoder.errors - errors} corrupt SLIP frames")
+                    if self.slip_decoder.pending() > 1000000:
+                        self.warn_overload()
+                    if packets:
+                        return packets
+        raise SessionClosed()
+
+    def recv_slip_packet(self):
+        if not self.recv_packets:
+            self.recv_packets.extend(self.recv_slip_packets())
+        return self.recv_packets.popleft()
+
+    def shutdown(self, timeout=1):
+        self.alive = False
+        try:
+            self.serial.cancel_read()
+        except Exception:
+            pass
+        self.socket_recv_thread.join(timeout)
+        try:
+            if self.serial.is_open:
+                self.serial.close()
+        except Exception as e:
+            print(f"Serial close error: {e}")
+
+
+def open_sensor_session(column="gradient", stream_timeout=5, port=None, decimation=1):
+    # Returns (session, column_index); column_index is None when the sensor is not usable.
+    sensor_port = port or detect_sensor_port()
+    if sensor_port is None:
+        print("Failed to initialise sensor.")
+        return None, None
+    session = CustomTIOSession(url=sensor_port, verbose=False, specialize=False)
+
+    print("Sensor initialised")
+    session.specialize(connectingMessage=True, stateCache=False)
+    wait_start_time = time.time()
+    while not session.protocol.streams:
+        time.sleep(0.1)
+        if time.time() - wait_start_time > stream_timeout:
+            print("Stream info not received in time.")
+            return session, None
+
+    columns = session.protocol.columns
+    if column not in columns:
+        print(f"{column} not in columns:", columns)
+        return session, None
+
+    session.rpc_val(f"{column}.data.decimation", tio.UINT32_T, decimation)
+    # The sensor answers a new decimation with fresh stream metadata; timestamps follow it.
+    expected = round(SENSOR_RATE / decimation)
+    while session.source_rate(column) != expected and time.time() - wait_start_time < stream_timeout:
+        time.sleep(0.05)
+    if session.source_rate(column) != expected:
+        print(f"Sensor streams at {session.source_rate(column)} Hz, expected {expected} Hz")
+    print("Stream ready. Reading data...")
+    return session, columns.index(column)
+
+
+def stream_blocks(session, column_index, stop_event, on_block, on_idle=None, poll_interval=0.1):
+    # Drains the session until stop_event is set; on_block(timestamps, values) gets every decoded block.
+    block_decoder = StreamBlockDecoder(session.protocol, tio.TL_PTYPE_STREAM0)
+    while not stop_event.is_set():
+        try:
+            packets = drain_queue(session.pub_queue, timeout=poll_interval)
+            if on_idle is not None:
+                on_idle()
+            if not packets:
+                continue
+            timestamps, values = block_decoder.decode(packets, column_index)
+            if len(values):
+                on_block(timestamps, values)
+        except Exception as e:
+            print(f"Error in data_loop: {e}")
+
+
+def encode_filter_settings(settings):
+    lowpass, highpass, notch, custom_freq = settings
+    return [int(lowpass), int(highpass), int(notch), custom_freq or 0]
+
+
+def decode_filter_settings(values):
+    lowpass, highpass, notch, custom_freq = values
+    return bool(lowpass), bool(highpass), bool(notch), (custom_freq or None)
+
+
+def acquisition_process(rings, filter_settings, stop_event, index=0, port=None):
+    # Child process entry point for one sensor: sample source plus streaming filters. rings
+    # maps "filtered" and "raw" to the (name, capacity) of SAMPLE_RECORD rings created by the
+    # GUI; the raw one carries every sample with its device timestamp for recording.
+    # Imported here because sample_sources builds on this module.
+    from sample_sources import create_sample_source
+    shared = {key: SharedMemoryRingBuffer(capacity, name=name, create=False, dtype=SAMPLE_RECORD)
+              for key, (name, capacity) in rings.items()}
+    source = create_sample_source(index=index, port=port)
+    filter_chain = LiveFilterChain(effective_sample_rate())
+
+    def publish(timestamps, values):
+        records = np.empty(len(values), dtype=SAMPLE_RECORD)
+        records['time'] = timestamps
+        records['value'] = values
+        shared["raw"].extend(records)
+        shared["filtered"].extend(filter_chain.process_records(records, decode_filter_settings(filter_settings[:])))
+
+    try:
+        if source.open():
+            source.run(stop_event, publish, on_idle=shared["filtered"].beat)
+    finally:
+        source.close()
+        for ring in shared.values():
+            ring.close()
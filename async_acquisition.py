@@ -0,0 +1,236 @@
+import os
+import struct
+import asyncio
+import threading
+import serial
+import slip
+import tio
+from PyQt5.QtCore import QObject, pyqtSignal
+from slip_decoder import SlipDecoder
+from acquisition import SENSOR_RATE, StreamBlockDecoder, device_decimation
+from streaming_filters import PolyphaseResampler, resample_ratio
+
+
+class AsyncSensor:
+    # One TIO device driven from an asyncio loop: serial bytes are read when the port is
+    # readable (add_reader on POSIX, short polling elsewhere), deframed with SlipDecoder and
+    # decoded with TIOProtocol directly, without the TIOSession threads. Iterating the sensor
+    # yields (timestamps, values) blocks for one column, at sample_rate when one is given
+    # (decimated on the device or resampled here, see MKG_DECIMATION).
+
+    def __init__(self, port, column="gradient", max_blocks=256, heartbeat_interval=0.5, poll_interval=0.005,
+                 sample_rate=None, decimation="host"):
+        self.port = port
+        self.column = column
+        self.sample_rate = sample_rate
+        self.decimation = decimation
+        self.resampler = None
+        self.column_index = None
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+        self.protocol = tio.TIOProtocol(routing=[])
+        self.slip_decoder = SlipDecoder()
+        self.block_decoder = StreamBlockDecoder(self.protocol, tio.TL_PTYPE_STREAM0)
+        self.replies = {}
+        self.blocks = asyncio.Queue(maxsize=max_blocks)
+        self.dropped_blocks = 0
+        self.serial = None
+        self.reader_fd = None
+        self.tasks = []
+        self.closed = False
+        self.error = None
+
+    async def open(self, stream_timeout=5):
+        loop = asyncio.get_running_loop()
+        self.serial = serial.Serial(self.port, baudrate=115200, timeout=0)
+        self.serial.reset_input_buffer()
+        if os.name == "posix":
+            self.reader_fd = self.serial.fileno()
+            loop.add_reader(self.reader_fd, self.read_available)
+        else:
+            self.tasks.append(loop.create_task(self.poll_serial()))
+        self.tasks.append(loop.create_task(self.send_heartbeats()))
+
+        await self.rpc("data.send_all")
+        waited = 0
+        while not self.protocol.streams:
+            await asyncio.sleep(0.1)
+            waited += 0.1
+            if waited > stream_timeout:
+                raise IOError("Stream info not received in time.")
+        columns = self.protocol.columns
+        if self.column not in columns:
+            raise IOError(f"{self.column} not in columns: {columns}")
+
+        decimation = 1
+        if self.sample_rate and self.decimation == "device":
+            decimation = device_decimation(self.sample_rate)
+        await self.rpc_val(f"{self.column}.data.decimation", tio.UINT32_T, decimation)
+        # The sensor answers a new decimation with fresh stream metadata; timestamps follow it.
+        expected = round(SENSOR_RATE / decimation)
+        while self.protocol.columnsByName[self.column]['stream_Fs'] != expected and waited <= stream_timeout:
+            await asyncio.sleep(0.05)
+            waited += 0.05
+        source_rate = self.protocol.columnsByName[self.column]['stream_Fs']
+        if self.sample_rate and decimation == 1:
+            up, down = resample_ratio(self.sample_rate, source_rate)
+            if up != down:
+                self.resampler = PolyphaseResampler(up, down)
+        self.column_index = columns.index(self.column)
+
+    def read_available(self):
+        try:
+            data = self.serial.read(self.serial.in_waiting or 1)
+        except (serial.SerialException, OSError) as e:
+            self.fail(e)
+            return
+        if data:
+            self.handle_bytes(data)
+
+    async def poll_serial(self):
+        while True:
+            self.read_available()
+            if not self.serial.in_waiting:
+                await asyncio.sleep(self.poll_interval)
+
+    def handle_bytes(self, data):
+        stream_packets = []
+        for packet in self.slip_decoder.feed(data):
+            parsed = self.protocol.decode_packet(packet)
+            packet_type = parsed['type']
+            if packet_type == tio.TL_PTYPE_STREAM0:
+                stream_packets.append(parsed)
+            elif packet_type == tio.TL_PTYPE_RPC_REP or packet_type == tio.TL_PTYPE_RPC_ERROR:
+                reply = self.replies.pop(parsed['requestid'], None)
+                if reply is not None and not reply.done():
+                    reply.set_result(parsed)
+        if stream_packets and self.column_index is not None:
+            timestamps, values = self.block_decoder.decode(stream_packets, self.column_index)
+            if self.resampler is not None and len(values):
+                timestamps, values = self.resampler.process(timestamps, values)
+            if len(values):
+                self.put_block((timestamps, values))
+
+    def put_block(self, block):
+        # A consumer that falls behind loses the oldest blocks, never the serial port.
+        if self.blocks.full():
+            self.blocks.get_nowait()
+            self.dropped_blocks += 1
+        self.blocks.put_nowait(block)
+
+    def write(self, msg):
+        self.serial.write(slip.encode(bytearray(msg)))
+
+    async def send_heartbeats(self):
+        while True:
+            self.write(self.protocol.heartbeat())
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def rpc(self, topic, payload=None, timeout=3.0):
+        msg, request_id = self.protocol.req(topic, payload)
+        reply = asyncio.get_running_loop().create_future()
+        self.replies[request_id] = reply
+        self.write(msg)
+        try:
+            parsed = await asyncio.wait_for(reply, timeout)
+        finally:
+            self.replies.pop(request_id, None)
+        if parsed['type'] == tio.TL_PTYPE_RPC_ERROR:
+            raise tio.TLRPCException(tio.TL_RPC_ERRORS[parsed['error']])
+        return parsed['payload'] or None
+
+    async def rpc_val(self, topic, rpc_type, value):
+        return await self.rpc(topic, struct.pack("<" + tio.TYPES[rpc_type][0], value))
+
+    def fail(self, error):
+        self.error = error
+        asyncio.get_running_loop().create_task(self.close())
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed and self.blocks.empty():
+            raise StopAsyncIteration
+        block = await self.blocks.get()
+        if block is None:
+            raise StopAsyncIteration
+        return block
+
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.reader_fd is not None:
+            asyncio.get_running_loop().remove_reader(self.reader_fd)
+            self.reader_fd = None
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        for reply in self.replies.values():
+            reply.cancel()
+        if self.serial is not None and self.serial.is_open:
+            self.serial.close()
+        self.put_block(None)
+
+
+class AsyncAcquisition(QObject):
+    # Runs every sensor on one asyncio loop in one background thread. sink(index, timestamps,
+    # values) is called on that thread for each block; lifecycle changes reach Qt as signals.
+    device_started = pyqtSignal(int, str)
+    device_stopped = pyqtSignal(int, str)
+
+    def __init__(self, sink, parent=None):
+        super().__init__(parent)
+        self.sink = sink
+        self.loop = None
+        self.thread = None
+        self.sensors = {}
+        self.runners = []
+
+    def start(self, ports, **sensor_options):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        for index, port in enumerate(ports):
+            self.runners.append(asyncio.run_coroutine_threadsafe(self.run_sensor(index, port, sensor_options), self.loop))
+
+    async def run_sensor(self, index, port, sensor_options):
+        sensor = AsyncSensor(port, **sensor_options)
+        self.sensors[index] = sensor
+        reason = "stopped"
+        try:
+            await sensor.open()
+            self.device_started.emit(index, port)
+            async for timestamps, values in sensor:
+                self.sink(index, timestamps, values)
+            if sensor.error is not None:
+                reason = f"serial error: {sensor.error}"
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            reason = f"error: {e}"
+        finally:
+            await sensor.close()
+            self.device_stopped.emit(index, reason)
+
+    def queue_depth(self):
+        # Decoded blocks waiting for the sink, over all sensors.
+        return sum(sensor.blocks.qsize() for sensor in list(self.sensors.values()))
+
+    async def shutdown(self):
+        await asyncio.gather(*(sensor.close() for sensor in list(self.sensors.values())), return_exceptions=True)
+
+    def stop(self, timeout=2):
+        if self.loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result(timeout)
+            for runner in self.runners:
+                runner.result(timeout)
+        except Exception as e:
+            print(f"Async acquisition shutdown error: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+        self.loop.close()
+        self.loop = None
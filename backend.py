@@ -1,12 +1,14 @@
 import os
 import sys
 import time
+from PyQt5.QtCore import QObject, QTimer
 from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import QVBoxLayout, QFrame, QFileDialog, QApplication
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.figure import Figure
+import numpy as np
 from scipy.signal import butter, filtfilt
 import serial.tools.list_ports
+from plot_backends import create_plot_canvas
+from streaming_filters import MAINS_FILTER, BASELINE_FILTER, BASELINE_WINDOW, PowerlineCanceller, baseline_stage
 
 if getattr(sys, 'frozen', False):
     BASE_DIR = sys._MEIPASS
@@ -19,20 +21,81 @@ DOT_BLACK_PATH = os.path.join(IMAGES_DIR, "dot_black.png").replace("\\", "/")
 DOT_WHITE_PATH = os.path.join(IMAGES_DIR, "dot_white.png").replace("\\", "/")
 
 
-class MplCanvas(FigureCanvas):
-    def __init__(self, parent=None, width=5, height=4, dpi=100):
-        fig = Figure(figsize=(width, height), dpi=dpi)
-        self.axes = fig.add_subplot(111)
-        super().__init__(fig)
-        self.setStyleSheet("background-color: transparent;")
+class RedrawScheduler(QObject):
+    def __init__(self, window):
+        super().__init__(window)
+        self.window = window
+        self.pending_zoom = None
+        self.pending_pan = None
+        self.pending_filters = False
+
+        screen = QApplication.primaryScreen()
+        refresh_rate = screen.refreshRate() if screen else 60
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(max(1, int(1000 / (refresh_rate or 60))))
+        self.timer.timeout.connect(self.flush)
+
+    def request_zoom(self, value):
+        self.pending_zoom = value
+        self.schedule()
+
+    def request_pan(self, value):
+        self.pending_pan = value
+        self.schedule()
+
+    def request_filters(self):
+        self.pending_filters = True
+        self.schedule()
+
+    def schedule(self):
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def cancel(self):
+        self.timer.stop()
+        self.pending_zoom = None
+        self.pending_pan = None
+        self.pending_filters = False
+
+    def flush(self):
+        zoom, pan, filters = self.pending_zoom, self.pending_pan, self.pending_filters
+        self.pending_zoom = None
+        self.pending_pan = None
+        self.pending_filters = False
+
+        window = self.window
+        if window.data is None or window.canvas_frame is None:
+            return
+
+        if filters and refresh_filtered_data(window):
+            update_plot(window, window.data, draw=False)
+        if zoom is not None:
+            update_zoom(window, zoom, draw=False)
+        if pan is not None:
+            update_pan(window, pan, draw=False)
+
+        window.canvas.draw()
+
+
+def handle_threaded_rendering_toggle(window):
+    if window.canvas_frame is not None:
+        window.canvas.set_threaded_rendering(window.threaded_rendering.isChecked())
+
+
+def detect_sensor_ports():
+    # MKG_SENSOR_PORT skips USB detection, e.g. to use the pty opened by sensor_emulator.py;
+    # several ports are separated with os.pathsep.
+    ports = os.environ.get("MKG_SENSOR_PORT")
+    if ports:
+        return ports.split(os.pathsep)
+    return [port.device for port in sorted(serial.tools.list_ports.comports(), key=lambda port: port.device)
+            if port.vid == 0x0483 and port.pid == 0x5740]
 
 
 def detect_sensor_port():
-    ports = serial.tools.list_ports.comports()
-    for port in ports:
-        if port.vid == 0x0483 and port.pid == 0x5740:
-            return port.device
-    return None
+    ports = detect_sensor_ports()
+    return ports[0] if ports else None
 
 
 def state_change(window):
@@ -69,9 +132,9 @@ def show_controls(window):
     window.setFixedSize(1200, 950)
 
 
-def validate_custom_filter(input_field, apply_checkbox):
+def validate_custom_filter(input_field, apply_checkbox, max_freq=230):
     text = input_field.text()
-    if text.isdigit() and 1 <= int(text) <= 230:
+    if text.isdigit() and 1 <= int(text) <= max_freq:
         apply_checkbox.setEnabled(True)
     else:
         apply_checkbox.setEnabled(False)
@@ -136,29 +199,53 @@ def apply_time_range(window):
             pass
 
 
+def data_sample_rate(data, default=480):
+    # Recordings carry their rate in the sample spacing (decimated ones run below 480 Hz).
+    times = data['time'].to_numpy()
+    step = np.median(np.diff(times)) if len(times) > 1 else 0
+    return 1.0 / step if step > 0 else default
+
+
+# Cutoffs in Hz; filters at or above Nyquist leave the data as it is.
 def bandpass_filter(data, lowcut, highcut, fs=480, order=5):
     nyq = 0.5 * fs
     low = lowcut / nyq
-    high = highcut / nyq
+    high = min(highcut / nyq, 0.99)
     b, a = butter(order, [low, high], btype='band')
     y = filtfilt(b, a, data)
     return y
 
 
-def lowpass_filter(data, normal_cutoff=0.5, order=5):
-    b, a = butter(order, normal_cutoff, btype='low', analog=False)
+def lowpass_filter(data, cutoff=120, fs=480, order=5):
+    if cutoff >= 0.5 * fs:
+        return data
+    b, a = butter(order, cutoff, btype='low', analog=False, fs=fs)
     y = filtfilt(b, a, data)
     return y
 
 
-def highpass_filter(data, normal_cutoff=0.04, order=5):
-    b, a = butter(order, normal_cutoff, btype='high', analog=False)
+def highpass_filter(data, cutoff=9.6, fs=480, order=5):
+    b, a = butter(order, cutoff, btype='high', analog=False, fs=fs)
     y = filtfilt(b, a, data)
     return y
 
 
+def baseline_filter(data, method=BASELINE_FILTER, window=BASELINE_WINDOW, fs=480):
+    # Running-window baseline removal over a whole recording, centred on each sample.
+    stage = baseline_stage(method, window, fs)
+    if stage is None:
+        return highpass_filter(data, fs=fs)
+    values = np.asarray(data, dtype=np.float64)
+    if len(values) == 0:
+        return values
+    padded = np.concatenate([values, np.full(stage.delay, values[-1])])
+    return stage.process(padded)[stage.delay:]
+
+
 def notch_filter(data, freq=50, fs=480, bandwidth=5):
     nyq = 0.5 * fs
+    if freq + bandwidth / 2 >= nyq:
+        return data
     low = (freq - bandwidth / 2) / nyq
     high = (freq + bandwidth / 2) / nyq
     b, a = butter(N=2, Wn=[low, high], btype='bandstop')
@@ -166,30 +253,44 @@ def notch_filter(data, freq=50, fs=480, bandwidth=5):
     return y
 
 
-def update_bandpass_filter(window):
+def powerline_filter(data, mains=50, fs=480, harmonics=None):
+    # The chosen mains harmonics in one adaptive pass (see PowerlineCanceller).
+    canceller = PowerlineCanceller(fs, mains, harmonics)
+    if len(canceller.harmonics) == 0:
+        return data
+    values = np.asarray(data, dtype=np.float64)
+    # Fit on the opening seconds run backwards first, so the fit ends at the start of the
+    # recording and the start is cleaned as well.
+    canceller.process(values[:int(5 * canceller.time_constant * fs)][::-1])
+    canceller.reverse()
+    return canceller.process(values)
+
+
+def refresh_filtered_data(window):
+    # window.original_data holds the raw samples, window.data the filtered ones and
+    # window.display_data the part of window.data handed to the plot.
     if not hasattr(window, 'original_data') or window.original_data is None:
         print("No original data available. Filtering is not possible.")
-        return
-    window.filtered_data_no_bandpass = apply_filters(window, window.original_data.copy())
+        return False
+    filtered_data = apply_filters(window, window.original_data.copy())
     if window.bandpass_apply.isChecked():
         lowcut, highcut = window.bandpass_slider.value()
         print(f"Applying bandpass filter: {lowcut}Hz - {highcut}Hz")
-        window.filtered_data_with_bandpass = window.filtered_data_no_bandpass.copy()
-        window.filtered_data_with_bandpass['gradient.B'] = bandpass_filter(window.filtered_data_with_bandpass['gradient.B'], lowcut, highcut)
-        window.data['gradient.B'] = window.filtered_data_with_bandpass['gradient.B']
-    else:
-        window.data['gradient.B'] = window.filtered_data_no_bandpass['gradient.B']
+        filtered_data['gradient.B'] = bandpass_filter(filtered_data['gradient.B'], lowcut, highcut,
+                                                      fs=data_sample_rate(filtered_data))
+    window.data = filtered_data
+    return True
+
 
-    update_plot(window, window.data)
+def update_bandpass_filter(window):
+    if refresh_filtered_data(window):
+        update_plot(window, window.data)
 
 
 def handle_bandpass_apply_toggle(window):
-    if window.bandpass_apply.isChecked():
-        update_bandpass_filter(window)
-    else:
+    if not window.bandpass_apply.isChecked():
         print("Bandpass filter off. Resetting to filtered state without bandpass.")
-        window.data['gradient.B'] = window.filtered_data_no_bandpass['gradient.B']
-        update_plot(window, window.data)
+    window.redraw_scheduler.request_filters()
 
 
 def update_slider_labels(window):
@@ -207,7 +308,7 @@ def update_slider_labels(window):
 
             print(f"Label update error: {e}")
     if window.bandpass_apply.isChecked():
-        update_bandpass_filter(window)
+        window.redraw_scheduler.request_filters()
     else:
         print("Bandpass filter is off. Slider movement will not affect the plot.")
 
@@ -224,31 +325,36 @@ def validate_bandpass_values(window):
 
 
 def apply_filters(window, data):
+    fs = data_sample_rate(data)
     if window.lowpass_filter.isChecked():
         print("Applying Lowpass Filter...")
-        data['gradient.B'] = lowpass_filter(data['gradient.B'])
+        data['gradient.B'] = lowpass_filter(data['gradient.B'], fs=fs)
 
     if window.highpass_filter.isChecked():
-        print("Applying Highpass Filter...")
-        data['gradient.B'] = highpass_filter(data['gradient.B'])
-
-    if window.filter_50hz.isChecked():
-        print("Applying 50Hz Notch Filter...")
-        data['gradient.B'] = notch_filter(data['gradient.B'], freq=50)
-
-    if window.filter_100hz.isChecked():
-        print("Applying 100Hz Notch Filter...")
-        data['gradient.B'] = notch_filter(data['gradient.B'], freq=100)
-
-    if window.filter_150hz.isChecked():
-        print("Applying 150Hz Notch Filter...")
-        data['gradient.B'] = notch_filter(data['gradient.B'], freq=150)
+        if BASELINE_FILTER == "butterworth":
+            print("Applying Highpass Filter...")
+            data['gradient.B'] = highpass_filter(data['gradient.B'], fs=fs)
+        else:
+            print(f"Applying {BASELINE_FILTER} baseline removal ({BASELINE_WINDOW:g} s window)...")
+            data['gradient.B'] = baseline_filter(data['gradient.B'], fs=fs)
+
+    mains_filters = [(1, window.filter_50hz), (2, window.filter_100hz), (3, window.filter_150hz)]
+    if MAINS_FILTER == "adaptive":
+        harmonics = [harmonic for harmonic, checkbox in mains_filters if checkbox.isChecked()]
+        if harmonics:
+            print(f"Applying adaptive mains canceller at {', '.join(f'{50 * k}Hz' for k in harmonics)}...")
+            data['gradient.B'] = powerline_filter(data['gradient.B'], mains=50, fs=fs, harmonics=harmonics)
+    else:
+        for harmonic, checkbox in mains_filters:
+            if checkbox.isChecked():
+                print(f"Applying {50 * harmonic}Hz Notch Filter...")
+                data['gradient.B'] = notch_filter(data['gradient.B'], freq=50 * harmonic, fs=fs)
 
     try:
         custom_freq_1 = int(window.custom_filter_1_input.text())
         if window.custom_filter_1_apply.isChecked() and 1 <= custom_freq_1 <= 230:
             print(f"Applying Custom Filter 1 with freq {custom_freq_1}Hz...")
-            data['gradient.B'] = notch_filter(data['gradient.B'], freq=custom_freq_1)
+            data['gradient.B'] = notch_filter(data['gradient.B'], freq=custom_freq_1, fs=fs)
     except ValueError:
         print("Invalid input for Custom Filter 1.")
 
@@ -256,27 +362,15 @@ def apply_filters(window, data):
         custom_freq_2 = int(window.custom_filter_2_input.text())
         if window.custom_filter_2_apply.isChecked() and 1 <= custom_freq_2 <= 230:
             print(f"Applying Custom Filter 2 with freq {custom_freq_2}Hz...")
-            data['gradient.B'] = notch_filter(data['gradient.B'], freq=custom_freq_2)
+            data['gradient.B'] = notch_filter(data['gradient.B'], freq=custom_freq_2, fs=fs)
     except ValueError:
         print("Invalid input for Custom Filter 2.")
 
     return data
 
 
-def toggle_bandpass_apply_silently(window):
-    if not window.bandpass_apply.isChecked():
-        window.bandpass_apply.setChecked(True)
-        window.bandpass_apply.setChecked(False)
-
-
 def handle_filter_toggle(window, filter_name):
-    if not window.bandpass_apply.isChecked():
-        toggle_bandpass_apply_silently(window)
-
-        window.filtered_data_no_bandpass = apply_filters(window, window.original_data.copy())
-        window.data['gradient.B'] = window.filtered_data_no_bandpass['gradient.B']
-
-    update_plot(window, window.data)
+    window.redraw_scheduler.request_filters()
 
 
 def save_data(window):
@@ -308,12 +402,7 @@ def save_data(window):
         print("No data to be saved.")
         return
 
-    filtered_data = apply_filters(window, window.original_data.copy())
-
-    if window.bandpass_apply.isChecked():
-        lowcut, highcut = window.bandpass_slider.value()
-        print(f"Applying bandpass filter: {lowcut}Hz - {highcut}Hz for saving data.")
-        filtered_data['gradient.B'] = bandpass_filter(filtered_data['gradient.B'], lowcut, highcut)
+    filtered_data = window.data
 
     if window.current_time_from is not None and window.current_time_to is not None:
         filtered_data = filtered_data[(filtered_data['time'] >= window.current_time_from) &
@@ -335,16 +424,16 @@ def save_data(window):
         print(f"Saved filtered data to {xlsx_file_path}")
 
 
-def update_plot(window, data, time_from=None, time_to=None):
+def update_plot(window, data, time_from=None, time_to=None, draw=True):
     if data is not None:
-        filtered_data = apply_filters(window, data.copy())
+        window.display_data = data
 
         if window.current_time_from is None or window.current_time_to is None:
-            window.current_time_from = filtered_data['time'].min()
-            window.current_time_to = filtered_data['time'].max()
+            window.current_time_from = data['time'].min()
+            window.current_time_to = data['time'].max()
 
-        if window.canvas_frame and window.canvas.axes:
-            current_xlim = window.canvas.axes.get_xlim()
+        if window.canvas_frame:
+            current_xlim = window.canvas.get_xlim()
         else:
             current_xlim = None
 
@@ -370,64 +459,49 @@ def update_plot(window, data, time_from=None, time_to=None):
                 """)
 
             layout_canvas = QVBoxLayout()
-            window.canvas = MplCanvas(window.canvas_frame, width=8, height=6, dpi=100)
+            window.canvas = create_plot_canvas(window.canvas_frame, width=8, height=6, dpi=100,
+                                               threaded_rendering=window.threaded_rendering.isChecked())
             layout_canvas.addWidget(window.canvas)
             window.canvas_frame.setLayout(layout_canvas)
             window.canvas_layout.addWidget(window.canvas_frame)
             print("The plot canvas has been created and added to the container")
 
-        window.canvas.figure.clf()
-        window.canvas.axes = window.canvas.figure.add_subplot(111)
-
         if time_from is not None and time_to is not None:
-            window.canvas.axes.set_xlim(time_from, time_to)
+            window.canvas.set_xlim(time_from, time_to)
         elif current_xlim:
-            window.canvas.axes.set_xlim(current_xlim)
+            window.canvas.set_xlim(*current_xlim)
         else:
-            window.canvas.axes.set_xlim(filtered_data['time'].min(), filtered_data['time'].max())
-
-        visible_data = filtered_data[(filtered_data['time'] >= window.canvas.axes.get_xlim()[0]) &
-                                     (filtered_data['time'] <= window.canvas.axes.get_xlim()[1])]
-        if not visible_data.empty:
-            min_y = visible_data['gradient.B'].min()
-            max_y = visible_data['gradient.B'].max()
-            data_range = max_y - min_y
-            window.canvas.axes.set_ylim(min_y - data_range, max_y + data_range)
-
-        if window.toggle_theme.isChecked():
-            window.canvas.axes.set_facecolor('#2c2c2c')
-            window.canvas.figure.patch.set_facecolor('#2c2c2c')
-            window.canvas.axes.spines['bottom'].set_color('white')
-            window.canvas.axes.spines['left'].set_color('white')
-            window.canvas.axes.tick_params(axis='x', colors='white')
-            window.canvas.axes.tick_params(axis='y', colors='white')
-            window.canvas.axes.xaxis.label.set_color('white')
-            window.canvas.axes.yaxis.label.set_color('white')
-            window.canvas.axes.title.set_color('white')
-            line_color = 'cyan'
-        else:
-            window.canvas.axes.set_facecolor('white')
-            window.canvas.figure.patch.set_facecolor('white')
-            window.canvas.axes.spines['bottom'].set_color('black')
-            window.canvas.axes.spines['left'].set_color('black')
-            window.canvas.axes.tick_params(axis='x', colors='black')
-            window.canvas.axes.tick_params(axis='y', colors='black')
-            window.canvas.axes.xaxis.label.set_color('black')
-            window.canvas.axes.yaxis.label.set_color('black')
-            window.canvas.axes.title.set_color('black')
-            line_color = 'blue'
-
-        window.canvas.axes.plot(filtered_data['time'], filtered_data['gradient.B'], label='Gradient B', color=line_color)
-        window.canvas.axes.set_xlabel('Time')
-        window.canvas.axes.set_ylabel('Magnetic Field (B)')
-        window.canvas.axes.set_title('Magnetocardiogram Visualization')
-        window.canvas.axes.legend()
+            window.canvas.set_xlim(data['time'].min(), data['time'].max())
 
-        window.canvas.draw()
+        window.tile_cache.set_signal(data['time'].to_numpy(), data['gradient.B'].to_numpy())
+        show_viewport(window, *window.canvas.get_xlim())
+
+        window.canvas.set_dark_mode(window.toggle_theme.isChecked())
+        window.canvas.set_labels('Time', 'Magnetic Field (B)', title='Magnetocardiogram Visualization', legend='Gradient B')
+
+        if draw:
+            window.canvas.draw()
         print("Plot updated successfully.")
 
 
-def update_zoom(window, value):
+def update_theme(window):
+    if window.canvas_frame is None:
+        return
+    window.canvas.set_dark_mode(window.toggle_theme.isChecked())
+    window.canvas.draw()
+
+
+def show_viewport(window, time_from, time_to):
+    time, values, y_range = window.tile_cache.viewport(time_from, time_to)
+    window.canvas.set_trace(time, values)
+    if y_range is not None:
+        min_y, max_y = y_range
+        data_range = max_y - min_y
+        window.canvas.set_ylim(min_y - data_range, max_y + data_range)
+    return y_range
+
+
+def update_zoom(window, value, draw=True):
     if window.current_time_from is None or window.current_time_to is None:
         return
 
@@ -435,7 +509,7 @@ def update_zoom(window, value):
     data_range = window.current_time_to - window.current_time_from
     visible_range = data_range * zoom_factor
 
-    current_center = (window.canvas.axes.get_xlim()[0] + window.canvas.axes.get_xlim()[1]) / 2.0
+    current_center = (window.canvas.get_xlim()[0] + window.canvas.get_xlim()[1]) / 2.0
 
     new_time_from = current_center - visible_range / 2.0
     new_time_to = current_center + visible_range / 2.0
@@ -443,35 +517,25 @@ def update_zoom(window, value):
     new_time_from = max(new_time_from, window.data['time'].min())
     new_time_to = min(new_time_to, window.data['time'].max())
 
-    window.canvas.axes.set_xlim(new_time_from, new_time_to)
-
-    filtered_data = apply_filters(window, window.data.copy())
-    visible_data = filtered_data[(filtered_data['time'] >= new_time_from) &
-                                 (filtered_data['time'] <= new_time_to)]
-
-    min_y = visible_data['gradient.B'].min()
-    max_y = visible_data['gradient.B'].max()
+    window.canvas.set_xlim(new_time_from, new_time_to)
 
-    if not visible_data.empty:
-        data_range_y = max_y - min_y
-        window.canvas.axes.set_ylim(min_y - data_range_y, max_y + data_range_y)
-
-    print(min_y, max_y)
+    show_viewport(window, new_time_from, new_time_to)
 
     if value < 101:
         window.pan_slider.setEnabled(True)
     else:
         window.pan_slider.setEnabled(False)
 
-    window.canvas.draw()
+    if draw:
+        window.canvas.draw()
 
 
-def update_pan(window, value):
+def update_pan(window, value, draw=True):
     if window.current_time_from is None or window.current_time_to is None:
         return
 
     pan_factor = value / 100.0
-    current_xlim = window.canvas.axes.get_xlim()
+    current_xlim = window.canvas.get_xlim()
     visible_range = current_xlim[1] - current_xlim[0]
     data_range = window.current_time_to - window.current_time_from
 
@@ -479,19 +543,9 @@ def update_pan(window, value):
     new_time_from = window.current_time_from + pan_offset
     new_time_to = new_time_from + visible_range
 
-    window.canvas.axes.set_xlim(new_time_from, new_time_to)
-
-    filtered_data = apply_filters(window, window.data.copy())
-    visible_data = filtered_data[(filtered_data['time'] >= new_time_from) &
-                                 (filtered_data['time'] <= new_time_to)]
+    window.canvas.set_xlim(new_time_from, new_time_to)
 
-    min_y = visible_data['gradient.B'].min()
-    max_y = visible_data['gradient.B'].max()
+    show_viewport(window, new_time_from, new_time_to)
 
-    if not visible_data.empty:
-        data_range_y = max_y - min_y
-        window.canvas.axes.set_ylim(min_y - data_range_y, max_y + data_range_y)
-
-    print(min_y, max_y)
-
-    window.canvas.draw()
\ No newline at end of file
+    if draw:
+        window.canvas.draw()
@@ -0,0 +1,169 @@
+import os
+import json
+import struct
+import binascii
+import numpy as np
+
+# File layout, all little-endian:
+#   FILE_MAGIC, u32 header length, JSON header (sample_rate, channels, start_time, block_samples)
+#   fixed-size blocks: BLOCK_MAGIC, u32 block number, u32 sample count, u32 crc32 of the
+#       records, then block_samples records (time + one float64 per channel, zero padded)
+#   index, written on close: INDEX_MAGIC, u32 block count, one INDEX_ENTRY per block
+#   footer: u64 index offset, FOOTER_MAGIC
+# Blocks are only ever appended whole, so after a crash every block that reached the disk
+# can be validated by its CRC and read back; the index is rebuilt by scanning the blocks.
+FILE_MAGIC = b"MKGREC2\n"
+BLOCK_MAGIC = b"BLK0"
+INDEX_MAGIC = b"IDX0"
+FOOTER_MAGIC = b"MKGEND\n\0"
+FOOTER = struct.Struct("<Q8s")
+INDEX_ENTRY = np.dtype([('offset', '<u8'), ('count', '<u4'), ('first_time', '<f8')])
+
+
+def record_dtype(channels):
+    return np.dtype([('time', '<f8')] + [(channel, '<f8') for channel in channels])
+
+
+def block_dtype(header):
+    return np.dtype([('magic', 'S4'), ('number', '<u4'), ('count', '<u4'), ('crc', '<u4'),
+                     ('records', record_dtype(header['channels']), (header['block_samples'],))])
+
+
+def is_chunked_recording(file_path):
+    with open(file_path, 'rb') as file:
+        return file.read(len(FILE_MAGIC)) == FILE_MAGIC
+
+
+def read_header(file_path):
+    with open(file_path, 'rb') as file:
+        if file.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            raise ValueError("Not a chunked recording.")
+        header_length, = struct.unpack("<I", file.read(4))
+        header = json.loads(file.read(header_length).decode("utf-8"))
+    return header, len(FILE_MAGIC) + 4 + header_length
+
+
+class ChunkedRecordingWriter:
+    def __init__(self, path, sample_rate, channels, start_time, block_samples=512):
+        self.header = {'sample_rate': sample_rate, 'channels': list(channels),
+                       'start_time': start_time, 'block_samples': block_samples}
+        self.dtype = block_dtype(self.header)
+        self.block = np.zeros(1, dtype=self.dtype)
+        self.records = self.block['records'][0]
+        self.filled = 0
+        self.index = []
+        self.file = open(path, "wb")
+        encoded = json.dumps(self.header).encode("utf-8")
+        self.file.write(FILE_MAGIC + struct.pack("<I", len(encoded)) + encoded)
+
+    def append(self, records):
+        # records: structured array with 'time' and one field per channel.
+        position = 0
+        while position < len(records):
+            take = min(len(records) - position, len(self.records) - self.filled)
+            self.records[self.filled:self.filled + take] = records[position:position + take]
+            self.filled += take
+            position += take
+            if self.filled == len(self.records):
+                self.write_block()
+
+    def write_block(self):
+        block = self.block[0]
+        block['magic'] = BLOCK_MAGIC
+        block['number'] = len(self.index)
+        block['count'] = self.filled
+        self.records[self.filled:] = 0
+        block['crc'] = binascii.crc32(self.records.tobytes())
+        self.index.append((self.file.tell(), self.filled, self.records['time'][0]))
+        self.file.write(self.block.tobytes())
+        self.filled = 0
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.filled:
+            self.write_block()
+        index_offset = self.file.tell()
+        self.file.write(INDEX_MAGIC + struct.pack("<I", len(self.index)))
+        self.file.write(np.array(self.index, dtype=INDEX_ENTRY).tobytes())
+        self.file.write(FOOTER.pack(index_offset, FOOTER_MAGIC))
+        self.file.close()
+
+
+def read_index(file_path, data_offset, dtype):
+    size = os.path.getsize(file_path)
+    if size < data_offset + FOOTER.size:
+        return None
+    with open(file_path, 'rb') as file:
+        file.seek(size - FOOTER.size)
+        index_offset, magic = FOOTER.unpack(file.read(FOOTER.size))
+        if magic != FOOTER_MAGIC or index_offset < data_offset or (index_offset - data_offset) % dtype.itemsize:
+            return None
+        file.seek(index_offset)
+        if file.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+            return None
+        count, = struct.unpack("<I", file.read(4))
+        index = np.frombuffer(file.read(count * INDEX_ENTRY.itemsize), dtype=INDEX_ENTRY)
+    if len(index) != count or index_offset != data_offset + count * dtype.itemsize:
+        return None
+    return index
+
+
+def rebuild_index(file_path, data_offset, dtype):
+    # Walks the blocks from the start and stops at the first one that is torn or corrupt.
+    block_count = (os.path.getsize(file_path) - data_offset) // dtype.itemsize
+    if block_count == 0:
+        return np.empty(0, dtype=INDEX_ENTRY)
+    blocks = np.memmap(file_path, dtype=dtype, mode='r', offset=data_offset, shape=(block_count,))
+    entries = []
+    for number in range(block_count):
+        block = blocks[number]
+        records = block['records']
+        if (block['magic'] != BLOCK_MAGIC or block['number'] != number or block['count'] > len(records)
+                or binascii.crc32(records.tobytes()) != block['crc']):
+            break
+        entries.append((data_offset + number * dtype.itemsize, block['count'], records['time'][0]))
+    return np.array(entries, dtype=INDEX_ENTRY)
+
+
+def open_recording(file_path):
+    # Returns (header, blocks, index): blocks is a read-only memmap of the valid blocks and
+    # index holds their offsets, sample counts and first timestamps. Files without a valid
+    # index (still being written, or left behind by a crash) are recovered by rebuild_index.
+    header, data_offset = read_header(file_path)
+    dtype = block_dtype(header)
+    index = read_index(file_path, data_offset, dtype)
+    if index is None:
+        index = rebuild_index(file_path, data_offset, dtype)
+    if len(index) == 0:
+        return header, np.empty(0, dtype=dtype), index
+    blocks = np.memmap(file_path, dtype=dtype, mode='r', offset=data_offset, shape=(len(index),))
+    return header, blocks, index
+
+
+def block_records(blocks, index):
+    # Flattens blocks into one record array, dropping the padding of partially filled blocks.
+    if len(blocks) == 0:
+        return np.empty(0, dtype=blocks.dtype['records'].base)
+    records = blocks['records']
+    filled = np.arange(records.shape[1]) < index['count'][:, None]
+    return records[filled]
+
+
+def repair_recording(file_path):
+    # Truncates a crashed recording after its last complete block and writes a fresh index
+    # (recording.recover_recording, for the .part files StreamRecorder leaves behind).
+    header, data_offset = read_header(file_path)
+    dtype = block_dtype(header)
+    if read_index(file_path, data_offset, dtype) is not None:
+        return
+    index = rebuild_index(file_path, data_offset, dtype)
+    index_offset = data_offset + len(index) * dtype.itemsize
+    with open(file_path, 'r+b') as file:
+        file.truncate(index_offset)
+        file.seek(index_offset)
+        file.write(INDEX_MAGIC + struct.pack("<I", len(index)))
+        file.write(index.tobytes())
+        file.write(FOOTER.pack(index_offset, FOOTER_MAGIC))
@@ -1,12 +1,18 @@
 import pandas as pd
 from PyQt5.QtWidgets import QFileDialog, QMessageBox
-from backend import update_plot, update_zoom, update_pan
+from backend import update_plot, update_zoom, update_pan, refresh_filtered_data
+from recording import is_binary_recording, load_binary_recording
 
 
 def load_data(file_path):
     try:
         print(f"Loading data from {file_path}...")
 
+        if is_binary_recording(file_path):
+            data = load_binary_recording(file_path)
+            print("Data loaded successfully.")
+            return data
+
         encoding = "Windows-1250"
         print(f"Using file encoding: {encoding}")
 
@@ -47,7 +53,7 @@ def load_data(file_path):
             data.columns = [col.strip().capitalize() for col in data.columns]
 
             expected_columns = ['Time', 'Value']
-            if list(data.columns) != expected_columns:
+            if list(data.columns[:2]) != expected_columns:
                 raise ValueError(
                     f"Incorrect file format. Headers expected:  {expected_columns}, found: {list(data.columns)}.")
 
@@ -130,16 +136,17 @@ def load_and_plot_file(window):
                 window.reset_controls_to_default()
                 data = aggregate_duplicate_timestamps(data, time_column='time', value_column='gradient.B', method='mean')
 
-                window.original_data = data.copy()
-                window.data = data
+                window.original_data = data
+                refresh_filtered_data(window)
 
                 window.current_time_from = None
                 window.current_time_to = None
 
-                update_plot(window, data)
+                update_plot(window, window.data)
 
                 update_zoom(window, 1)
                 update_pan(window, 50)
+                window.redraw_scheduler.cancel()
                 window.show_controls()
             else:
                 QMessageBox.warning(window, "Warning", "Failed to load data from the file. Please check the file format.")
@@ -0,0 +1,232 @@
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import struct
+import threading
+import numpy as np
+from ring_buffer import SAMPLE_RECORD
+
+# MKG_FANOUT publishes the live samples to local subscribers: "unix:<path>", "tcp:<port>"
+# (loopback) or "tcp:<host>:<port>"; a bare path or port number works too. Empty disables it.
+FANOUT_ADDRESS = os.environ.get("MKG_FANOUT", "")
+
+# Stream layout, little-endian: HELLO_MAGIC, u32 header length, JSON header (sample_rate,
+# channels), then one frame per block: u16 channel index, u16 reserved, u32 sample count,
+# followed by that many SAMPLE_RECORD records (f8 device timestamp, f8 raw value).
+HELLO_MAGIC = b"MKGFAN1\n"
+FRAME = struct.Struct("<HHI")
+
+
+def parse_address(address):
+    # Returns (family, address) for socket.socket / bind / connect.
+    address = str(address)
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[5:]
+    if address.startswith("tcp:"):
+        address = address[4:]
+    elif not address.isdigit():
+        return socket.AF_UNIX, address
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def encode_frame(channel, timestamps, values):
+    records = np.empty(len(values), dtype=SAMPLE_RECORD)
+    records['time'] = timestamps
+    records['value'] = values
+    return FRAME.pack(channel, 0, len(records)) + records.tobytes()
+
+
+def receive_exactly(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    while view:
+        received = sock.recv_into(view)
+        if received == 0:
+            return None
+        view = view[received:]
+    return bytes(buffer)
+
+
+class FanoutClient:
+    # One subscriber: frames wait in a bounded queue and a sender thread writes them out,
+    # so a subscriber that stops reading only ever blocks its own thread.
+
+    def __init__(self, server, sock, name, max_frames):
+        self.server = server
+        self.socket = sock
+        self.name = name
+        self.frames = queue.Queue(max_frames)
+        self.closed = False
+        self.thread = threading.Thread(target=self.send_loop, daemon=True)
+
+    def send_loop(self):
+        try:
+            while not self.closed:
+                frame = self.frames.get()
+                if frame is None:
+                    break
+                self.socket.sendall(frame)
+        except OSError:
+            pass
+        self.server.remove(self, "disconnected")
+
+    def offer(self, frame):
+        try:
+            self.frames.put_nowait(frame)
+            return True
+        except queue.Full:
+            return False
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            # Wakes a sender stuck in sendall; a sender waiting for frames gets the None.
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.offer(None)
+        self.socket.close()
+
+
+class FanoutServer:
+    # Publishes sample blocks to any number of local subscribers without touching the
+    # acquisition: publish() encodes each block once and only queues it; a subscriber whose
+    # queue is full (max_frames blocks behind) is dropped rather than waited for.
+
+    def __init__(self, address, sample_rate, channels, max_frames=1024):
+        self.family, self.address = parse_address(address)
+        self.max_frames = max_frames
+        header = json.dumps({'sample_rate': sample_rate, 'channels': list(channels)}).encode("utf-8")
+        self.hello = HELLO_MAGIC + struct.pack("<I", len(header)) + header
+        self.clients = []
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.socket = socket.socket(self.family, socket.SOCK_STREAM)
+        if self.family == socket.AF_UNIX:
+            if os.path.exists(self.address):
+                os.remove(self.address)
+        else:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(self.address)
+        self.socket.listen()
+        self.socket.settimeout(0.2)
+        self.accept_thread = threading.Thread(target=self.accept_loop, daemon=True)
+
+    def start(self):
+        self.accept_thread.start()
+        print(f"Publishing live samples on {self.describe()}")
+
+    def describe(self):
+        if self.family == socket.AF_UNIX:
+            return f"unix:{self.address}"
+        host, port = self.socket.getsockname()[:2]
+        return f"tcp:{host}:{port}"
+
+    def accept_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                sock, peer = self.socket.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            sock.settimeout(None)
+            name = f"{peer[0]}:{peer[1]}" if isinstance(peer, tuple) else "(unix socket)"
+            client = FanoutClient(self, sock, name, self.max_frames)
+            client.offer(self.hello)
+            with self.lock:
+                self.clients.append(client)
+            client.thread.start()
+            print(f"Fan-out subscriber connected: {client.name}")
+
+    def publish(self, channel, timestamps, values):
+        # Safe to call from several acquisition threads at once.
+        if not self.clients:
+            return
+        frame = encode_frame(channel, timestamps, values)
+        for client in list(self.clients):
+            if not client.offer(frame):
+                self.remove(client, f"dropped, more than {self.max_frames} blocks behind")
+
+    def remove(self, client, reason):
+        with self.lock:
+            if client not in self.clients:
+                return
+            self.clients.remove(client)
+        client.close()
+        if not self.stop_event.is_set():
+            print(f"Fan-out subscriber {client.name} {reason}")
+
+    def close(self):
+        self.stop_event.set()
+        self.accept_thread.join(1)
+        self.socket.close()
+        for client in list(self.clients):
+            self.remove(client, "closed")
+        if self.family == socket.AF_UNIX and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+class FanoutSubscriber:
+    # Client side: connects, reads the header (sample_rate, channels), then read_block()
+    # returns (channel, records) per published block, None once the server has gone.
+
+    def __init__(self, address, timeout=5):
+        family, address = parse_address(address)
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(address)
+        if receive_exactly(self.socket, len(HELLO_MAGIC)) != HELLO_MAGIC:
+            raise IOError("Not a fan-out stream.")
+        header_length, = struct.unpack("<I", receive_exactly(self.socket, 4))
+        self.header = json.loads(receive_exactly(self.socket, header_length).decode("utf-8"))
+        self.sample_rate = self.header['sample_rate']
+        self.channels = self.header['channels']
+        self.socket.settimeout(None)
+
+    def read_block(self):
+        head = receive_exactly(self.socket, FRAME.size)
+        if head is None:
+            return None
+        channel, _, count = FRAME.unpack(head)
+        data = receive_exactly(self.socket, count * SAMPLE_RECORD.itemsize)
+        if data is None:
+            return None
+        return channel, np.frombuffer(data, dtype=SAMPLE_RECORD)
+
+    def __iter__(self):
+        while True:
+            block = self.read_block()
+            if block is None:
+                return
+            yield block
+
+    def close(self):
+        self.socket.close()
+
+
+if __name__ == "__main__":
+    # python fanout.py [address]: subscribes and prints the per-channel sample rate every second.
+    address = sys.argv[1] if len(sys.argv) > 1 else FANOUT_ADDRESS
+    if not address:
+        sys.exit("Usage: python fanout.py <address> (or set MKG_FANOUT)")
+    subscriber = FanoutSubscriber(address)
+    print(f"Subscribed: {len(subscriber.channels)} channel(s) at {subscriber.sample_rate:g} Hz")
+    counts = [0] * len(subscriber.channels)
+    reported = time.monotonic()
+    try:
+        for channel, records in subscriber:
+            counts[channel] += len(records)
+            if time.monotonic() - reported >= 1:
+                reported = time.monotonic()
+                print("  ".join(f"{name}: {count}" for name, count in zip(subscriber.channels, counts)))
+                counts = [0] * len(subscriber.channels)
+    except KeyboardInterrupt:
+        pass
+    subscriber.close()
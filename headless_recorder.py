@@ -0,0 +1,228 @@
+import os
+import sys
+import time
+import signal
+import argparse
+import datetime
+import threading
+from acquisition import SAMPLE_RATE, DECIMATION_MODE, effective_sample_rate
+from sample_sources import SAMPLE_SOURCE, SOURCE_SPEED, create_sample_source, sample_source_ports
+from recording import StreamRecorder
+from fanout import FANOUT_ADDRESS, FanoutServer
+
+
+class RotatingRecorder:
+    # Records one sensor as a series of files, starting the next one every rotate_seconds or
+    # once the file being written passes rotate_bytes, whichever comes first. Blocks go to
+    # exactly one file, so consecutive files join up without gaps. Finished files are closed
+    # (and exported, for CSV) on their own thread while acquisition carries on.
+
+    def __init__(self, directory, name, binary=True, sample_rate=480, rotate_seconds=None, rotate_bytes=None):
+        self.directory = directory
+        self.name = name
+        self.binary = binary
+        self.sample_rate = sample_rate
+        self.rotate_seconds = rotate_seconds
+        self.rotate_bytes = rotate_bytes
+        self.recorder = None
+        self.opened = 0
+        self.last_size_check = 0
+        self.files = 0
+        self.samples = 0
+        self.finishers = []
+
+    def open(self):
+        stamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        path = os.path.join(self.directory, f"{stamp}_{self.name}{'.mkgb' if self.binary else '.csv'}")
+        if self.recorder is not None and os.path.abspath(path) == os.path.abspath(self.recorder.path):
+            path = path.replace(stamp, stamp + f"_{self.files}")
+        self.recorder = StreamRecorder(path, binary=self.binary, sample_rate=self.sample_rate)
+        self.recorder.start()
+        self.opened = time.monotonic()
+        self.files += 1
+        print(f"Recording {self.name} to {path}")
+
+    def write(self, timestamps, values):
+        if self.due():
+            self.rotate()
+        self.recorder.write(timestamps, values)
+        self.samples += len(values)
+
+    def due(self):
+        now = time.monotonic()
+        if self.rotate_seconds and now - self.opened >= self.rotate_seconds:
+            return True
+        # The size is that of the binary capture (a CSV export comes out about twice as large);
+        # stat it at most once a second.
+        if self.rotate_bytes and now - self.last_size_check >= 1:
+            self.last_size_check = now
+            try:
+                return os.path.getsize(self.recorder.temp_path) >= self.rotate_bytes
+            except OSError:
+                return False
+        return False
+
+    def rotate(self):
+        finished = self.recorder
+        self.open()
+        self.finish(finished)
+
+    def finish(self, recorder):
+        # Not a daemon thread, so a CSV export still running at exit completes first.
+        finisher = threading.Thread(target=finish_recording, args=(recorder,))
+        finisher.start()
+        self.finishers = [thread for thread in self.finishers if thread.is_alive()] + [finisher]
+
+    def close(self):
+        if self.recorder is not None:
+            self.finish(self.recorder)
+            self.recorder = None
+        for finisher in self.finishers:
+            finisher.join()
+
+
+def finish_recording(recorder):
+    try:
+        file_path = recorder.stop()
+    except Exception as e:
+        print(f"Recording error: {e}")
+        return
+    print(f"Closed {file_path} ({recorder.samples_written} samples)")
+
+
+class HeadlessRecorder:
+    # The acquisition of the live view without the view: one source thread per sensor feeding
+    # a RotatingRecorder (and the fan-out server, if one is configured). No filtering or
+    # drawing happens here, so the process mostly sleeps in the sources' waits.
+
+    def __init__(self, directory, spec=None, channels=None, speed=None, sample_rate=None, decimation=None,
+                 binary=True, rotate_seconds=None, rotate_bytes=None, fanout_address=None):
+        self.spec = SAMPLE_SOURCE if spec is None else spec
+        self.speed = SOURCE_SPEED if speed is None else speed
+        self.requested_rate = SAMPLE_RATE if sample_rate is None else sample_rate
+        self.decimation = DECIMATION_MODE if decimation is None else decimation
+        self.sample_rate = effective_sample_rate(self.requested_rate, self.decimation)
+        self.ports = sample_source_ports(self.spec, channels)
+        self.names = [f"sensor{index + 1}" for index in range(len(self.ports))]
+        os.makedirs(directory, exist_ok=True)
+        self.recorders = [RotatingRecorder(directory, name, binary, self.sample_rate, rotate_seconds, rotate_bytes)
+                          for name in self.names]
+        self.fanout_address = fanout_address
+        self.fanout = None
+        self.sources = [None] * len(self.ports)
+        self.threads = []
+        self.stop_event = threading.Event()
+
+    def start(self):
+        if not self.ports:
+            print("Failed to initialise sensor.")
+            return False
+        if self.fanout_address:
+            self.fanout = FanoutServer(self.fanout_address, self.sample_rate, self.names)
+            self.fanout.start()
+        for recorder in self.recorders:
+            recorder.open()
+        for index, port in enumerate(self.ports):
+            thread = threading.Thread(target=self.data_loop, args=(index, port), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return True
+
+    def data_loop(self, index, port):
+        source = create_sample_source(self.spec, self.speed, index=index, port=port,
+                                      sample_rate=self.requested_rate, decimation=self.decimation)
+        self.sources[index] = source
+        recorder = self.recorders[index]
+
+        def on_block(timestamps, values):
+            recorder.write(timestamps, values)
+            if self.fanout is not None:
+                self.fanout.publish(index, timestamps, values)
+
+        try:
+            if source.open():
+                source.run(self.stop_event, on_block)
+        except Exception as e:
+            print(f"{self.names[index]}: {e}")
+        finally:
+            source.close()
+            print(f"{self.names[index]}: acquisition ended")
+
+    def running(self):
+        return any(thread.is_alive() for thread in self.threads)
+
+    def status(self):
+        return "  ".join(f"{recorder.name}: {recorder.samples} samples, file {recorder.files}"
+                         for recorder in self.recorders)
+
+    def stop(self):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join(timeout=5)
+        for source in self.sources:
+            if source is not None:
+                source.close()
+        for recorder in self.recorders:
+            recorder.close()
+        if self.fanout is not None:
+            self.fanout.close()
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Record the sensor(s) straight to disk without the live view; stops cleanly on "
+                    "Ctrl+C or SIGTERM.")
+    parser.add_argument("--output", default="recordings", help="directory for the recordings (default: %(default)s)")
+    parser.add_argument("--csv", action="store_true", help="write CSV instead of binary .mkgb files")
+    parser.add_argument("--rotate-minutes", type=float, help="start a new file after this many minutes")
+    parser.add_argument("--rotate-mb", type=float, help="start a new file once the current one reaches this size")
+    parser.add_argument("--duration", type=float, help="stop after this many seconds")
+    parser.add_argument("--source", help="sensor, synthetic, pty:<source> or a file to replay (default: MKG_SOURCE)")
+    parser.add_argument("--channels", type=int, help="simulated sensors to record (default: MKG_SOURCE_CHANNELS)")
+    parser.add_argument("--speed", type=float, help="replay/simulation speed (default: MKG_SOURCE_SPEED)")
+    parser.add_argument("--sample-rate", type=float, help="recording rate in Hz (default: MKG_SAMPLE_RATE)")
+    parser.add_argument("--decimation", choices=("host", "device"), help="where the rate is reduced (default: MKG_DECIMATION)")
+    parser.add_argument("--fanout", default=FANOUT_ADDRESS or None, help="also publish the samples on this address (default: MKG_FANOUT)")
+    parser.add_argument("--status-interval", type=float, default=60, help="seconds between status lines (default: %(default)s)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    recorder = HeadlessRecorder(
+        args.output, spec=args.source, channels=args.channels, speed=args.speed, sample_rate=args.sample_rate,
+        decimation=args.decimation, binary=not args.csv,
+        rotate_seconds=args.rotate_minutes * 60 if args.rotate_minutes else None,
+        rotate_bytes=args.rotate_mb * 1e6 if args.rotate_mb else None, fanout_address=args.fanout)
+
+    def request_stop(signum, frame):
+        print(f"Signal {signum} received, stopping.")
+        recorder.stop_event.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    if hasattr(signal, "SIGBREAK"):
+        signal.signal(signal.SIGBREAK, request_stop)
+
+    if not recorder.start():
+        return 1
+    started = time.monotonic()
+    last_status = started
+    # Short waits keep the main thread responsive to signals.
+    while not recorder.stop_event.wait(0.5):
+        now = time.monotonic()
+        if args.duration and now - started >= args.duration:
+            break
+        if not recorder.running():
+            print("All sources have stopped.")
+            break
+        if now - last_status >= args.status_interval:
+            last_status = now
+            print(recorder.status())
+    recorder.stop()
+    print(recorder.status())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+import os
+import numpy as np
+from ring_buffer import SampleRingBuffer, SAMPLE_RECORD
+
+# How far back the live view can scroll (and zoom out to), in minutes.
+HISTORY_MINUTES = float(os.environ.get("MKG_HISTORY_MINUTES", "60"))
+
+# A decimated history entry: the first timestamp of the bucket and the extremes within it.
+BUCKET_RECORD = np.dtype([('time', '<f8'), ('low', '<f8'), ('high', '<f8')])
+
+
+class SampleHistory:
+    # Multi-resolution history of one stream for scrolling back and zooming out. Level 0
+    # keeps the newest level_points samples at full rate; every further level folds factor
+    # entries of the level below into one min/max bucket, so it reaches factor times as far
+    # back in the same space. Levels are added until the whole history fits, and each is a
+    # fixed ring, so memory stays bounded however long the session runs (about 3 MB per
+    # stream for an hour at 480 Hz). Min/max buckets keep spikes visible at every zoom.
+
+    def __init__(self, sample_rate, minutes=HISTORY_MINUTES, level_points=32768, factor=16):
+        self.sample_rate = sample_rate
+        self.factor = factor
+        needed = int(np.ceil(minutes * 60 * sample_rate))
+        self.levels = [SampleRingBuffer(min(level_points, max(needed, 1)), dtype=SAMPLE_RECORD)]
+        self.bucket_sizes = [1]
+        while self.levels[-1].capacity * self.bucket_sizes[-1] < needed:
+            size = self.bucket_sizes[-1] * factor
+            self.levels.append(SampleRingBuffer(min(level_points, -(-needed // size)), dtype=BUCKET_RECORD))
+            self.bucket_sizes.append(size)
+        # Entries of each level waiting for a full bucket of the next one.
+        self.pending = [np.empty(0, dtype=level.data.dtype) for level in self.levels[:-1]]
+
+    def append(self, records):
+        if len(records) == 0:
+            return
+        self.levels[0].extend(records)
+        entries = records
+        for level in range(1, len(self.levels)):
+            entries = np.concatenate([self.pending[level - 1], entries])
+            complete = len(entries) - len(entries) % self.factor
+            self.pending[level - 1] = entries[complete:].copy()
+            if complete == 0:
+                break
+            groups = entries[:complete].reshape(-1, self.factor)
+            buckets = np.empty(len(groups), dtype=BUCKET_RECORD)
+            buckets['time'] = groups['time'][:, 0]
+            if level == 1:
+                buckets['low'] = groups['value'].min(axis=1)
+                buckets['high'] = groups['value'].max(axis=1)
+            else:
+                buckets['low'] = groups['low'].min(axis=1)
+                buckets['high'] = groups['high'].max(axis=1)
+            self.levels[level].extend(buckets)
+            entries = buckets
+
+    def time_range(self):
+        # (oldest, newest) timestamp held, or None while empty.
+        newest = self.levels[0].latest(1)
+        if len(newest) == 0:
+            return None
+        for level in reversed(self.levels):
+            if len(level):
+                return level.latest(len(level))['time'][0], newest['time'][0]
+
+    def window(self, start, end, max_points=4000):
+        # (times, values) between start and end from the finest level that still reaches
+        # back to start within max_points; buckets come out as min/max pairs.
+        span = max(end - start, 0)
+        chosen = None
+        for index, level in enumerate(self.levels):
+            # A coarser level still empty (early in a session) never beats a finer one with data.
+            if len(level) == 0:
+                break
+            chosen = index, level.latest(len(level))
+            # A level that is not full yet holds everything since the start of the session.
+            complete = len(level) < level.capacity or chosen[1]['time'][0] <= start
+            points = span * self.sample_rate / self.bucket_sizes[index] * (1 if index == 0 else 2)
+            if complete and points <= max_points:
+                break
+        if chosen is None:
+            return np.empty(0), np.empty(0)
+        index, entries = chosen
+        # One entry either side, so the trace runs up to the edges of the view.
+        first, stop = np.searchsorted(entries['time'], (start, end))
+        entries = entries[max(first - 1, 0):stop + 1]
+        if index == 0:
+            return entries['time'], entries['value']
+        if 2 * len(entries) > max_points:
+            # Wider than the coarsest level holds at this size: fold neighbouring buckets.
+            starts = np.linspace(0, len(entries), max_points // 2, endpoint=False).astype(np.int64)
+            low = np.minimum.reduceat(entries['low'], starts)
+            high = np.maximum.reduceat(entries['high'], starts)
+            return np.repeat(entries['time'][starts], 2), np.column_stack((low, high)).ravel()
+        return np.repeat(entries['time'], 2), np.column_stack((entries['low'], entries['high'])).ravel()
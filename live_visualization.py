@@ -2,21 +2,27 @@ import os
 import sys
 from PyQt5.QtGui import QIntValidator, QIcon
 from PyQt5.QtWidgets import QMainWindow, QVBoxLayout, QWidget, QFileDialog, QPushButton, QHBoxLayout, QCheckBox, QLabel, \
-    QSizePolicy, QFrame, QLineEdit
+    QSizePolicy, QFrame, QLineEdit, QSlider
 from PyQt5.QtCore import QTimer, Qt, pyqtSignal, QObject, QThreadPool, QEvent
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.figure import Figure
 import numpy as np
 import threading
 import time
 import subprocess
 import datetime
-import queue
-import tio
-import slip
-import serial
-from backend import lowpass_filter, highpass_filter, notch_filter, validate_custom_filter, state_change, detect_sensor_port, IMAGES_DIR, DOT_BLACK_PATH, DOT_WHITE_PATH
-from collections import deque
+import multiprocessing
+from backend import validate_custom_filter, state_change, IMAGES_DIR, DOT_BLACK_PATH, DOT_WHITE_PATH
+from plot_backends import create_plot_canvas
+from ring_buffer import SampleRingBuffer, SharedMemoryRingBuffer, SAMPLE_RECORD
+from streaming_filters import LiveFilterChain
+from acquisition import ACQUISITION_MODE, SAMPLE_RATE, DECIMATION_MODE, acquisition_process, encode_filter_settings, \
+    effective_sample_rate
+from sample_sources import SAMPLE_SOURCE, create_sample_source, sample_source_ports
+from async_acquisition import AsyncAcquisition
+from recording import StreamRecorder
+from telemetry import PipelineTelemetry, format_telemetry
+from fanout import FANOUT_ADDRESS, FanoutServer
+from history import SampleHistory, HISTORY_MINUTES
+from spectrum import SpectrumPanel
 
 if getattr(sys, 'frozen', False):
     BASE_DIR = sys._MEIPASS
@@ -25,30 +31,8 @@ else:
 
 DEVCON_PATH = os.path.join(BASE_DIR, "devcon.exe").replace("\\", "/")
 
-
-class CustomTIOSession(tio.TIOSession):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.recv_buffer = bytearray()
-
-    def recv_slip_packet(self):
-        while self.alive and self.serial.is_open:
-            try:
-                data = self.serial.read(self.serial.in_waiting or 1)
-            except serial.SerialException as e:
-                raise IOError(f"serial error: {e}")
-            else:
-                if data:
-                    self.buffer.extend(data)
-                    if len(self.buffer) > 1000000:
-                        self.warn_overload()
-                    while slip.SLIP_END_CHAR in self.buffer:
-                        packet, self.buffer = self.buffer.split(slip.SLIP_END_CHAR, 1)
-                        try:
-                            return slip.decode(packet)
-                        except slip.SLIPEncodingError as error:
-                            self.logger.debug(error)
-                            return b""
+# Spans the live view can zoom out to, in seconds; the first is the live window itself.
+VIEW_SPANS = [span for span in (2, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600) if span <= HISTORY_MINUTES * 60]
 
 
 class RealTimePlotWindow(QMainWindow):
@@ -104,6 +88,12 @@ class RealTimePlotWindow(QMainWindow):
         self.dark_mode_layout = QHBoxLayout()
         self.dark_mode_layout.setContentsMargins(0, 0, 0, 20)
         self.dark_mode_layout.setSpacing(0)
+        self.dropped_label = QLabel("Dropped samples: 0")
+        self.dropped_label.setStyleSheet("font-size: 14px; padding: 0px;")
+        self.dark_mode_layout.addWidget(self.dropped_label, alignment=Qt.AlignLeft)
+        self.acquisition_label = QLabel("")
+        self.acquisition_label.setStyleSheet("font-size: 14px; padding: 0px 0px 0px 20px;")
+        self.dark_mode_layout.addWidget(self.acquisition_label, alignment=Qt.AlignLeft)
         self.dark_mode_layout.addStretch()
         self.dark_mode_layout.addWidget(self.toggle_theme, alignment=Qt.AlignRight)
         self.dark_mode_layout.addWidget(self.theme_label, alignment=Qt.AlignRight)
@@ -133,12 +123,15 @@ class RealTimePlotWindow(QMainWindow):
 
         self.custom_filter_layout = QHBoxLayout()
         self.custom_filter_input = QLineEdit()
-        self.custom_filter_input.setPlaceholderText("1-230Hz")
+        # Notches stay 10 Hz clear of Nyquist (1-230 Hz at the sensor's 480 Hz).
+        self.custom_filter_max = int(effective_sample_rate() / 2) - 10
+        self.custom_filter_input.setPlaceholderText(f"1-{self.custom_filter_max}Hz")
         self.custom_filter_input.setFixedWidth(100)
-        self.custom_filter_validator = QIntValidator(1, 230, self)
+        self.custom_filter_validator = QIntValidator(1, self.custom_filter_max, self)
         self.custom_filter_input.setValidator(self.custom_filter_validator)
         self.custom_filter_input.textChanged.connect(
-            lambda: validate_custom_filter(self.custom_filter_input, self.custom_filter_apply))
+            lambda: validate_custom_filter(self.custom_filter_input, self.custom_filter_apply, self.custom_filter_max))
+        self.custom_filter_input.textChanged.connect(self.update_filter_settings)
         self.custom_filter_layout.addWidget(self.custom_filter_input, alignment=Qt.AlignRight)
 
         self.custom_filter_apply = QCheckBox("Apply")
@@ -176,6 +169,8 @@ class RealTimePlotWindow(QMainWindow):
         self.highpass_enabled = False
         self.notch_enabled = False
         self.custom_enabled = False
+        self.filter_settings = (False, False, False, None)
+        self.recorders = []
 
         self.canvas_frame = QFrame(self.central_widget)
         self.canvas_frame.setContentsMargins(0, 0, 0, 0)
@@ -194,9 +189,46 @@ class RealTimePlotWindow(QMainWindow):
         self.top_layout.addWidget(self.canvas_frame)
         self.layout.addLayout(self.top_layout)
 
+        # Scrolling back and zooming out read from the channels' histories while streaming continues.
+        self.history_layout = QHBoxLayout()
+        self.scroll_label = QLabel("Scroll back")
+        self.history_layout.addWidget(self.scroll_label, alignment=Qt.AlignLeft)
+        self.scroll_slider = QSlider(Qt.Horizontal)
+        self.scroll_slider.setInvertedAppearance(True)
+        self.scroll_slider.setMinimum(0)
+        self.scroll_slider.setMaximum(0)
+        self.scroll_slider.setFixedWidth(400)
+        self.scroll_slider.valueChanged.connect(self.update_view)
+        self.history_layout.addWidget(self.scroll_slider, alignment=Qt.AlignLeft)
+        self.scroll_position_label = QLabel("Live")
+        self.history_layout.addWidget(self.scroll_position_label, alignment=Qt.AlignLeft)
+        self.history_layout.addStretch()
+        self.zoom_label = QLabel("Window: 2 s")
+        self.history_layout.addWidget(self.zoom_label, alignment=Qt.AlignRight)
+        self.zoom_slider = QSlider(Qt.Horizontal)
+        self.zoom_slider.setMinimum(0)
+        self.zoom_slider.setMaximum(len(VIEW_SPANS) - 1)
+        self.zoom_slider.setValue(0)
+        self.zoom_slider.setFixedWidth(200)
+        self.zoom_slider.valueChanged.connect(self.update_view)
+        self.history_layout.addWidget(self.zoom_slider, alignment=Qt.AlignRight)
+        self.layout.addLayout(self.history_layout)
+        self.history_timer = QTimer()
+        self.history_timer.timeout.connect(self.update_scroll_range)
+        self.history_timer.start(1000)
+
         self.button_layout = QHBoxLayout()
         self.start_recording_button = QPushButton("Start recording")
         self.stop_recording_button = QPushButton("Stop recording")
+        self.record_filtered = QCheckBox("Record filtered channel")
+        self.telemetry_toggle = QCheckBox("Telemetry")
+        self.telemetry_toggle.clicked.connect(lambda: self.canvas.show_telemetry(self.telemetry_toggle.isChecked()))
+        self.export_telemetry_button = QPushButton("Export telemetry")
+        self.stack_channels = QCheckBox("Stack channels")
+        self.stack_channels.setChecked(True)
+        self.stack_channels.clicked.connect(lambda: self.canvas.set_stacked(self.stack_channels.isChecked()))
+        self.spectrum_toggle = QCheckBox("Spectrum")
+        self.spectrum_toggle.clicked.connect(lambda: self.spectrum_panel.set_enabled(self.spectrum_toggle.isChecked()))
 
         button_style = """
             QPushButton {
@@ -215,33 +247,69 @@ class RealTimePlotWindow(QMainWindow):
         """
         self.start_recording_button.setStyleSheet(button_style)
         self.stop_recording_button.setStyleSheet(button_style)
+        self.export_telemetry_button.setStyleSheet(button_style)
 
         self.start_recording_button.clicked.connect(self.start_recording)
         self.stop_recording_button.clicked.connect(self.stop_recording)
         self.stop_recording_button.setEnabled(False)
+        self.export_telemetry_button.clicked.connect(self.export_telemetry)
 
         self.button_layout.addWidget(self.start_recording_button)
         self.button_layout.addWidget(self.stop_recording_button)
+        self.button_layout.addWidget(self.record_filtered)
+        self.button_layout.addWidget(self.stack_channels)
+        self.button_layout.addWidget(self.spectrum_toggle)
+        self.button_layout.addWidget(self.telemetry_toggle)
+        self.button_layout.addWidget(self.export_telemetry_button)
         self.layout.addLayout(self.button_layout)
         print("Call self.canvas.start_data_loop()")
         self.canvas.start_data_loop()
+        self.stack_channels.setVisible(len(self.canvas.channels) > 1)
+        # Fed with the raw samples on its own thread; only runs while shown.
+        self.spectrum_panel = SpectrumPanel([channel.spectrum_tap for channel in self.canvas.channels],
+                                            self.canvas.sample_rate, [channel.name for channel in self.canvas.channels])
+        self.spectrum_panel.hide()
+        self.canvas_frame_layout.addWidget(self.spectrum_panel)
         self.change_theme(0)
 
     def toggle_lowpass(self):
         self.lowpass_enabled = self.lowpass_filter.isChecked()
         print(f"Lowpass: {self.lowpass_enabled}")
+        self.update_filter_settings()
 
     def toggle_highpass(self):
         self.highpass_enabled = self.highpass_filter.isChecked()
         print(f"Highpass: {self.highpass_enabled}")
+        self.update_filter_settings()
 
     def toggle_notch(self):
         self.notch_enabled = self.notch_filter.isChecked()
         print(f"50 Hz: {self.notch_enabled}")
+        self.update_filter_settings()
 
     def toggle_custom(self):
         self.custom_enabled = self.custom_filter_apply.isChecked()
         print(f"Custom filter: {self.custom_enabled}")
+        self.update_filter_settings()
+
+    def update_view(self):
+        span = VIEW_SPANS[self.zoom_slider.value()]
+        back = self.scroll_slider.value()
+        self.scroll_slider.setPageStep(span)
+        self.zoom_label.setText(f"Window: {format_seconds(span)}")
+        self.scroll_position_label.setText(f"{format_seconds(back)} back" if back else "Live")
+        self.canvas.set_view(span, back)
+
+    def update_scroll_range(self):
+        self.scroll_slider.setMaximum(int(self.canvas.history_seconds()))
+
+    def update_filter_settings(self):
+        # Read by the canvas filter thread; replaced as a whole so it never sees a half-updated set.
+        custom_freq = None
+        text = self.custom_filter_input.text().strip()
+        if self.custom_enabled and text.isdigit() and 1 <= int(text) <= self.custom_filter_max:
+            custom_freq = int(text)
+        self.filter_settings = (self.lowpass_enabled, self.highpass_enabled, self.notch_enabled, custom_freq)
 
     def change_theme(self, state):
         if state == 2:
@@ -281,6 +349,7 @@ class RealTimePlotWindow(QMainWindow):
                     }
                 """)
             self.canvas.set_dark_mode(True)
+            self.spectrum_panel.set_dark_mode(True)
         else:
             self.setStyleSheet("""
                 QMainWindow {
@@ -319,41 +388,74 @@ class RealTimePlotWindow(QMainWindow):
                     }
                 """)
             self.canvas.set_dark_mode(False)
+            self.spectrum_panel.set_dark_mode(False)
 
     def start_recording(self):
-        self.data_recording = True
-        self.record_start_time = datetime.datetime.now()
-        self.recorded_data = []
+        default_filename = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        options = QFileDialog.Options()
+        file_path, selected_filter = QFileDialog.getSaveFileName(
+            self, "Save the file", default_filename,
+            "Pliki CSV (*.csv);;Binary recording (*.mkgb);;Wszystkie pliki (*)", options=options
+        )
+        if not file_path:
+            return
+        binary = file_path.endswith(".mkgb") or selected_filter.startswith("Binary")
+        if binary and not file_path.endswith(".mkgb"):
+            file_path += ".mkgb"
+        filter_settings = (lambda: self.filter_settings) if self.record_filtered.isChecked() else None
+        # One file per sensor, each with its own device timestamps.
+        recorders = [StreamRecorder(channel_recording_path(file_path, index), binary=binary,
+                                    sample_rate=self.canvas.sample_rate, filter_settings=filter_settings)
+                     for index in range(max(len(self.canvas.channels), 1))]
+        for recorder in recorders:
+            recorder.start()
+        self.recorders = recorders
         self.start_recording_button.setEnabled(False)
+        self.record_filtered.setEnabled(False)
         self.stop_recording_button.setEnabled(True)
-        print(f"Data recording has begun: {self.data_recording}")
+        print(f"Data recording has begun: {file_path}")
 
     def stop_recording(self):
-        self.data_recording = False
         self.start_recording_button.setEnabled(True)
         self.stop_recording_button.setEnabled(False)
-
-        if self.recorded_data:
-            default_filename = self.record_start_time.strftime("%Y-%m-%d_%H-%M-%S")
-            options = QFileDialog.Options()
-            file_path, _ = QFileDialog.getSaveFileName(
-                self, "Save the file", default_filename, "Pliki CSV (*.csv);;Wszystkie pliki (*)", options=options
-            )
-            if file_path:
-                with open(file_path, "w") as file:
-                    file.write("Time, Value\n")
-                    for timestamp, value in self.recorded_data:
-                        file.write(f"{timestamp},{value}\n")
-                print(f"The data was recorded in a file: {file_path}")
+        self.record_filtered.setEnabled(True)
+        recorders, self.recorders = self.recorders, []
+        # CSV export of a long session takes seconds; finish it off the GUI thread. Not a daemon
+        # thread, so an export still running at exit completes before the process ends.
+        for recorder in recorders:
+            threading.Thread(target=self.finish_recording, args=(recorder,)).start()
+
+    def finish_recording(self, recorder):
+        try:
+            file_path = recorder.stop()
+        except Exception as e:
+            print(f"Recording error: {e}")
+            return
+        if recorder.samples_written:
+            print(f"The data was recorded in a file: {file_path}")
         else:
-            print("No data was recorded")
+            print(f"No data was recorded in {file_path}")
+
+    def export_telemetry(self):
+        default_filename = datetime.datetime.now().strftime("telemetry_%Y-%m-%d_%H-%M-%S.csv")
+        file_path, _ = QFileDialog.getSaveFileName(self, "Save telemetry", default_filename,
+                                                   "Pliki CSV (*.csv);;Wszystkie pliki (*)")
+        if not file_path:
+            return
+        try:
+            self.canvas.telemetry.export_csv(file_path)
+            print(f"Telemetry saved to {file_path}")
+        except Exception as e:
+            print(f"Telemetry export error: {e}")
 
     def closeEvent(self, event):
         print("Zamykam RealTimePlotWindow.")
+        self.history_timer.stop()
+        self.spectrum_panel.close_panel()
         self.canvas.stop_data_loop()
+        if self.recorders:
+            self.stop_recording()
         try:
-            if self.canvas.session:
-                self.canvas.session.close()
             reset_com_port()
         except Exception as e:
             print(f"COM port reset error: {e}")
@@ -361,43 +463,170 @@ class RealTimePlotWindow(QMainWindow):
         super().closeEvent(event)
 
 
-class RealTimePlotCanvas(FigureCanvas):
+def autoscale_limits(limits, y):
+    # Returns the y limits for trace y, or limits itself when they still suit it.
+    y_min, y_max = y.min(), y.max()
+    if np.isnan(y_min) or np.isnan(y_max) or np.isinf(y_min) or np.isinf(y_max):
+        return (-1, 1)
+    data_range = y_max - y_min
+    margin = (data_range / 2) if data_range != 0 else 1
+    new_limits = (y_min - margin, y_max + margin)
+    if limits is not None:
+        # Keep the current limits while the trace fits and still fills a fair share of
+        # them; every change forces a full redraw of the axes instead of a blit.
+        low, high = limits
+        if low <= y_min and y_max <= high and high - low <= 2 * (new_limits[1] - new_limits[0]):
+            return limits
+    return new_limits
+
+
+def format_seconds(seconds):
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds} s"
+    if seconds % 60 == 0:
+        return f"{seconds // 60} min"
+    return f"{seconds // 60}:{seconds % 60:02d} min"
+
+
+def channel_recording_path(file_path, index):
+    # The first sensor records to the chosen file, the others next to it.
+    if index == 0:
+        return file_path
+    root, ext = os.path.splitext(file_path)
+    return f"{root}_sensor{index + 1}{ext}"
+
+
+class LiveChannel:
+    # One sensor of the live view: ingest -> buffer -> filter thread -> filtered_buffer ->
+    # render timer, every ring holding SAMPLE_RECORD (device timestamp, value) with exactly
+    # one producer and one consumer. In process mode the channel's child process fills the
+    # shared filtered ring and raw_tap (raw samples for recorders and fan-out); buffer is unused.
+    # Everything the render timer reads also goes into history, for scrolling back. The raw
+    # samples also go to spectrum_tap, so the spectrum shows the mains the filters remove.
+
+    def __init__(self, index, name, port, capacity, sample_rate, shared=False):
+        self.index = index
+        self.name = name
+        self.port = port
+        self.buffer = SampleRingBuffer(capacity, dtype=SAMPLE_RECORD)
+        if shared:
+            self.filtered_buffer = SharedMemoryRingBuffer(capacity, dtype=SAMPLE_RECORD)
+            self.raw_tap = SharedMemoryRingBuffer(int(30 * sample_rate), dtype=SAMPLE_RECORD)
+        else:
+            self.filtered_buffer = SampleRingBuffer(capacity, dtype=SAMPLE_RECORD)
+            self.raw_tap = None
+        self.filter_chain = LiveFilterChain(sample_rate)
+        self.history = SampleHistory(sample_rate)
+        self.spectrum_tap = SampleRingBuffer(int(30 * sample_rate), dtype=SAMPLE_RECORD)
+        self.source = None
+        self.thread = None
+        self.process = None
+        self.status = ""
+        self.last_heartbeat = 0
+        self.last_heartbeat_time = 0
+        self.tap_samples = 0
+        self.ingest_dropped = 0
+        self.render_dropped = 0
+        self.ylim = None
+        # Device timestamps are put on the host clock with the smallest arrival - timestamp
+        # gap seen so far, which stands in for the clock offset plus the fastest possible
+        # delivery. This lines sensors up on a common timebase and gives the latency.
+        self.clock_offset = float("inf")
+
+    def ingest(self, timestamps, values):
+        records = np.empty(len(values), dtype=SAMPLE_RECORD)
+        records['time'] = timestamps
+        records['value'] = values
+        self.buffer.extend(records)
+        self.spectrum_tap.extend(records)
+        self.note_arrival(timestamps[-1])
+
+    def note_arrival(self, timestamp):
+        self.clock_offset = min(self.clock_offset, time.time() - timestamp)
+
+    def filter_pending(self, settings):
+        # Filters whatever has arrived; returns (samples filtered, samples dropped).
+        block, dropped = self.buffer.read()
+        self.ingest_dropped += dropped
+        if len(block):
+            self.filtered_buffer.extend(self.filter_chain.process_records(block, settings))
+        return len(block), dropped
+
+    def close(self):
+        if self.raw_tap is not None:
+            self.filtered_buffer.close()
+            self.raw_tap.close()
+
+
+class RealTimePlotCanvas(QWidget):
     data_received = pyqtSignal(float)
 
     def __init__(self):
         super().__init__()
 
-        self.session = None
-        self.data_thread = None
+        self.acquisition_mode = ACQUISITION_MODE
+        self.async_acquisition = None
+        self.fanout = None
+        self.stop_event = threading.Event()
+        self.shared_settings = None
+        self.published_settings = None
 
         self.parent_window = None
         self.setAttribute(Qt.WA_DeleteOnClose, True)
-        self.xlim = 200
-        self.n = np.linspace(0, self.xlim - 1, self.xlim)
-        self.y = np.zeros(self.xlim)
-
-        self.fig = Figure(figsize=(5, 5), dpi=100)
-        self.ax1 = self.fig.add_subplot(111)
-        self.ax1.set_xlim(0, self.xlim - 1)
-        self.ax1.set_xlabel('Index')
-        self.ax1.set_ylabel('Sensor Value')
-
-        self.line1, = self.ax1.plot([], [], 'b-', label='Sensor Data')
-        self.ax1.legend()
-
-        super().__init__(self.fig)
-
+        self.sample_rate = effective_sample_rate()
+        self.window_seconds = 2.0
+        self.target_fps = 60
+        self.frame_cost = 0.0
+
+        self.xlim = int(self.window_seconds * self.sample_rate)
+        self.ylim = None
+        self.stacked = True
+        # Seconds shown and how far before the live edge they end; view_anchor is the host
+        # time the view was scrolled back from, None while following the live edge.
+        self.view_span = self.window_seconds
+        self.view_back = 0
+        self.view_anchor = None
+        self.view_changed = False
+        self.history_points = 4000
+
+        # One LiveChannel per sensor, created by start_data_loop.
+        self.channels = []
+        self.filter_thread = None
+        self.dropped_samples = 0
+        self.reported_drops = 0
+        self.drop_report_time = 0
+        self.telemetry = PipelineTelemetry()
+
+        self.plot = create_plot_canvas(self, width=5, height=5, dpi=100, tight_layout=True, blit=True)
+        self.plot.set_xlim(-(self.xlim - 1) / self.sample_rate, 0)
+        self.plot.set_labels('Time (s)', 'Sensor Value', legend='Sensor Data')
+        self.plot.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+
+        self.plot_layout = QVBoxLayout(self)
+        self.plot_layout.setContentsMargins(0, 0, 0, 0)
+        self.plot_layout.addWidget(self.plot)
+
+        self.telemetry_overlay = QLabel(self.plot)
+        self.telemetry_overlay.setStyleSheet(
+            "background-color: rgba(0, 0, 0, 160); color: white; font-family: monospace; font-size: 12px; "
+            "padding: 6px; border: none; border-radius: 4px;")
+        self.telemetry_overlay.move(10, 10)
+        self.telemetry_overlay.hide()
+        self.telemetry_timer = QTimer()
+        self.telemetry_timer.timeout.connect(self.sample_telemetry)
+        self.telemetry_timer.start(1000)
+
+        # Single-shot so frames never queue up behind a slow draw; render_frame re-arms it.
         self.timer = QTimer()
-        self.timer.timeout.connect(self.update_plot)
-        self.timer.start(10)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.render_frame)
+        self.timer.start(0)
 
         self.addedData = []
         self.running = False
         self.setAttribute(Qt.WA_DeleteOnClose, True)
 
-        self.sample_rate = 480
-        self.buffer = deque(maxlen=2000)
-        self.delay = 50
         self.threadpool = QThreadPool()
         print("RealTimePlotCanvas.__init__ called")
 
@@ -405,162 +634,365 @@ class RealTimePlotCanvas(FigureCanvas):
         print(f"add_data called with the value: {value}")
         self.addedData.append(value)
 
+    def render_frame(self):
+        if self.acquisition_mode == "process" and self.channels:
+            self.check_acquisition_processes()
+        started = time.perf_counter()
+        drew = self.update_plot()
+        cost = time.perf_counter() - started
+        # Frames with nothing new return early; timing them would dilute the draw cost.
+        if drew:
+            self.telemetry.timing("draw", cost)
+        self.frame_cost = 0.8 * self.frame_cost + 0.2 * cost
+        # Never spend more than half of the GUI thread on drawing, whatever the target fps.
+        interval = max(1.0 / self.target_fps, 2 * self.frame_cost)
+        self.timer.start(int(interval * 1000))
+
+    def ingest_block(self, index, timestamps, values):
+        # Runs on the acquisition thread of sensor index: feeds its live pipeline and passes
+        # every raw sample with its device timestamp on to the recorder and subscribers.
+        self.channels[index].ingest(timestamps, values)
+        self.telemetry.count("samples", len(values))
+        self.publish_block(index, timestamps, values)
+
+    def publish_block(self, index, timestamps, values):
+        recorders = self.parent_window.recorders if self.parent_window else None
+        if recorders and index < len(recorders):
+            recorders[index].write(timestamps, values)
+        if self.fanout is not None:
+            self.fanout.publish(index, timestamps, values)
+
+    def drain_raw_tap(self, channel):
+        records, dropped = channel.raw_tap.read()
+        if dropped:
+            print(f"{channel.name}: raw tap dropped {dropped} samples")
+        if len(records):
+            # Raw timestamps: the filtered ones lag by the filter delay.
+            channel.note_arrival(records['time'][-1])
+            channel.spectrum_tap.extend(records)
+            self.publish_block(channel.index, records['time'], records['value'])
+
+    def check_acquisition_processes(self):
+        settings = self.parent_window.filter_settings if self.parent_window else (False, False, False, None)
+        if settings != self.published_settings:
+            self.shared_settings[:] = encode_filter_settings(settings)
+            self.published_settings = settings
+
+        now = time.monotonic()
+        for channel in self.channels:
+            self.telemetry.count("samples", channel.raw_tap.write_index - channel.tap_samples)
+            channel.tap_samples = channel.raw_tap.write_index
+            self.telemetry.peak("ring_fill", channel.filtered_buffer.available() / channel.filtered_buffer.capacity)
+            self.drain_raw_tap(channel)
+
+            heartbeat = channel.filtered_buffer.heartbeat
+            if heartbeat != channel.last_heartbeat:
+                channel.last_heartbeat = heartbeat
+                channel.last_heartbeat_time = now
+                channel.status = "running"
+            elif not channel.process.is_alive():
+                channel.status = "stopped"
+            elif heartbeat and now - channel.last_heartbeat_time > 2:
+                channel.status = "not responding"
+
+        if any(not channel.status for channel in self.channels):
+            return
+        problems = [channel for channel in self.channels if channel.status != "running"]
+        if not problems:
+            status = "Acquisition: running"
+        elif len(self.channels) == 1:
+            status = f"Acquisition: {problems[0].status}"
+        else:
+            status = "Acquisition: " + ", ".join(f"{channel.name} {channel.status}" for channel in problems)
+        if self.parent_window and self.parent_window.acquisition_label.text() != status:
+            if problems:
+                print(status)
+            self.parent_window.acquisition_label.setText(status)
+
+    def filter_loop(self):
+        while not self.stop_event.is_set():
+            settings = self.parent_window.filter_settings if self.parent_window else (False, False, False, None)
+            filtered = 0
+            for channel in self.channels:
+                self.telemetry.peak("ring_fill", channel.buffer.available() / channel.buffer.capacity)
+                try:
+                    started = time.perf_counter()
+                    count, dropped = channel.filter_pending(settings)
+                    if count:
+                        self.telemetry.timing("filter", time.perf_counter() - started)
+                    if dropped:
+                        self.telemetry.count("dropped", dropped)
+                    filtered += count
+                except Exception as e:
+                    print(f"Error in filter_loop: {e}")
+            if not filtered:
+                self.stop_event.wait(0.005)
+
+    def configure_traces(self):
+        # Several sensors are either stacked, each scaled into its own band with its name on
+        # the y axis, or overlaid on one scale; both stay on one axes so frames still blit.
+        count = len(self.channels)
+        if count <= 1:
+            self.plot.set_trace_count(1, ['Sensor Data'])
+            self.plot.set_yticks(None)
+        elif self.stacked:
+            labels = [channel.name for channel in self.channels]
+            self.plot.set_trace_count(count, labels, legend=False)
+            self.plot.set_yticks([count - 1 - index + 0.5 for index in range(count)], labels)
+            self.plot.set_ylim(0, count)
+        else:
+            self.plot.set_trace_count(count, [channel.name for channel in self.channels])
+            self.plot.set_yticks(None)
+        self.ylim = None
+        for channel in self.channels:
+            channel.ylim = None
+
+    def set_stacked(self, enabled):
+        self.stacked = enabled
+        self.configure_traces()
+
+    def update_autoscale(self, y):
+        limits = autoscale_limits(self.ylim, y)
+        if limits != self.ylim:
+            self.ylim = limits
+            self.plot.set_ylim(*limits)
+
+    def set_view(self, span, back):
+        # Scrolled back, the view holds still at that point of the session while the stream
+        # carries on; back at 0 it follows the live edge again.
+        if back <= 0:
+            self.view_anchor = None
+        elif self.view_anchor is None:
+            self.view_anchor = self.live_edge()
+        self.view_span = span
+        self.view_back = back
+        self.view_changed = True
+        if self.live_view():
+            self.plot.set_xlim(-(self.xlim - 1) / self.sample_rate, 0)
+
+    def live_view(self):
+        return self.view_anchor is None and self.view_span == self.window_seconds
+
+    def live_edge(self):
+        # Host time of the newest sample of any sensor.
+        edges = []
+        for channel in self.channels:
+            time_range = channel.history.time_range()
+            if time_range is not None:
+                edges.append(channel.clock_offset + time_range[1])
+        return max(edges) if edges else None
+
+    def history_seconds(self):
+        edge = self.live_edge()
+        if edge is None:
+            return 0
+        return edge - min(channel.clock_offset + channel.history.time_range()[0]
+                          for channel in self.channels if channel.history.time_range() is not None)
+
     def update_plot(self):
+        # True when the traces were redrawn.
         try:
-            if len(self.buffer) < self.delay + 10:
-                return
-
-            raw_data = list(self.buffer)
-            y_filtered = np.array(raw_data)
-
-            if self.parent_window.lowpass_enabled:
-                y_filtered = lowpass_filter(y_filtered, normal_cutoff=0.2917)
-            if self.parent_window.highpass_enabled:
-                y_filtered = highpass_filter(y_filtered, normal_cutoff=0.04)
-            if self.parent_window.notch_enabled:
-                y_filtered = notch_filter(y_filtered, freq=50, fs=self.sample_rate)
-            if self.parent_window.custom_enabled:
-                try:
-                    text = self.parent_window.custom_filter_input.text()
-                    if text.strip().isdigit():
-                        custom_freq = int(text)
-                        if 1 <= custom_freq <= 230:
-                            y_filtered = notch_filter(y_filtered, custom_freq, fs=self.sample_rate)
-                except:
-                    pass
-
-            display_value = y_filtered[-self.delay]
-
-            self.y = np.roll(self.y, -1)
-            self.y[-1] = display_value
-
-            if self.parent_window and hasattr(self.parent_window,
-                                              'data_recording') and self.parent_window.data_recording:
-                timestamp = datetime.datetime.now().strftime("%H:%M:%S.%f")
-                self.parent_window.recorded_data.append((timestamp, display_value))
-
-            y_min, y_max = self.y.min(), self.y.max()
-            if np.isnan(y_min) or np.isnan(y_max) or np.isinf(y_min) or np.isinf(y_max):
-                self.ax1.set_ylim(-1, 1)
-            else:
-                data_range = y_max - y_min
-                margin = (data_range / 2) if data_range != 0 else 1
-                self.ax1.set_ylim(y_min - margin, y_max + margin)
-
-            self.line1.set_data(np.arange(self.xlim), self.y)
-            self.ax1.draw_artist(self.ax1.patch)
-            self.ax1.draw_artist(self.line1)
-            self.blit(self.ax1.bbox)
+            fresh = False
+            for channel in self.channels:
+                new_samples, dropped = channel.filtered_buffer.read()
+                if dropped:
+                    channel.render_dropped += dropped
+                    self.telemetry.count("dropped", dropped)
+                channel.history.append(new_samples)
+                fresh = fresh or len(new_samples) > 0
+            total_dropped = sum(channel.ingest_dropped + channel.render_dropped for channel in self.channels)
+            if total_dropped != self.dropped_samples:
+                self.dropped_samples = total_dropped
+                # Under sustained overload this changes every frame; log at most once a second.
+                now = time.monotonic()
+                if now - self.drop_report_time >= 1:
+                    print(f"Live plot dropped {total_dropped - self.reported_drops} samples ({total_dropped} in total)")
+                    self.reported_drops = total_dropped
+                    self.drop_report_time = now
+                if self.parent_window:
+                    self.parent_window.dropped_label.setText(f"Dropped samples: {self.dropped_samples}")
+
+            if not self.live_view():
+                # A scrolled-back view only changes when it is moved.
+                if (fresh and self.view_anchor is None) or self.view_changed:
+                    self.view_changed = False
+                    return self.update_history_view()
+                return False
+            if not fresh:
+                return False
+
+            traces = [(channel, channel.filtered_buffer.latest(self.xlim)) for channel in self.channels]
+            traces = [(channel, records) for channel, records in traces if len(records)]
+            # Host time of the newest sample of each sensor; the x axis ends at the newest overall.
+            newest = [channel.clock_offset + records['time'][-1] for channel, records in traces]
+            now = max(newest)
+            self.draw_traces([(channel, records['time'] + (channel.clock_offset - now), records['value'])
+                              for channel, records in traces])
+            self.telemetry.gauge("latency_ms", 1000 * (time.time() - min(newest)))
+            return True
 
         except Exception as e:
             print(f"Error in update_plot: {e}")
+            return False
+
+    def update_history_view(self):
+        # x in seconds before the live edge, or before the point the view was scrolled back from.
+        now = self.view_anchor if self.view_anchor is not None else self.live_edge()
+        if now is None:
+            return False
+        end = now - self.view_back
+        start = end - self.view_span
+        traces = []
+        for channel in self.channels:
+            t, y = channel.history.window(start - channel.clock_offset, end - channel.clock_offset,
+                                          self.history_points)
+            if len(t):
+                traces.append((channel, t + (channel.clock_offset - now), y))
+        self.plot.set_xlim(start - now, end - now)
+        if not traces:
+            return False
+        self.draw_traces(traces)
+        return True
+
+    def draw_traces(self, traces):
+        stacked = self.stacked and len(self.channels) > 1
+        if not stacked:
+            self.update_autoscale(np.concatenate([y for _, _, y in traces]))
+        for channel, x, y in traces:
+            if stacked:
+                channel.ylim = autoscale_limits(channel.ylim, y)
+                low, high = channel.ylim
+                y = (y - low) / (high - low) + (len(self.channels) - 1 - channel.index)
+            self.plot.set_trace(x, y, channel.index)
+        self.plot.draw_trace()
+
+    def sample_telemetry(self):
+        sources = [channel.source for channel in self.channels if channel.source is not None]
+        if sources:
+            self.telemetry.gauge("queue_depth", sum(source.queue_depth() for source in sources))
+        elif self.async_acquisition is not None:
+            self.telemetry.gauge("queue_depth", self.async_acquisition.queue_depth())
+        row = self.telemetry.sample()
+        if self.telemetry_overlay.isVisible():
+            self.telemetry_overlay.setText(format_telemetry(row))
+            self.telemetry_overlay.adjustSize()
+
+    def show_telemetry(self, enabled):
+        self.telemetry_overlay.setVisible(enabled)
+        if enabled and self.telemetry.history:
+            self.telemetry_overlay.setText(format_telemetry(self.telemetry.history[-1]))
+            self.telemetry_overlay.adjustSize()
+        self.telemetry_overlay.raise_()
 
     def start_data_loop(self):
         print("start_data_loop called")
         self.running = True
-        self.data_thread = threading.Thread(target=self.data_loop, daemon=True)
-        self.data_thread.start()
+        ports = sample_source_ports()
+        if not ports:
+            print("Failed to initialise sensor.")
+        shared = self.acquisition_mode == "process"
+        self.channels = [LiveChannel(index, f"Sensor {index + 1}", port, 4 * self.xlim, self.sample_rate, shared)
+                         for index, port in enumerate(ports)]
+        for channel in self.channels:
+            if channel.port is not None:
+                print(f"{channel.name}: {channel.port}")
+        self.configure_traces()
+        if FANOUT_ADDRESS:
+            try:
+                self.fanout = FanoutServer(FANOUT_ADDRESS, self.sample_rate, [channel.name for channel in self.channels])
+                self.fanout.start()
+            except (OSError, ValueError) as e:
+                print(f"Fan-out server not started ({FANOUT_ADDRESS}): {e}")
+        if self.acquisition_mode == "process":
+            # spawn rather than fork: the GUI process already runs Qt and several threads.
+            # One process per sensor, so a slow or wedged device never holds up the others.
+            context = multiprocessing.get_context("spawn")
+            self.stop_event = context.Event()
+            self.shared_settings = context.Array('i', encode_filter_settings((False, False, False, None)))
+            for channel in self.channels:
+                rings = {"filtered": (channel.filtered_buffer.name, channel.filtered_buffer.capacity),
+                         "raw": (channel.raw_tap.name, channel.raw_tap.capacity)}
+                channel.process = context.Process(
+                    target=acquisition_process, daemon=True,
+                    args=(rings, self.shared_settings, self.stop_event, channel.index, channel.port))
+                channel.process.start()
+            print(f"{len(self.channels)} acquisition process(es) running")
+            return
+        self.stop_event = threading.Event()
+        # The asyncio backend only talks to serial ports; other sources run on data threads
+        # (or serve them on a port with sensor_emulator.py and MKG_SENSOR_PORT).
+        if self.acquisition_mode == "asyncio" and SAMPLE_SOURCE == "sensor":
+            self.async_acquisition = AsyncAcquisition(self.ingest_block)
+            self.async_acquisition.device_started.connect(self.on_device_started)
+            self.async_acquisition.device_stopped.connect(self.on_device_stopped)
+            if ports:
+                self.async_acquisition.start(ports, sample_rate=SAMPLE_RATE, decimation=DECIMATION_MODE)
+        else:
+            for channel in self.channels:
+                channel.thread = threading.Thread(target=self.data_loop, args=(channel,), daemon=True)
+                channel.thread.start()
+        self.filter_thread = threading.Thread(target=self.filter_loop, daemon=True)
+        self.filter_thread.start()
         print("Data_thread running")
 
     def stop_data_loop(self):
+        # Every loop waits on stop_event with a short timeout, so these joins return almost
+        # immediately; the timeouts only guard against a wedged serial driver.
         self.running = False
-
-        if self.data_thread is not None and self.data_thread.is_alive():
-            self.data_thread.join(timeout=2)
-
-        if self.session:
-            self.session.alive = False
-            time.sleep(1)
-            self.session.close()
-            try:
-                if self.session.serial.is_open:
-                    self.session.serial.close()
-            except Exception as e:
-                print(f"Serial close error: {e}")
-
-    def data_loop(self):
+        self.stop_event.set()
+        self.timer.stop()
+        self.telemetry_timer.stop()
+        self.plot.stop_rendering()
+
+        if self.async_acquisition is not None:
+            self.async_acquisition.stop()
+            self.async_acquisition = None
+
+        for thread in [channel.thread for channel in self.channels] + [self.filter_thread]:
+            if thread is not None and thread.is_alive():
+                thread.join(timeout=2)
+
+        deadline = time.monotonic() + 5
+        for channel in self.channels:
+            if channel.process is not None:
+                channel.process.join(timeout=max(deadline - time.monotonic(), 0))
+                if channel.process.is_alive():
+                    print(f"{channel.name}: acquisition process did not stop, terminating it.")
+                    channel.process.terminate()
+                    channel.process.join()
+                channel.process = None
+            channel.close()
+            if channel.source is not None:
+                channel.source.close()
+
+        if self.fanout is not None:
+            self.fanout.close()
+            self.fanout = None
+
+    def on_device_started(self, index, port):
+        print(f"Sensor {index} streaming from {port}")
+        if self.parent_window:
+            self.parent_window.acquisition_label.setText("Acquisition: running")
+
+    def on_device_stopped(self, index, reason):
+        print(f"Sensor {index} {reason}")
+        if self.parent_window and self.running:
+            if len(self.channels) > 1:
+                reason = f"{self.channels[index].name} {reason}"
+            self.parent_window.acquisition_label.setText(f"Acquisition: {reason}")
+
+    def data_loop(self, channel):
         print("data_loop called")
+        channel.source = create_sample_source(index=channel.index, port=channel.port)
         try:
-            sensor_port = detect_sensor_port()
-            self.session = CustomTIOSession(url=sensor_port, verbose=False, specialize=False)
-            if not self.session:
-                print("Failed to initialise sensor.")
-                return
-
-            print("Sensor initialised")
-            self.session.specialize(connectingMessage=True, stateCache=False)
-            wait_start_time = time.time()
-            while not self.session.protocol.streams:
-                time.sleep(0.1)
-                if time.time() - wait_start_time > 5:
-                    print("Stream info not received in time.")
-                    return
-
-            self.session.rpc_val("gradient.data.decimation", tio.UINT32_T, 1)
-            print("Stream ready. Reading data...")
-
-            self.running = True
-            columns = self.session.protocol.columns
-            if "gradient" not in columns:
-                print("gradient not in columns:", columns)
-                return
-            gradient_index = columns.index("gradient")
-
-            while self.running:
-                try:
-                    decoded_packet = self.session.pub_queue.get(timeout=1)
-                    if decoded_packet["type"] != tio.TL_PTYPE_STREAM0:
-                        continue
-
-                    result = self.session.protocol.stream_data(decoded_packet, timeaxis=True)
-                    if not isinstance(result, tuple) or len(result) < 2:
-                        continue
-                    timestamp, values = result
-
-                    if len(values) <= gradient_index:
-                        continue
-                    gradient_value = values[gradient_index]
-
-                    self.buffer.append(gradient_value)
-
-                except queue.Empty:
-                    pass
-                except Exception as e:
-                    print(f"Error in data_loop: {e}")
+            if channel.source.open():
+                channel.source.run(self.stop_event, lambda timestamps, values: self.ingest_block(channel.index, timestamps, values))
         finally:
-            if self.session:
-                self.session.close()
+            channel.source.close()
 
     def set_dark_mode(self, enabled):
-        if enabled:
-            self.ax1.set_facecolor('#2c2c2c')
-            self.fig.patch.set_facecolor('#2c2c2c')
-            self.ax1.spines['bottom'].set_color('white')
-            self.ax1.spines['left'].set_color('white')
-            self.ax1.tick_params(axis='x', colors='white')
-            self.ax1.tick_params(axis='y', colors='white')
-            self.ax1.xaxis.label.set_color('white')
-            self.ax1.yaxis.label.set_color('white')
-            self.ax1.title.set_color('white')
-            self.line1.set_color('cyan')
-        else:
-            self.ax1.set_facecolor('white')
-            self.fig.patch.set_facecolor('white')
-            self.ax1.spines['bottom'].set_color('black')
-            self.ax1.spines['left'].set_color('black')
-            self.ax1.tick_params(axis='x', colors='black')
-            self.ax1.tick_params(axis='y', colors='black')
-            self.ax1.xaxis.label.set_color('black')
-            self.ax1.yaxis.label.set_color('black')
-            self.ax1.title.set_color('black')
-            self.line1.set_color('blue')
-
-        self.draw()
-
-    def resizeEvent(self, event):
-        super().resizeEvent(event)
-        self.figure.tight_layout()
-        self.draw()
+        self.plot.set_dark_mode(enabled)
+        self.plot.draw()
 
 
 def reset_com_port():
@@ -0,0 +1,468 @@
+import os
+import threading
+import numpy as np
+from PyQt5.QtCore import Qt, QObject, QRectF, QPointF, pyqtSignal
+from PyQt5.QtGui import QImage, QPainter, QColor, QPen, QPolygonF
+from PyQt5.QtWidgets import QWidget
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.figure import Figure
+from matplotlib.ticker import AutoLocator, ScalarFormatter
+
+# Per-machine choice of trace renderer: "matplotlib" (default) or "qpainter".
+PLOT_BACKEND = os.environ.get("MKG_PLOT_BACKEND", "matplotlib").lower()
+
+DARK_THEME = {'background': '#2c2c2c', 'foreground': 'white', 'line': 'cyan'}
+LIGHT_THEME = {'background': 'white', 'foreground': 'black', 'line': 'blue'}
+# Traces after the first (multi-sensor views); the first one follows the theme.
+TRACE_COLORS = ['#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
+
+
+def trace_color(theme, index):
+    return theme['line'] if index == 0 else TRACE_COLORS[(index - 1) % len(TRACE_COLORS)]
+
+
+def create_plot_canvas(parent=None, backend=None, **kwargs):
+    backend = (backend or PLOT_BACKEND).lower()
+    if backend == "qpainter":
+        return QPainterPlot(parent)
+    if backend != "matplotlib":
+        print(f"Unknown plot backend '{backend}', falling back to matplotlib.")
+    return MatplotlibPlot(parent, **kwargs)
+
+
+class MatplotlibPlot(FigureCanvas):
+    def __init__(self, parent=None, width=5, height=4, dpi=100, threaded_rendering=False, tight_layout=False, blit=False):
+        fig = Figure(figsize=(width, height), dpi=dpi)
+        self.axes = fig.add_subplot(111)
+        self.line, = self.axes.plot([], [], color=LIGHT_THEME['line'])
+        self.lines = [self.line]
+        self.theme = LIGHT_THEME
+        super().__init__(fig)
+        self.setStyleSheet("background-color: transparent;")
+        self.tight_layout = tight_layout
+
+        # With blitting the trace is left out of full draws; every full draw re-caches the
+        # background (axes, ticks, labels) and draw_trace only repaints the line on top of it.
+        self.use_blit = blit
+        self.background = None
+        self.background_key = None
+        if blit:
+            self.line.set_animated(True)
+            self.mpl_connect('draw_event', self.cache_background)
+
+        self.threaded_rendering = False
+        self.render_worker = None
+        self.frame_counter = 0
+        self.shown_frame = 0
+        self.frame_pixels = None
+        self.frame_image = None
+        self.set_threaded_rendering(threaded_rendering)
+
+    def set_trace(self, x, y, index=0):
+        self.lines[index].set_data(x, y)
+
+    def set_trace_count(self, count, labels=None, legend=True):
+        while len(self.lines) > count:
+            self.lines.pop().remove()
+        while len(self.lines) < count:
+            line, = self.axes.plot([], [], color=trace_color(self.theme, len(self.lines)))
+            line.set_animated(self.use_blit)
+            self.lines.append(line)
+        if labels is not None:
+            for line, label in zip(self.lines, labels):
+                line.set_label(label)
+        if legend:
+            self.axes.legend(handles=self.lines)
+        elif self.axes.get_legend() is not None:
+            self.axes.get_legend().remove()
+        self.draw()
+
+    def set_xlim(self, left, right):
+        self.axes.set_xlim(left, right)
+
+    def set_yticks(self, positions=None, labels=None):
+        # None restores automatic ticks.
+        if positions is None:
+            self.axes.yaxis.set_major_locator(AutoLocator())
+            self.axes.yaxis.set_major_formatter(ScalarFormatter())
+        else:
+            self.axes.set_yticks(positions, labels)
+
+    def get_xlim(self):
+        return self.axes.get_xlim()
+
+    def set_ylim(self, bottom, top):
+        self.axes.set_ylim(bottom, top)
+
+    def set_labels(self, xlabel, ylabel, title=None, legend=None):
+        self.axes.set_xlabel(xlabel)
+        self.axes.set_ylabel(ylabel)
+        if title is not None:
+            self.axes.set_title(title)
+        if legend is not None:
+            self.line.set_label(legend)
+            self.axes.legend()
+
+    def set_dark_mode(self, enabled):
+        theme = DARK_THEME if enabled else LIGHT_THEME
+        self.theme = theme
+        foreground = theme['foreground']
+        self.axes.set_facecolor(theme['background'])
+        self.figure.patch.set_facecolor(theme['background'])
+        self.axes.spines['bottom'].set_color(foreground)
+        self.axes.spines['left'].set_color(foreground)
+        self.axes.tick_params(axis='x', colors=foreground)
+        self.axes.tick_params(axis='y', colors=foreground)
+        self.axes.xaxis.label.set_color(foreground)
+        self.axes.yaxis.label.set_color(foreground)
+        self.axes.title.set_color(foreground)
+        for index, line in enumerate(self.lines):
+            line.set_color(trace_color(theme, index))
+        if self.axes.get_legend() is not None:
+            self.axes.legend(handles=self.lines)
+
+    def set_threaded_rendering(self, enabled):
+        if enabled and self.render_worker is None:
+            self.render_worker = AggRenderWorker(self)
+            self.render_worker.frame_ready.connect(self.show_frame)
+        self.threaded_rendering = enabled
+        self.frame_image = None
+        self.draw()
+
+    def stop_rendering(self):
+        # Teardown: ends the background render thread, if one was started.
+        if self.render_worker is not None:
+            self.render_worker.stop()
+            self.render_worker.thread.join(timeout=2)
+            self.render_worker = None
+        self.threaded_rendering = False
+
+    def draw(self):
+        if not self.threaded_rendering:
+            super().draw()
+            return
+        self.frame_counter += 1
+        self.render_worker.submit(self.frame_counter, self.capture_plot_spec())
+
+    def blit_key(self):
+        return self.axes.get_xlim(), self.axes.get_ylim(), self.figure.bbox.bounds
+
+    def cache_background(self, event):
+        if self.threaded_rendering:
+            return
+        self.background = self.copy_from_bbox(self.figure.bbox)
+        self.background_key = self.blit_key()
+        for line in self.lines:
+            self.axes.draw_artist(line)
+
+    def draw_trace(self):
+        if self.threaded_rendering or not self.use_blit:
+            self.draw()
+            return
+        if self.background is None or self.blit_key() != self.background_key:
+            self.draw()
+            return
+        self.restore_region(self.background)
+        for line in self.lines:
+            self.axes.draw_artist(line)
+        self.blit(self.axes.bbox)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if self.tight_layout:
+            self.figure.tight_layout()
+            self.draw()
+
+    def capture_plot_spec(self):
+        ax = self.axes
+        legend = ax.get_legend()
+        return {
+            'size_inches': tuple(self.figure.get_size_inches()),
+            'dpi': self.figure.dpi,
+            'figure_facecolor': self.figure.get_facecolor(),
+            'axes_facecolor': ax.get_facecolor(),
+            'foreground': ax.spines['left'].get_edgecolor(),
+            'lines': [(line.get_xdata(), line.get_ydata(), line.get_color(), line.get_label()) for line in ax.get_lines()],
+            'xlim': ax.get_xlim(),
+            'ylim': ax.get_ylim(),
+            'xlabel': ax.get_xlabel(),
+            'ylabel': ax.get_ylabel(),
+            'title': ax.get_title(),
+            'legend': legend is not None,
+            'yticks': (ax.get_yticks(), [tick.get_text() for tick in ax.get_yticklabels()]),
+        }
+
+    def show_frame(self, frame_id, pixels):
+        if frame_id <= self.shown_frame or not self.threaded_rendering:
+            return
+        self.shown_frame = frame_id
+        height, width = pixels.shape[:2]
+        self.frame_pixels = pixels
+        self.frame_image = QImage(pixels.data, width, height, QImage.Format_RGBA8888)
+        self.update()
+
+    def paintEvent(self, event):
+        if not self.threaded_rendering:
+            super().paintEvent(event)
+            return
+        if self.frame_image is None:
+            return
+        painter = QPainter(self)
+        painter.drawImage(self.rect(), self.frame_image)
+        painter.end()
+
+
+def render_plot_spec(spec):
+    fig = Figure(figsize=spec['size_inches'], dpi=spec['dpi'])
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+
+    foreground = spec['foreground']
+    fig.patch.set_facecolor(spec['figure_facecolor'])
+    ax.set_facecolor(spec['axes_facecolor'])
+    ax.spines['bottom'].set_color(foreground)
+    ax.spines['left'].set_color(foreground)
+    ax.tick_params(axis='x', colors=foreground)
+    ax.tick_params(axis='y', colors=foreground)
+    ax.xaxis.label.set_color(foreground)
+    ax.yaxis.label.set_color(foreground)
+    ax.title.set_color(foreground)
+
+    for x, y, color, label in spec['lines']:
+        ax.plot(x, y, color=color, label=label)
+    ax.set_xlim(spec['xlim'])
+    ax.set_ylim(spec['ylim'])
+    ax.set_xlabel(spec['xlabel'])
+    ax.set_ylabel(spec['ylabel'])
+    ax.set_title(spec['title'])
+    ax.set_yticks(*spec['yticks'])
+    if spec['legend']:
+        ax.legend()
+
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba()).copy()
+
+
+class AggRenderWorker(QObject):
+    frame_ready = pyqtSignal(int, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.condition = threading.Condition()
+        self.pending = None
+        self.running = True
+        self.thread = threading.Thread(target=self.render_loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, frame_id, spec):
+        with self.condition:
+            self.pending = (frame_id, spec)
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def render_loop(self):
+        while True:
+            with self.condition:
+                while self.pending is None and self.running:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                frame_id, spec = self.pending
+                self.pending = None
+            try:
+                pixels = render_plot_spec(spec)
+            except Exception as e:
+                print(f"Background render error: {e}")
+                continue
+            self.frame_ready.emit(frame_id, pixels)
+
+
+def nice_ticks(low, high, count=6):
+    span = high - low
+    if not np.isfinite(span) or span <= 0:
+        return np.array([low])
+    raw_step = span / count
+    magnitude = 10 ** np.floor(np.log10(raw_step))
+    for factor in (1, 2, 2.5, 5, 10):
+        step = factor * magnitude
+        if span / step <= count:
+            break
+    first = np.ceil(low / step) * step
+    return np.arange(first, high + step * 1e-9, step)
+
+
+def polyline(x, y):
+    polygon = QPolygonF(len(x))
+    buffer = polygon.data()
+    buffer.setsize(2 * len(x) * np.dtype(np.float64).itemsize)
+    points = np.frombuffer(buffer, dtype=np.float64)
+    points[0::2] = x
+    points[1::2] = y
+    return polygon
+
+
+class QPainterPlot(QWidget):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setAttribute(Qt.WA_OpaquePaintEvent, True)
+        self.traces = [(np.empty(0), np.empty(0))]
+        self.labels = []
+        self.yticks = None
+        self.xlim = (0.0, 1.0)
+        self.ylim = (0.0, 1.0)
+        self.xlabel = ""
+        self.ylabel = ""
+        self.title = None
+        self.legend = None
+        self.threaded_rendering = False
+        self.set_dark_mode(False)
+
+    def set_trace(self, x, y, index=0):
+        self.traces[index] = (np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+
+    def set_trace_count(self, count, labels=None, legend=True):
+        self.traces = (self.traces + [(np.empty(0), np.empty(0))] * count)[:count]
+        if labels is not None:
+            self.labels = list(labels)
+        if not legend:
+            self.labels = []
+        self.legend = None
+        self.update()
+
+    def set_xlim(self, left, right):
+        self.xlim = (float(left), float(right))
+
+    def set_yticks(self, positions=None, labels=None):
+        self.yticks = None if positions is None else list(zip(positions, labels))
+
+    def get_xlim(self):
+        return self.xlim
+
+    def set_ylim(self, bottom, top):
+        self.ylim = (float(bottom), float(top))
+
+    def set_labels(self, xlabel, ylabel, title=None, legend=None):
+        self.xlabel = xlabel
+        self.ylabel = ylabel
+        if title is not None:
+            self.title = title
+        if legend is not None:
+            self.legend = legend
+
+    def set_dark_mode(self, enabled):
+        theme = DARK_THEME if enabled else LIGHT_THEME
+        self.theme = theme
+        self.background = QColor(theme['background'])
+        self.foreground = QColor(theme['foreground'])
+        self.line_color = QColor(theme['line'])
+
+    def set_threaded_rendering(self, enabled):
+        # QPainter paths are cheap enough to stay on the GUI thread.
+        self.update()
+
+    def stop_rendering(self):
+        pass
+
+    def draw(self):
+        self.update()
+
+    def draw_trace(self):
+        self.update()
+
+    def plot_rect(self, metrics):
+        text_height = metrics.height()
+        widest = "-0.0000"
+        if self.yticks:
+            widest = max([widest] + [label for _, label in self.yticks], key=metrics.horizontalAdvance)
+        left = text_height + metrics.horizontalAdvance(widest) + 15
+        top = (text_height * 2 if self.title else text_height) + 5
+        bottom = text_height * 2 + 15
+        return QRectF(left, top, max(self.width() - left - 20, 1), max(self.height() - top - bottom, 1))
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), self.background)
+        metrics = painter.fontMetrics()
+        rect = self.plot_rect(metrics)
+        x0, x1 = self.xlim
+        y0, y1 = self.ylim
+        sx = rect.width() / (x1 - x0) if x1 != x0 else 1.0
+        sy = rect.height() / (y1 - y0) if y1 != y0 else 1.0
+
+        painter.setPen(QPen(self.foreground, 1))
+        painter.drawLine(rect.bottomLeft(), rect.bottomRight())
+        painter.drawLine(rect.bottomLeft(), rect.topLeft())
+
+        for tick in nice_ticks(x0, x1):
+            px = rect.left() + (tick - x0) * sx
+            painter.drawLine(QPointF(px, rect.bottom()), QPointF(px, rect.bottom() + 4))
+            label = f"{tick:g}"
+            painter.drawText(QPointF(px - metrics.horizontalAdvance(label) / 2, rect.bottom() + 6 + metrics.ascent()), label)
+        yticks = self.yticks if self.yticks is not None else [(tick, f"{tick:.4g}") for tick in nice_ticks(y0, y1)]
+        for tick, label in yticks:
+            py = rect.bottom() - (tick - y0) * sy
+            painter.drawLine(QPointF(rect.left() - 4, py), QPointF(rect.left(), py))
+            painter.drawText(QPointF(rect.left() - 8 - metrics.horizontalAdvance(label), py + metrics.ascent() / 2), label)
+
+        painter.drawText(QRectF(rect.left(), self.height() - metrics.height() - 5, rect.width(), metrics.height()),
+                         Qt.AlignHCenter, self.xlabel)
+        if self.title:
+            painter.drawText(QRectF(rect.left(), 5, rect.width(), metrics.height()), Qt.AlignHCenter, self.title)
+        painter.save()
+        painter.translate(5, rect.center().y())
+        painter.rotate(-90)
+        painter.drawText(QRectF(-rect.height() / 2, 0, rect.height(), metrics.height()), Qt.AlignHCenter, self.ylabel)
+        painter.restore()
+
+        for index, (x, y) in enumerate(self.traces):
+            if len(x) < 2:
+                continue
+            start, stop = np.searchsorted(x, (x0, x1))
+            start = max(start - 1, 0)
+            stop = min(stop + 1, len(x))
+            px = rect.left() + (x[start:stop] - x0) * sx
+            py = rect.bottom() - (y[start:stop] - y0) * sy
+            if len(px) > 4 * rect.width():
+                columns = px.astype(np.int64)
+                starts = np.concatenate(([0], np.flatnonzero(np.diff(columns)) + 1))
+                py = np.column_stack((np.minimum.reduceat(py, starts), np.maximum.reduceat(py, starts))).ravel()
+                px = np.repeat(px[starts], 2)
+            painter.save()
+            painter.setClipRect(rect)
+            pen = QPen(self.line_color if index == 0 else QColor(trace_color(self.theme, index)), 1)
+            pen.setCosmetic(True)
+            painter.setPen(pen)
+            painter.drawPolyline(polyline(px, py))
+            painter.restore()
+
+        if self.labels:
+            width = max(metrics.horizontalAdvance(label) for label in self.labels) + 45
+            row = metrics.height() + 4
+            box = QRectF(rect.right() - width - 8, rect.top() + 8, width, row * len(self.labels) + 6)
+            painter.setPen(QPen(self.foreground, 1))
+            painter.setBrush(self.background)
+            painter.drawRect(box)
+            for index, label in enumerate(self.labels):
+                middle = box.top() + 3 + row * index + row / 2
+                painter.setPen(QPen(self.line_color if index == 0 else QColor(trace_color(self.theme, index)), 1.5))
+                painter.drawLine(QPointF(box.left() + 8, middle), QPointF(box.left() + 30, middle))
+                painter.setPen(QPen(self.foreground, 1))
+                painter.drawText(QPointF(box.left() + 37, middle + metrics.ascent() / 2 - 1), label)
+        elif self.legend:
+            width = metrics.horizontalAdvance(self.legend) + 45
+            box = QRectF(rect.right() - width - 8, rect.top() + 8, width, metrics.height() + 10)
+            painter.setPen(QPen(self.foreground, 1))
+            painter.setBrush(self.background)
+            painter.drawRect(box)
+            painter.setPen(QPen(self.line_color, 1.5))
+            middle = box.center().y()
+            painter.drawLine(QPointF(box.left() + 8, middle), QPointF(box.left() + 30, middle))
+            painter.setPen(QPen(self.foreground, 1))
+            painter.drawText(QPointF(box.left() + 37, middle + metrics.ascent() / 2 - 1), self.legend)
+
+        painter.end()
@@ -0,0 +1,158 @@
+import os
+import sys
+import queue
+import datetime
+import threading
+import numpy as np
+import pandas as pd
+from streaming_filters import LiveFilterChain
+from chunked_recording import (ChunkedRecordingWriter, record_dtype, is_chunked_recording, open_recording,
+                               block_records, repair_recording)
+
+EXPORT_CHUNK = 100000
+
+
+def format_clock_times(epoch_seconds):
+    # "%H:%M:%S.%f" in local time for a whole block at once, the format load_data expects.
+    utc_offset = datetime.datetime.now().astimezone().utcoffset().total_seconds()
+    micros = np.round((np.asarray(epoch_seconds, dtype=np.float64) + utc_offset) * 1e6).astype('datetime64[us]')
+    iso = np.datetime_as_string(micros, unit='us').astype('U26')
+    return iso.view('U1').reshape(-1, 26)[:, 11:].copy().view('U15').ravel()
+
+
+def is_binary_recording(file_path):
+    return is_chunked_recording(file_path)
+
+
+def load_binary_recording(file_path):
+    # Blocks are memory-mapped; a crashed .part file yields every complete block it holds.
+    header, blocks, index = open_recording(file_path)
+    records = block_records(blocks, index)
+    times = records['time']
+    if len(times):
+        times = times - times[0]
+    return pd.DataFrame({'time': times, 'gradient.B': records[header['channels'][0]]})
+
+
+def export_csv(binary_path, csv_path):
+    header, blocks, index = open_recording(binary_path)
+    channels = header['channels']
+    step = max(1, EXPORT_CHUNK // header['block_samples'])
+    names = ["Time", "Value"] + (["Filtered"] if len(channels) > 1 else [])
+    with open(csv_path, "w", encoding="utf-8") as file:
+        file.write(", ".join(names) + "\n")
+        for start in range(0, len(blocks), step):
+            records = block_records(blocks[start:start + step], index[start:start + step])
+            rows = format_clock_times(records['time'])
+            for channel in channels:
+                rows = np.char.add(np.char.add(rows, ","), records[channel].astype(str))
+            file.write("\n".join(rows.tolist()) + "\n")
+
+
+class StreamRecorder:
+    # Streams raw sample blocks with their device timestamps to <path>.part from a writer
+    # thread, in the chunked format of chunked_recording; on stop() the file is closed with
+    # its index and renamed into place (binary) or exported to the "Time, Value" CSV read by
+    # load_data, with the timestamps formatted in bulk. If filter_settings is given, the
+    # writer also runs its own streaming filter chain and stores a filtered channel.
+
+    def __init__(self, path, binary=False, sample_rate=480, filter_settings=None, flush_interval=1.0, block_samples=512):
+        self.path = path
+        self.temp_path = path + ".part"
+        self.binary = binary
+        self.sample_rate = sample_rate
+        self.filter_settings = filter_settings
+        self.filter_chain = LiveFilterChain(sample_rate) if filter_settings is not None else None
+        self.channels = ['gradient.B'] + (['gradient.B.filtered'] if filter_settings is not None else [])
+        self.dtype = record_dtype(self.channels)
+        self.flush_interval = flush_interval
+        self.block_samples = block_samples
+        self.queue = queue.Queue()
+        self.thread = None
+        self.error = None
+        self.samples_written = 0
+
+    def start(self):
+        self.file = ChunkedRecordingWriter(self.temp_path, self.sample_rate, self.channels,
+                                           datetime.datetime.now().timestamp(), self.block_samples)
+        self.thread = threading.Thread(target=self.writer_loop, daemon=True)
+        self.thread.start()
+
+    def write(self, timestamps, values):
+        # Called from the ingest side; copies so the caller may reuse its buffers.
+        self.queue.put((np.array(timestamps, dtype=np.float64), np.array(values, dtype=np.float64)))
+
+    def writer_loop(self):
+        last_flush = datetime.datetime.now()
+        while True:
+            try:
+                block = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                block = ()
+            if block is None:
+                break
+            try:
+                if block:
+                    self.write_block(*block)
+                now = datetime.datetime.now()
+                if (now - last_flush).total_seconds() >= self.flush_interval:
+                    self.file.flush()
+                    last_flush = now
+            except Exception as e:
+                self.error = e
+                print(f"Recording error: {e}")
+                break
+
+    def write_block(self, timestamps, values):
+        records = np.empty(len(values), dtype=self.dtype)
+        records['time'] = timestamps
+        records['gradient.B'] = values
+        if self.filter_chain is not None:
+            records['gradient.B.filtered'] = self.filter_chain.process(values, self.filter_settings())
+        self.file.append(records)
+        self.samples_written += len(values)
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+        if self.binary:
+            os.replace(self.temp_path, self.path)
+        else:
+            export_csv(self.temp_path, self.path)
+            os.remove(self.temp_path)
+        return self.path
+
+
+def recover_recording(part_path):
+    # Finishes a .part file left behind when the recorder did not stop cleanly, as stop()
+    # would have: cut after the last complete block with a fresh index, then renamed into
+    # place (binary) or exported (CSV). Returns (path, samples recovered).
+    if not part_path.endswith(".part"):
+        raise ValueError(f"{part_path} is not a .part recording")
+    path = part_path[:-len(".part")]
+    repair_recording(part_path)
+    header, blocks, index = open_recording(part_path)
+    samples = int(index['count'].sum())
+    del blocks
+    if path.endswith(".csv"):
+        export_csv(part_path, path)
+        os.remove(part_path)
+    else:
+        os.replace(part_path, path)
+    return path, samples
+
+
+if __name__ == "__main__":
+    # python recording.py <file.part>...: recovers recordings left behind by a crash.
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python recording.py <recording.part>...")
+    failed = False
+    for part_path in sys.argv[1:]:
+        try:
+            path, samples = recover_recording(part_path)
+            print(f"Recovered {path} ({samples} samples)")
+        except (OSError, ValueError) as e:
+            print(f"{part_path}: {e}")
+            failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,117 @@
+from multiprocessing import shared_memory
+import numpy as np
+
+# Ring element for streams that keep each sample's device timestamp next to its value.
+SAMPLE_RECORD = np.dtype([('time', '<f8'), ('value', '<f8')])
+
+
+class SampleRingBuffer:
+    # Single-producer / single-consumer ring over a preallocated array. Each sample is
+    # stored at slot and slot + capacity, so the newest n samples are always one
+    # contiguous view. Only the producer assigns write_index and only the consumer
+    # assigns read_index, each after the data it covers is in place.
+
+    def __init__(self, capacity, dtype=np.float64):
+        self.capacity = int(capacity)
+        self.data = np.zeros(2 * self.capacity, dtype=dtype)
+        self.write_index = 0
+        self.read_index = 0
+
+    def __len__(self):
+        return min(self.write_index, self.capacity)
+
+    def push(self, value):
+        position = self.write_index % self.capacity
+        self.data[position] = value
+        self.data[position + self.capacity] = value
+        self.write_index += 1
+
+    def extend(self, values):
+        values = np.asarray(values)
+        count = len(values)
+        if count == 0:
+            return
+        if count > self.capacity:
+            values = values[-self.capacity:]
+        position = (self.write_index + count - len(values)) % self.capacity
+        head = min(len(values), self.capacity - position)
+        self.data[position:position + head] = values[:head]
+        self.data[position + self.capacity:position + self.capacity + head] = values[:head]
+        tail = len(values) - head
+        if tail:
+            self.data[:tail] = values[head:]
+            self.data[self.capacity:self.capacity + tail] = values[head:]
+        self.write_index += count
+
+    def latest(self, count):
+        count = min(count, len(self))
+        end = self.write_index % self.capacity + self.capacity
+        return self.data[end - count:end]
+
+    def available(self):
+        return self.write_index - self.read_index
+
+    def read(self, max_count=None):
+        # Returns (view, dropped): the samples written since the last read, oldest first,
+        # and how many were overwritten before the consumer got to them.
+        write_index = self.write_index
+        pending = write_index - self.read_index
+        dropped = max(pending - self.capacity, 0)
+        pending -= dropped
+        if max_count is not None:
+            pending = min(pending, max_count)
+        start = self.read_index + dropped
+        end = (start + pending) % self.capacity + self.capacity
+        self.read_index = start + pending
+        return self.data[end - pending:end], dropped
+
+
+class SharedMemoryRingBuffer(SampleRingBuffer):
+    # Same ring, with the samples and both indices in a multiprocessing.shared_memory block
+    # so the producer can live in another process. Header slots: write index, read index,
+    # heartbeat (bumped by the producer while it is alive).
+    HEADER_SLOTS = 3
+
+    def __init__(self, capacity, name=None, create=True, dtype=np.float64):
+        self.capacity = int(capacity)
+        header_bytes = 8 * self.HEADER_SLOTS
+        size = header_bytes + 2 * self.capacity * np.dtype(dtype).itemsize
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        self.owner = create
+        self.name = self.shm.name
+        self.header = np.ndarray((self.HEADER_SLOTS,), dtype=np.int64, buffer=self.shm.buf)
+        self.data = np.ndarray((2 * self.capacity,), dtype=dtype, buffer=self.shm.buf, offset=header_bytes)
+        if create:
+            self.header[:] = 0
+            self.data[:] = 0
+
+    @property
+    def write_index(self):
+        return int(self.header[0])
+
+    @write_index.setter
+    def write_index(self, value):
+        self.header[0] = value
+
+    @property
+    def read_index(self):
+        return int(self.header[1])
+
+    @read_index.setter
+    def read_index(self, value):
+        self.header[1] = value
+
+    @property
+    def heartbeat(self):
+        return int(self.header[2])
+
+    def beat(self):
+        self.header[2] += 1
+
+    def close(self):
+        # The numpy views pin the mapping; drop them before closing it.
+        self.header = None
+        self.data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
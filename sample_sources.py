@@ -0,0 +1,238 @@
+import os
+import time
+import numpy as np
+from acquisition import SAMPLE_RATE, DECIMATION_MODE, open_sensor_session, stream_blocks, device_decimation, \
+    effective_sample_rate
+from backend import detect_sensor_ports
+from data_processing import load_data
+from sensor_emulator import SensorEmulator
+from streaming_filters import PolyphaseResampler, resample_ratio
+
+# MKG_SOURCE picks what feeds the live pipeline: "sensor" (default) for the TIO device,
+# "synthetic" for generated MCG, or the path of any file load_data reads for replay.
+# Prefixing with "pty:" ("pty:synthetic", "pty:recording.mkgb") serves the samples through
+# sensor_emulator instead, so they also go through the serial port, SLIP and TIO decoding.
+# MKG_SOURCE_SPEED plays non-sensor sources faster than real time (1 to 100), and
+# MKG_SOURCE_CHANNELS runs that many of them side by side, like an array of sensors.
+SAMPLE_SOURCE = os.environ.get("MKG_SOURCE", "sensor")
+SOURCE_SPEED = float(os.environ.get("MKG_SOURCE_SPEED", "1"))
+SOURCE_CHANNELS = int(os.environ.get("MKG_SOURCE_CHANNELS", "1"))
+
+
+class SensorSource:
+    # The TIO device behind detect_sensor_port (or an explicit port), decimating by
+    # decimation on the device.
+
+    def __init__(self, column="gradient", port=None, emulator=None, decimation=1):
+        self.column = column
+        self.port = port
+        self.emulator = emulator
+        self.decimation = decimation
+        self.session = None
+        self.column_index = None
+        self.sample_rate = None
+
+    def open(self):
+        if self.emulator is not None:
+            self.emulator.start()
+        self.session, self.column_index = open_sensor_session(self.column, port=self.port, decimation=self.decimation)
+        if self.column_index is None:
+            return False
+        self.sample_rate = self.session.source_rate(self.column)
+        return True
+
+    def run(self, stop_event, on_block, on_idle=None):
+        stream_blocks(self.session, self.column_index, stop_event, on_block, on_idle=on_idle)
+
+    def queue_depth(self):
+        # STREAM0 packets decoded by the session but not yet taken by stream_blocks.
+        return self.session.pub_queue.qsize() if self.session is not None else 0
+
+    def close(self):
+        if self.session is not None:
+            self.session.shutdown()
+            self.session = None
+        if self.emulator is not None:
+            self.emulator.stop()
+            self.emulator = None
+
+
+class PacedSource:
+    # Base for sources that make up their samples: run() hands out whatever is due at
+    # speed x real time every block_interval, stamped like device samples
+    # (start time + sample number / sample rate). Subclasses implement generate().
+
+    def __init__(self, sample_rate=480, speed=1.0, block_interval=0.02):
+        self.sample_rate = sample_rate
+        self.speed = speed
+        self.block_interval = block_interval
+        self.start_time = None
+        self.emitted = 0
+
+    def open(self):
+        return True
+
+    def read(self, count):
+        # Returns (timestamps, values) for the next count samples, or None when exhausted.
+        if self.start_time is None:
+            self.start_time = time.time()
+        block = self.generate(self.emitted, count)
+        if block is None:
+            return None
+        timestamps, values = block
+        self.emitted += len(values)
+        return self.start_time + timestamps, values
+
+    def run(self, stop_event, on_block, on_idle=None):
+        started = time.perf_counter()
+        first = self.emitted
+        while not stop_event.is_set():
+            due = first + int((time.perf_counter() - started) * self.speed * self.sample_rate)
+            if due > self.emitted:
+                block = self.read(due - self.emitted)
+                if block is None:
+                    print("Sample source finished.")
+                    break
+                on_block(*block)
+            if on_idle is not None:
+                on_idle()
+            stop_event.wait(self.block_interval)
+
+    def queue_depth(self):
+        return 0
+
+    def close(self):
+        pass
+
+
+class SyntheticSource(PacedSource):
+    # MCG-like test signal: a P-QRS-T complex every beat on top of baseline wander, mains
+    # interference and white noise, so every live filter has something to remove.
+    WAVES = ((0.20, 0.12, 0.025), (0.35, -0.10, 0.010), (0.37, 1.00, 0.010),
+             (0.39, -0.25, 0.010), (0.60, 0.30, 0.040))
+
+    def __init__(self, sample_rate=480, speed=1.0, heart_rate=72, mains=50, mains_amplitude=0.3,
+                 wander_amplitude=0.5, noise=0.05, seed=0, **options):
+        super().__init__(sample_rate, speed, **options)
+        self.beat_period = 60.0 / heart_rate
+        self.mains = mains
+        self.mains_amplitude = mains_amplitude
+        self.wander_amplitude = wander_amplitude
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+
+    def generate(self, first, count):
+        t = (first + np.arange(count)) / self.sample_rate
+        phase = np.mod(t, self.beat_period)
+        values = np.zeros(count)
+        for center, amplitude, width in self.WAVES:
+            values += amplitude * np.exp(-0.5 * ((phase - center) / width) ** 2)
+        values += self.wander_amplitude * np.sin(2 * np.pi * 0.3 * t)
+        values += self.mains_amplitude * np.sin(2 * np.pi * self.mains * t)
+        values += self.noise * self.rng.standard_normal(count)
+        return t, values
+
+
+class ReplaySource(PacedSource):
+    # Plays back any file load_data understands, looping by default, with the recorded
+    # sample spacing; the sample rate is taken from the median time step.
+
+    def __init__(self, path, speed=1.0, loop=True, **options):
+        super().__init__(speed=speed, **options)
+        self.path = path
+        self.loop = loop
+        self.times = None
+        self.values = None
+
+    def open(self):
+        data = load_data(self.path)
+        if data is None or len(data) < 2:
+            print(f"Nothing to replay in {self.path}")
+            return False
+        self.times = data['time'].to_numpy(dtype=np.float64)
+        self.times = self.times - self.times[0]
+        self.values = data['gradient.B'].to_numpy(dtype=np.float64)
+        step = float(np.median(np.diff(self.times)))
+        self.sample_rate = 1.0 / step
+        self.duration = self.times[-1] + step
+        print(f"Replaying {len(self.values)} samples at {self.sample_rate:.1f} Hz from {self.path}")
+        return True
+
+    def generate(self, first, count):
+        length = len(self.values)
+        if not self.loop:
+            count = min(count, length - first)
+            if count <= 0:
+                return None
+        positions = first + np.arange(count)
+        laps, indices = np.divmod(positions, length)
+        return self.times[indices] + laps * self.duration, self.values[indices]
+
+
+class ResampledSource:
+    # Any source brought to sample_rate on the host by PolyphaseResampler; with
+    # decimation="device" it is decimated by the integer factor the sensor would use.
+
+    def __init__(self, source, sample_rate, decimation="host"):
+        self.source = source
+        self.target_rate = sample_rate
+        self.decimation = decimation
+        self.resampler = None
+        self.sample_rate = None
+
+    def open(self):
+        if not self.source.open():
+            return False
+        source_rate = self.source.sample_rate
+        self.sample_rate = effective_sample_rate(self.target_rate, self.decimation, source_rate)
+        up, down = resample_ratio(self.sample_rate, source_rate)
+        if up != down:
+            self.resampler = PolyphaseResampler(up, down)
+            print(f"Resampling {source_rate:g} Hz to {self.sample_rate:g} Hz")
+        return True
+
+    def run(self, stop_event, on_block, on_idle=None):
+        def resample(timestamps, values):
+            timestamps, values = self.resampler.process(timestamps, values)
+            if len(values):
+                on_block(timestamps, values)
+
+        self.source.run(stop_event, resample if self.resampler is not None else on_block, on_idle=on_idle)
+
+    def queue_depth(self):
+        return self.source.queue_depth()
+
+    def close(self):
+        self.source.close()
+
+
+def sample_source_ports(spec=None, channels=None):
+    # One entry per channel: the serial port of each sensor, None for simulated channels.
+    spec = SAMPLE_SOURCE if spec is None else spec
+    if spec == "sensor":
+        return detect_sensor_ports()
+    return [None] * (SOURCE_CHANNELS if channels is None else channels)
+
+
+def create_sample_source(spec=None, speed=None, column="gradient", index=0, port=None, sample_rate=None,
+                         decimation=None):
+    # sample_rate defaults to MKG_SAMPLE_RATE; 0 keeps the source at its own rate.
+    spec = SAMPLE_SOURCE if spec is None else spec
+    speed = SOURCE_SPEED if speed is None else speed
+    sample_rate = SAMPLE_RATE if sample_rate is None else sample_rate
+    decimation = DECIMATION_MODE if decimation is None else decimation
+    device = decimation == "device" and sample_rate
+    if spec.startswith("pty:"):
+        emulator = SensorEmulator(create_sample_source(spec[4:], speed, column, index, sample_rate=0), column=column)
+        source = SensorSource(column, port=emulator.port, emulator=emulator,
+                              decimation=device_decimation(sample_rate) if device else 1)
+    elif spec == "sensor":
+        source = SensorSource(column, port=port, decimation=device_decimation(sample_rate) if device else 1)
+    elif spec == "synthetic":
+        # Slightly different heart rates keep simulated channels apart on screen.
+        source = SyntheticSource(speed=speed, heart_rate=72 + 4 * index, seed=index)
+    else:
+        source = ReplaySource(spec, speed=speed)
+    if not sample_rate or (device and isinstance(source, SensorSource)):
+        return source
+    return ResampledSource(source, sample_rate, decimation)
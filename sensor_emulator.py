@@ -0,0 +1,171 @@
+import os
+import sys
+import time
+import struct
+import select
+import binascii
+import threading
+import numpy as np
+import tio
+from slip_decoder import SlipDecoder
+
+FLOAT32_SOURCE = 66  # tio.TYPES code of a float32 column
+STREAM0_ROW = np.dtype([('type', 'u1'), ('routing', 'u1'), ('size', '<u2'), ('sample', '<u4'), ('value', '<f4')])
+
+
+def slip_frame(packet):
+    msg = packet + struct.pack("<I", binascii.crc32(packet))
+    return b"\xC0" + msg.replace(b"\xDB", b"\xDB\xDD").replace(b"\xC0", b"\xDB\xDC") + b"\xC0"
+
+
+def tio_packet(packet_type, payload):
+    return struct.pack("<BBH", packet_type, 0, len(payload)) + payload
+
+
+class SensorEmulator:
+    # Serves a sample source as a TIO device on a pseudo-terminal (POSIX only). It answers the
+    # RPCs CustomTIOSession and AsyncSensor make, sends timebase/source/stream metadata on
+    # data.send_all and from then on streams the source as SLIP-framed STREAM0 packets, one
+    # float32 sample each, like the sensor. Open .port like a serial port.
+
+    def __init__(self, source, column="gradient", name="MKG emulator"):
+        import tty  # POSIX only, like the pty itself
+        self.source = source
+        self.column = column
+        self.name = name
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.link = None
+        self.port = self.link_port(os.ttyname(self.slave))
+        self.decoder = SlipDecoder()
+        self.write_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.stream_thread = None
+        self.serve_thread = None
+        self.sample_number = 0
+        self.stream_start = None
+        self.decimation = 1
+        self.source_samples = 0
+
+    def link_port(self, pty_path):
+        # tio reads serial URLs as /dev/<device>[/<routing>...], so /dev/pts/<n> would be opened
+        # as "/dev/pts". Where /dev is writable (CI, containers) the pty gets a flat alias; the
+        # asyncio backend opens the plain pty path either way.
+        if pty_path.count("/") <= 2:
+            return pty_path
+        link = "/dev/mkg-emulator-" + os.path.basename(pty_path)
+        try:
+            if os.path.lexists(link):
+                os.remove(link)
+            os.symlink(pty_path, link)
+        except OSError:
+            print(f"Cannot alias {pty_path} under /dev; TIOSession will not open it, use MKG_ACQUISITION=asyncio.")
+            return pty_path
+        self.link = link
+        return link
+
+    def start(self):
+        if not self.source.open():
+            raise IOError("Sample source could not be opened.")
+        self.serve_thread = threading.Thread(target=self.serve, daemon=True)
+        self.serve_thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        for thread in (self.serve_thread, self.stream_thread):
+            if thread is not None:
+                thread.join(2)
+        self.source.close()
+        os.close(self.master)
+        os.close(self.slave)
+        if self.link is not None:
+            os.remove(self.link)
+
+    def send(self, data):
+        with self.write_lock:
+            view = memoryview(data)
+            while view and not self.stop_event.is_set():
+                try:
+                    written = os.write(self.master, view)
+                except BlockingIOError:
+                    time.sleep(0.001)
+                    continue
+                view = view[written:]
+
+    def serve(self):
+        while not self.stop_event.is_set():
+            readable, _, _ = select.select([self.master], [], [], 0.05)
+            if not readable:
+                continue
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                break
+            for packet in self.decoder.feed(data):
+                if packet[0] == tio.TL_PTYPE_RPC_REQ:
+                    self.handle_rpc(packet)
+
+    def handle_rpc(self, packet):
+        request_id, method_id = struct.unpack_from("<HH", packet, 4)
+        topic = packet[8:8 + method_id - 0x8000].decode("utf-8", "replace")
+        replies = {'dev.desc': self.name.encode("utf-8"), 'dev.name': self.name.encode("utf-8"),
+                   'rpc.list': struct.pack("<H", 0)}
+        self.send(slip_frame(tio_packet(tio.TL_PTYPE_RPC_REP, struct.pack("<H", request_id) + replies.get(topic, b""))))
+        if topic == f"{self.column}.data.decimation" and len(packet) >= 12 + len(topic):
+            self.set_decimation(struct.unpack_from("<I", packet, 8 + len(topic))[0])
+        if topic == "data.send_all":
+            self.send_metadata()
+            if self.stream_thread is None:
+                self.stream_thread = threading.Thread(target=self.source.run, args=(self.stop_event, self.send_samples), daemon=True)
+                self.stream_thread.start()
+
+    def set_decimation(self, decimation):
+        # Like the sensor: keep every decimation-th sample (no anti-aliasing) and announce the
+        # lower rate with new stream metadata. Sample numbers count output rows, so they are
+        # rescaled to keep timestamps continuous.
+        decimation = max(decimation, 1)
+        self.sample_number = self.sample_number * self.decimation // decimation
+        self.decimation = decimation
+        self.send_metadata()
+
+    def send_metadata(self):
+        sample_rate = int(round(self.source.sample_rate))
+        if self.stream_start is None:
+            self.stream_start = time.time()
+        timebase = struct.pack("<HBBQLLLf", 0, 0, 0, int(self.stream_start * 1e9), 1000000, sample_rate, 0, 0.0) + bytes(16)
+        source = struct.pack("<HHLLIHHB", 0, 0, 1, 0, 0, 0, 1, FLOAT32_SOURCE) + self.column.encode("utf-8")
+        stream = struct.pack("<HHLLQHH", 0, 0, self.decimation, 0, self.sample_number, 1, 0) + struct.pack("<HHLL", 0, 0, 1, 0)
+        for packet_type, payload in ((tio.TL_PTYPE_TIMEBASE, timebase), (tio.TL_PTYPE_SOURCE, source),
+                                     (tio.TL_PTYPE_STREAM, stream)):
+            self.send(slip_frame(tio_packet(packet_type, payload)))
+
+    def send_samples(self, timestamps, values):
+        first = self.source_samples
+        self.source_samples += len(values)
+        values = values[-first % self.decimation::self.decimation]
+        rows = np.empty(len(values), dtype=STREAM0_ROW)
+        rows['type'] = tio.TL_PTYPE_STREAM0
+        rows['routing'] = 0
+        rows['size'] = 8
+        rows['sample'] = self.sample_number + np.arange(len(values))
+        rows['value'] = values
+        self.sample_number += len(values)
+        data = rows.tobytes()
+        size = STREAM0_ROW.itemsize
+        self.send(b"".join(slip_frame(data[start:start + size]) for start in range(0, len(data), size)))
+
+
+if __name__ == "__main__":
+    # python sensor_emulator.py [synthetic|<recording>] [speed]; then run the live view with
+    # MKG_SENSOR_PORT set to the printed port.
+    from sample_sources import create_sample_source
+    spec = sys.argv[1] if len(sys.argv) > 1 else "synthetic"
+    speed = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    emulator = SensorEmulator(create_sample_source(spec, speed, sample_rate=0))
+    emulator.start()
+    print(f"Emulating the sensor on {emulator.port}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        emulator.stop()
@@ -0,0 +1,81 @@
+import binascii
+import struct
+import slip
+
+SLIP_END = slip.SLIP_END_CHAR
+SLIP_ESC = b"\xDB"
+SLIP_ESC_END = b"\xDB\xDC"
+SLIP_ESC_ESC = b"\xDB\xDD"
+
+
+class SlipDecoder:
+    # Incremental SLIP deframer. Incoming bytes are appended to one bytearray that is
+    # scanned from a moving offset, so each byte is searched once no matter how many
+    # frames arrive together or in how many pieces a long frame arrives (scanned marks how
+    # far an unterminated frame has been searched). Consumed bytes are only cut off once
+    # the offset passes compact_threshold (or the buffer is fully consumed), keeping the
+    # memmove amortised.
+
+    def __init__(self, compact_threshold=65536):
+        self.buffer = bytearray()
+        self.offset = 0
+        self.scanned = 0
+        self.compact_threshold = compact_threshold
+        self.frames = 0
+        self.errors = 0
+
+    def pending(self):
+        return len(self.buffer) - self.offset
+
+    def feed(self, data):
+        buffer = self.buffer
+        buffer += data
+        packets = []
+        start = self.offset
+        search = max(start, self.scanned)
+        with memoryview(buffer) as view:
+            while True:
+                end = buffer.find(SLIP_END, search)
+                if end < 0:
+                    break
+                if end > start:
+                    packet = self.decode_frame(buffer, view, start, end)
+                    if packet is not None:
+                        packets.append(packet)
+                start = end + 1
+                search = start
+        self.scanned = len(buffer)
+        if start == len(buffer):
+            buffer.clear()
+            self.scanned = 0
+            start = 0
+        elif start >= self.compact_threshold:
+            del buffer[:start]
+            self.scanned -= start
+            start = 0
+        self.offset = start
+        return packets
+
+    def decode_frame(self, buffer, view, start, end):
+        self.frames += 1
+        if buffer.find(SLIP_ESC, start, end) < 0:
+            msg = view[start:end]
+        else:
+            escaped = bytes(view[start:end])
+            if escaped.count(SLIP_ESC) != escaped.count(SLIP_ESC_END) + escaped.count(SLIP_ESC_ESC):
+                self.errors += 1
+                return None
+            msg = memoryview(escaped.replace(SLIP_ESC_END, b"\xC0").replace(SLIP_ESC_ESC, SLIP_ESC))
+        if len(msg) < 4:
+            self.errors += 1
+            return None
+        payload = msg[:-4]
+        if binascii.crc32(payload) != struct.unpack_from("<I", msg, len(msg) - 4)[0]:
+            self.errors += 1
+            return None
+        return bytes(payload)
+
+    def reset(self):
+        self.buffer.clear()
+        self.offset = 0
+        self.scanned = 0
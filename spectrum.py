@@ -0,0 +1,229 @@
+import os
+import threading
+import numpy as np
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QSizePolicy
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.figure import Figure
+from plot_backends import DARK_THEME, LIGHT_THEME, trace_color
+
+# Spectrum panel refreshes per second, and the time constant of its running average (s).
+SPECTRUM_RATE = float(os.environ.get("MKG_SPECTRUM_RATE", "4"))
+SPECTRUM_AVERAGE = float(os.environ.get("MKG_SPECTRUM_AVERAGE", "5"))
+SPECTROGRAM_SECONDS = 30
+# Peaks below this are baseline wander rather than anything a notch would remove.
+PEAK_MIN_FREQ = 2.0
+
+
+class StreamingSpectrum:
+    # Welch PSD of a stream, updated as samples arrive: every complete Hann segment (50%
+    # overlap, mean removed, density scaling as scipy.signal.welch) is transformed once and
+    # folded into an exponential average, and also becomes a row of the spectrogram. New
+    # samples cost their own segments' FFTs and nothing is recomputed over the buffer.
+
+    def __init__(self, sample_rate, segment=None, average_seconds=SPECTRUM_AVERAGE, spectrogram_seconds=SPECTROGRAM_SECONDS):
+        self.sample_rate = sample_rate
+        # About one second per segment, as a power of two: 512 samples (0.94 Hz bins) at 480 Hz.
+        self.segment = segment or 2 ** max(int(round(np.log2(sample_rate))), 4)
+        self.hop = self.segment // 2
+        self.window = np.hanning(self.segment + 1)[:-1]
+        self.scale = 1.0 / (sample_rate * np.sum(self.window ** 2))
+        self.frequencies = np.fft.rfftfreq(self.segment, 1.0 / sample_rate)
+        self.decay = np.exp(-self.hop / (sample_rate * average_seconds))
+        self.rows = np.zeros((max(int(spectrogram_seconds * sample_rate / self.hop), 1), len(self.frequencies)))
+        self.row_count = 0
+        self.psd = None
+        self.pending = np.empty(0)
+        self.lock = threading.Lock()
+
+    def reset(self):
+        # After a gap the pending samples no longer join up with the new ones.
+        self.pending = np.empty(0)
+
+    def feed(self, values):
+        # Returns the number of new segments.
+        self.pending = np.concatenate([self.pending, np.asarray(values, dtype=np.float64)])
+        if len(self.pending) < self.segment:
+            return 0
+        count = (len(self.pending) - self.segment) // self.hop + 1
+        segments = self.pending[np.arange(count)[:, None] * self.hop + np.arange(self.segment)]
+        segments = segments - segments.mean(axis=1, keepdims=True)
+        power = np.abs(np.fft.rfft(segments * self.window, axis=1)) ** 2 * self.scale
+        power[:, 1:-1 if self.segment % 2 == 0 else None] *= 2
+        self.pending = self.pending[count * self.hop:]
+
+        with self.lock:
+            # The running average after count more segments, in one step.
+            weights = (1 - self.decay) * self.decay ** np.arange(count - 1, -1, -1)
+            if self.psd is None:
+                self.psd = power[0]
+            self.psd = self.decay ** count * self.psd + weights @ power
+            for row in power[-len(self.rows):]:
+                self.rows[self.row_count % len(self.rows)] = row
+                self.row_count += 1
+        return count
+
+    def snapshot(self):
+        # (psd, spectrogram rows oldest first), or None before the first segment.
+        with self.lock:
+            if self.psd is None:
+                return None
+            start = self.row_count % len(self.rows)
+            rows = np.roll(self.rows, -start, axis=0) if self.row_count >= len(self.rows) else self.rows[:self.row_count].copy()
+            return self.psd.copy(), rows
+
+    def peak(self, psd):
+        # Strongest frequency, between bins by a parabola through the log power around it.
+        band = np.flatnonzero(self.frequencies >= PEAK_MIN_FREQ)
+        if len(band) == 0:
+            return None
+        index = band[np.argmax(psd[band])]
+        offset = 0.0
+        if 0 < index < len(psd) - 1:
+            left, centre, right = np.log(psd[index - 1:index + 2] + 1e-30)
+            curvature = left - 2 * centre + right
+            if curvature < 0:
+                offset = 0.5 * (left - right) / curvature
+        return self.frequencies[index] + offset * self.sample_rate / self.segment
+
+
+class SpectrumWorker:
+    # Feeds one StreamingSpectrum per channel from the channels' raw sample rings (this
+    # thread is their only reader), update_rate times a second, on its own thread; the panel
+    # only copies out the results.
+
+    def __init__(self, taps, sample_rate, update_rate=SPECTRUM_RATE):
+        self.taps = taps
+        self.spectra = [StreamingSpectrum(sample_rate) for _ in taps]
+        self.update_rate = update_rate
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        # Skip what arrived while the panel was hidden.
+        for tap, spectrum in zip(self.taps, self.spectra):
+            tap.read()
+            spectrum.reset()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stop_event.wait(1.0 / self.update_rate):
+            for tap, spectrum in zip(self.taps, self.spectra):
+                try:
+                    records, dropped = tap.read()
+                    if dropped:
+                        spectrum.reset()
+                    spectrum.feed(records['value'])
+                except Exception as e:
+                    print(f"Error in spectrum worker: {e}")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+            self.thread = None
+
+
+class SpectrumPanel(QWidget):
+    # PSD of every sensor (dB) next to a scrolling spectrogram of the first one, to spot mains
+    # interference and pick notch frequencies. Hidden, it costs nothing: the worker only runs
+    # while the panel is shown.
+
+    def __init__(self, taps, sample_rate, names, update_rate=SPECTRUM_RATE, parent=None):
+        super().__init__(parent)
+        self.names = names
+        self.worker = SpectrumWorker(taps, sample_rate, update_rate)
+        self.theme = LIGHT_THEME
+
+        self.figure = Figure(figsize=(5, 2.5), dpi=100, tight_layout=True)
+        self.psd_axes = self.figure.add_subplot(121)
+        self.spectrogram_axes = self.figure.add_subplot(122)
+        self.psd_lines = [self.psd_axes.plot([], [], label=name, linewidth=1)[0] for name in names]
+        self.psd_axes.set_xlim(0, sample_rate / 2)
+        self.psd_axes.set_xlabel('Frequency (Hz)')
+        self.psd_axes.set_ylabel('PSD (dB)')
+        if len(names) > 1:
+            self.psd_axes.legend(loc='upper right')
+        self.image = None
+        self.spectrogram_axes.set_xlabel('Time (s)')
+        self.spectrogram_axes.set_ylabel('Frequency (Hz)')
+        self.spectrogram_axes.set_title(names[0] if names else "")
+
+        self.plot = FigureCanvas(self.figure)
+        self.plot.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.plot)
+        self.setMinimumHeight(250)
+
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.refresh)
+        self.set_dark_mode(False)
+
+    def set_enabled(self, enabled):
+        self.setVisible(enabled)
+        if enabled:
+            self.worker.start()
+            self.timer.start(int(1000 / self.worker.update_rate))
+        else:
+            self.timer.stop()
+            self.worker.stop()
+
+    def refresh(self):
+        spectra = self.worker.spectra
+        snapshots = [spectrum.snapshot() for spectrum in spectra]
+        if not snapshots or snapshots[0] is None:
+            return
+        floor = 1e-20
+        low, high = None, None
+        for line, spectrum, snapshot in zip(self.psd_lines, spectra, snapshots):
+            if snapshot is None:
+                continue
+            db = 10 * np.log10(snapshot[0] + floor)
+            line.set_data(spectrum.frequencies, db)
+            low = db.min() if low is None else min(low, db.min())
+            high = db.max() if high is None else max(high, db.max())
+        self.psd_axes.set_ylim(low - 5, high + 5)
+        peak = spectra[0].peak(snapshots[0][0])
+        self.psd_axes.set_title(f"Peak: {peak:.1f} Hz" if peak is not None else "")
+
+        spectrum = spectra[0]
+        rows = 10 * np.log10(snapshots[0][1] + floor)
+        seconds = len(rows) * spectrum.hop / spectrum.sample_rate
+        extent = (-seconds, 0, 0, spectrum.sample_rate / 2)
+        if self.image is None:
+            self.image = self.spectrogram_axes.imshow(rows.T, aspect='auto', origin='lower', extent=extent,
+                                                      cmap='viridis', interpolation='nearest')
+        else:
+            self.image.set_data(rows.T)
+            self.image.set_extent(extent)
+        self.image.set_clim(np.percentile(rows, 5), rows.max())
+        self.spectrogram_axes.set_xlim(-SPECTROGRAM_SECONDS, 0)
+        self.plot.draw_idle()
+
+    def set_dark_mode(self, enabled):
+        theme = DARK_THEME if enabled else LIGHT_THEME
+        self.theme = theme
+        foreground = theme['foreground']
+        self.figure.patch.set_facecolor(theme['background'])
+        for axes in (self.psd_axes, self.spectrogram_axes):
+            axes.set_facecolor(theme['background'])
+            for spine in axes.spines.values():
+                spine.set_color(foreground)
+            axes.tick_params(axis='both', colors=foreground)
+            axes.xaxis.label.set_color(foreground)
+            axes.yaxis.label.set_color(foreground)
+            axes.title.set_color(foreground)
+        for index, line in enumerate(self.psd_lines):
+            line.set_color(trace_color(theme, index))
+        if self.psd_axes.get_legend() is not None:
+            self.psd_axes.legend(loc='upper right')
+        self.plot.draw_idle()
+
+    def close_panel(self):
+        self.timer.stop()
+        self.worker.stop()
@@ -0,0 +1,378 @@
+import os
+from bisect import bisect_left, insort
+from collections import deque
+from fractions import Fraction
+import numpy as np
+from scipy.signal import butter, sosfilt, sosfilt_zi, firwin
+
+# The live filters as frequencies, so they follow the sample rate (the cutoffs used to be
+# normalised to the sensor's 480 Hz).
+LOWPASS_CUTOFF = 70.0
+HIGHPASS_CUTOFF = 9.6
+
+# How the mains filters work in both windows: "notch" (a Butterworth band-stop per
+# frequency) or "adaptive" (one PowerlineCanceller for the mains and its harmonics).
+MAINS_FILTER = os.environ.get("MKG_MAINS_FILTER", "notch").lower()
+
+# How the highpass switches remove the baseline: "butterworth" (the order-5 highpass),
+# "moving-average" or "median" (the running-window stages below, over MKG_BASELINE_WINDOW s).
+BASELINE_FILTER = os.environ.get("MKG_BASELINE_FILTER", "butterworth").lower()
+BASELINE_WINDOW = float(os.environ.get("MKG_BASELINE_WINDOW", "0.2"))
+
+
+class SosFilterStage:
+    def __init__(self, sos):
+        self.sos = sos
+        self.zi = None
+
+    def process(self, block):
+        if len(block) == 0:
+            return block
+        if self.zi is None:
+            self.zi = sosfilt_zi(self.sos) * block[0]
+        output, self.zi = sosfilt(self.sos, block, zi=self.zi)
+        return output
+
+    def reset(self):
+        self.zi = None
+
+
+# The stage builders return None for filters the sample rate cannot represent: a lowpass or
+# notch at or above Nyquist has nothing left to act on.
+def lowpass_stage(cutoff=LOWPASS_CUTOFF, fs=480, order=5):
+    if cutoff >= 0.5 * fs:
+        return None
+    return SosFilterStage(butter(order, cutoff, btype='low', output='sos', fs=fs))
+
+
+def highpass_stage(cutoff=HIGHPASS_CUTOFF, fs=480, order=5):
+    return SosFilterStage(butter(order, cutoff, btype='high', output='sos', fs=fs))
+
+
+def notch_stage(freq=50, fs=480, bandwidth=5):
+    nyq = 0.5 * fs
+    if freq + bandwidth / 2 >= nyq:
+        return None
+    low = (freq - bandwidth / 2) / nyq
+    high = (freq + bandwidth / 2) / nyq
+    return SosFilterStage(butter(N=2, Wn=[low, high], btype='bandstop', output='sos'))
+
+
+class PowerlineCanceller:
+    # Adaptive mains canceller in one O(n) pass: the interference at each harmonic k * f0 is
+    # modelled as a * cos + b * sin of an internal reference (no reference input needed),
+    # the weights are fitted by block LMS and the model is subtracted. It behaves like a
+    # comb of notches about 1 / (pi * time_constant) Hz wide, far narrower than the 5 Hz
+    # band-stops, so the signal around the mains keeps its shape. f0 follows the mains: a
+    # reference off by df makes the fitted phase turn at 2 * pi * df, and that rotation is
+    # fed back into f0 (within max_deviation of the nominal frequency).
+    # The weights and f0 only change at the end of every block samples of the stream; input
+    # short of a full block is cancelled with the current weights and kept for the next call,
+    # so the output does not depend on how the caller slices the stream.
+
+    def __init__(self, fs=480, mains=50, harmonics=None, time_constant=1.0, max_deviation=1.0, block=None,
+                 tracking_time=0.15, tracking_snr=4.0):
+        self.fs = fs
+        self.mains = mains
+        self.max_deviation = max_deviation
+        if harmonics is None:
+            harmonics = range(1, int(0.5 * fs / mains) + 1)
+        # Leave out harmonics that could reach Nyquist as f0 moves.
+        self.harmonics = np.array([k for k in harmonics if k * (mains + max_deviation) < 0.5 * fs], dtype=np.float64)
+        self.time_constant = time_constant
+        self.block = block or max(int(fs / 10), 1)
+        self.step = 1.0 / (fs * time_constant)
+        self.tracking_time = tracking_time
+        self.tracking_snr = tracking_snr
+        self.frequency = float(mains)
+        self.weights = np.zeros(2 * len(self.harmonics))
+        self.phase = 0.0
+        self.last_angle = None
+        # The part of the current block received so far, with its output.
+        self.pending = np.empty(0)
+        self.pending_error = np.empty(0)
+
+    def reverse(self):
+        # Turns the fit round in time, keeping the frequency: after a stretch of signal has
+        # been processed backwards, the conjugated weights fit it forwards from where the
+        # backward pass ended (for a fit that ends right at the start of a recording).
+        count = len(self.harmonics)
+        # The reference phase at the last sample processed, which becomes the first one.
+        last = self.phase + 2 * np.pi * self.frequency / self.fs * (len(self.pending) - 1)
+        self.phase = -last % (2 * np.pi)
+        self.weights[count:] *= -1
+        self.last_angle = None
+        self.pending = np.empty(0)
+        self.pending_error = np.empty(0)
+
+    def reset(self):
+        self.weights[:] = 0
+        self.frequency = float(self.mains)
+        self.phase = 0.0
+        self.last_angle = None
+        self.pending = np.empty(0)
+        self.pending_error = np.empty(0)
+
+    def references(self, offset, n):
+        angles = np.outer(self.phase + 2 * np.pi * self.frequency / self.fs * np.arange(offset, offset + n),
+                          self.harmonics)
+        return np.hstack((np.cos(angles), np.sin(angles)))
+
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        output = np.empty_like(block)
+        start = 0
+        while start < len(block):
+            offset = len(self.pending)
+            n = min(self.block - offset, len(block) - start)
+            chunk = block[start:start + n]
+            reference = self.references(offset, n)
+            error = chunk - reference @ self.weights
+            output[start:start + n] = error
+            start += n
+            if offset + n < self.block:
+                self.pending = np.concatenate([self.pending, chunk])
+                self.pending_error = np.concatenate([self.pending_error, error])
+                break
+            if offset:
+                reference = self.references(0, self.block)
+                error = np.concatenate([self.pending_error, error])
+                self.pending = np.empty(0)
+                self.pending_error = np.empty(0)
+            self.update(reference, error)
+        return output
+
+    def update(self, reference, error):
+        n = len(error)
+        self.weights += 2 * self.step * (reference.T @ error)
+        self.phase = (self.phase + 2 * np.pi * self.frequency / self.fs * n) % (2 * np.pi)
+        count = len(self.harmonics)
+        if not count:
+            return
+
+        # Track only an interference that clearly stands out from the weight noise, whose
+        # power is about 2 * step * mean(error ** 2). Off by df, LMS only holds a fraction
+        # 1 / sqrt(1 + (2 * pi * df * time_constant) ** 2) of the interference, so the gate is
+        # set against that noise floor rather than against the error itself.
+        a, b = self.weights[0], self.weights[count]
+        if a * a + b * b > self.tracking_snr * 2 * self.step * np.mean(error * error):
+            angle = np.arctan2(-b, a)
+            if self.last_angle is not None:
+                drift = (angle - self.last_angle + np.pi) % (2 * np.pi) - np.pi
+                gain = min(n / (self.fs * self.tracking_time), 0.5)
+                self.frequency += gain * drift * self.fs / (2 * np.pi * n * self.harmonics[0])
+                self.frequency = min(max(self.frequency, self.mains - self.max_deviation),
+                                     self.mains + self.max_deviation)
+            self.last_angle = angle
+        else:
+            self.last_angle = None
+
+
+def powerline_stage(mains=50, fs=480, harmonics=None):
+    canceller = PowerlineCanceller(fs, mains, harmonics)
+    if len(canceller.harmonics) == 0:
+        return None
+    return canceller
+
+
+# Running-window baseline removal: the baseline is a moving average (cascade) or median of the
+# signal over a centred window and is subtracted from the input delayed to the window's
+# centre, so streamed output runs delay samples behind and whole recordings come out
+# aligned (baseline_filter in backend pads the end and drops the first delay samples).
+# Both start as if the first sample had always been there, like the IIR stages.
+class MovingAverageBaseline:
+    # passes boxcars of length samples in a row (3 come close to a Gaussian, without the
+    # boxcar's side lobes); each is a cumulative-sum difference over the block and the
+    # previous length - 1 inputs, so the cost per sample does not depend on the window.
+
+    def __init__(self, length, passes=3):
+        self.length = max(int(length) | 1, 3)
+        self.passes = passes
+        self.delay = passes * (self.length - 1) // 2
+        self.tails = None
+        self.history = None
+
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        if len(block) == 0:
+            return block
+        if self.tails is None:
+            self.tails = [np.full(self.length - 1, block[0]) for _ in range(self.passes)]
+            self.history = np.full(self.delay, block[0])
+        baseline = block
+        for index in range(self.passes):
+            extended = np.concatenate([self.tails[index], baseline])
+            sums = np.concatenate([[0.0], np.cumsum(extended)])
+            self.tails[index] = extended[-(self.length - 1):]
+            baseline = (sums[self.length:] - sums[:-self.length]) / self.length
+        delayed = np.concatenate([self.history, block])
+        self.history = delayed[len(block):]
+        return delayed[:len(block)] - baseline
+
+    def reset(self):
+        self.tails = None
+        self.history = None
+
+
+class RunningMedianBaseline:
+    # The window is kept twice: in arrival order, to know which value leaves, and sorted,
+    # where bisect finds the leaving value and the place for the new one; the median is the
+    # middle entry. A median follows the baseline under the QRS where an average is pulled
+    # up by it, as long as the window is well over twice the complex.
+
+    def __init__(self, length):
+        self.length = max(int(length) | 1, 3)
+        self.delay = (self.length - 1) // 2
+        self.window = None
+        self.ordered = None
+        self.history = None
+
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        if len(block) == 0:
+            return block
+        if self.window is None:
+            self.window = deque([float(block[0])] * self.length)
+            self.ordered = [float(block[0])] * self.length
+            self.history = np.full(self.delay, block[0])
+        window, ordered, middle = self.window, self.ordered, self.delay
+        baseline = np.empty(len(block))
+        for index, value in enumerate(block.tolist()):
+            del ordered[bisect_left(ordered, window.popleft())]
+            window.append(value)
+            insort(ordered, value)
+            baseline[index] = ordered[middle]
+        delayed = np.concatenate([self.history, block])
+        self.history = delayed[len(block):]
+        return delayed[:len(block)] - baseline
+
+    def reset(self):
+        self.window = None
+        self.ordered = None
+        self.history = None
+
+
+def baseline_stage(method=BASELINE_FILTER, window=BASELINE_WINDOW, fs=480):
+    # The running-window stage for method, or None for "butterworth" (use highpass_stage).
+    length = int(round(window * fs))
+    if method == "moving-average":
+        return MovingAverageBaseline(length)
+    if method == "median":
+        return RunningMedianBaseline(length)
+    if method != "butterworth":
+        print(f"Unknown baseline filter '{method}', using the Butterworth highpass.")
+    return None
+
+
+def resample_ratio(sample_rate, source_rate, max_denominator=64):
+    # (up, down) taking source_rate to (about) sample_rate; never upsamples.
+    ratio = Fraction(min(sample_rate, source_rate) / source_rate).limit_denominator(max_denominator)
+    return ratio.numerator, ratio.denominator
+
+
+class PolyphaseResampler:
+    # Streaming scipy.signal.resample_poly: the same Kaiser-windowed FIR, evaluated only at
+    # the output positions (one polyphase branch per output phase) and carried across blocks.
+    # Output k sits on input position k * down / up, so its timestamp is interpolated from
+    # the input ones; the cost is half the filter length of latency (10 * down input samples
+    # when decimating by an integer factor).
+
+    def __init__(self, up, down, window=('kaiser', 5.0)):
+        self.up = up
+        self.down = down
+        self.delay = 10 * max(up, down)
+        taps = firwin(2 * self.delay + 1, 1.0 / max(up, down), window=window) * up
+        self.taps = -(-len(taps) // up)
+        taps = np.concatenate([taps, np.zeros(self.taps * up - len(taps))])
+        # phases[p][m] = taps[p + m * up]: output position n uses inputs n // up - m.
+        self.phases = taps.reshape(self.taps, up).T
+        self.times = None
+        self.values = None
+        self.first = 0
+        self.position = self.delay
+
+    def process(self, times, values):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return np.empty(0), np.empty(0)
+        if self.values is None:
+            # Start as if the first sample had always been there, like the IIR stages do.
+            self.first = -(self.taps - 1)
+            self.values = np.full(self.taps - 1, values[0])
+            self.times = np.full(self.taps - 1, float(times[0]))
+        self.values = np.concatenate([self.values, values])
+        self.times = np.concatenate([self.times, times])
+        end = self.first + len(self.values)
+        count = max(0, (end * self.up - 1 - self.position) // self.down + 1)
+        positions = self.position + self.down * np.arange(count)
+        newest = positions // self.up - self.first
+        inputs = self.values[newest[:, None] - np.arange(self.taps)]
+        output = np.einsum('ij,ij->i', self.phases[positions % self.up], inputs)
+        where = (positions - self.delay) / self.up - self.first
+        index = np.minimum(where.astype(np.int64), len(self.times) - 2)
+        output_times = self.times[index] + (where - index) * (self.times[index + 1] - self.times[index])
+
+        self.position += self.down * count
+        keep = max(self.position // self.up - (self.taps - 1) - self.first, 0)
+        self.values = self.values[keep:]
+        self.times = self.times[keep:]
+        self.first += keep
+        return output_times, output
+
+
+class LiveFilterChain:
+    def __init__(self, sample_rate=480):
+        self.sample_rate = sample_rate
+        self.settings = None
+        self.stages = []
+        self.stage_map = {}
+        self.last_time = None
+
+    def configure(self, settings):
+        # Stages are kept by the setting they come from, so a change only builds (or drops) the
+        # stages of the settings that changed. The mains stage runs first: toggling the others
+        # then leaves its input, and an adaptive canceller's weights and lock, as they were.
+        if settings == self.settings:
+            return
+        lowpass, highpass, notch, custom_freq = settings
+        builders = []
+        if notch:
+            builders.append(("notch", self.mains_stage))
+        if lowpass:
+            builders.append(("lowpass", lambda: lowpass_stage(fs=self.sample_rate)))
+        if highpass:
+            builders.append(("highpass", lambda: baseline_stage(fs=self.sample_rate) or highpass_stage(fs=self.sample_rate)))
+        if custom_freq is not None:
+            builders.append((("custom", custom_freq), lambda: notch_stage(freq=custom_freq, fs=self.sample_rate)))
+        self.stage_map = {key: self.stage_map[key] if key in self.stage_map else build() for key, build in builders}
+        self.stages = [stage for stage in self.stage_map.values() if stage is not None]
+        self.settings = settings
+
+    def mains_stage(self):
+        if MAINS_FILTER == "adaptive":
+            return powerline_stage(mains=50, fs=self.sample_rate)
+        return notch_stage(freq=50, fs=self.sample_rate)
+
+    @property
+    def delay(self):
+        # Samples the output runs behind the input (the running-window baseline stages).
+        return sum(getattr(stage, 'delay', 0) for stage in self.stages)
+
+    def process(self, block, settings):
+        self.configure(settings)
+        block = np.asarray(block, dtype=np.float64)
+        for stage in self.stages:
+            block = stage.process(block)
+        return block
+
+    def process_records(self, records, settings):
+        # SAMPLE_RECORDs filtered, each output on the timestamp of the input it belongs to.
+        # Outputs that a newly added delay puts at or before ones already returned are dropped.
+        filtered = records.copy()
+        filtered['value'] = self.process(records['value'], settings)
+        filtered['time'] -= self.delay / self.sample_rate
+        if self.last_time is not None:
+            filtered = filtered[filtered['time'] > self.last_time]
+        if len(filtered):
+            self.last_time = filtered['time'][-1]
+        return filtered
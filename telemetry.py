@@ -0,0 +1,96 @@
+import time
+import threading
+import collections
+
+# Counters are summed and reported as totals and per-second rates, gauges keep their latest
+# value, timings are reported as mean and max milliseconds (plus calls per second) over the
+# sampling interval.
+COUNTERS = ("samples", "dropped")
+GAUGES = ("queue_depth", "ring_fill", "latency_ms")
+TIMINGS = ("filter", "draw")
+COLUMNS = (["time"] + [f"{name}{suffix}" for name in COUNTERS for suffix in ("_total", "_per_s")] + list(GAUGES)
+           + [f"{name}{suffix}" for name in TIMINGS for suffix in ("_ms", "_max_ms", "_per_s")])
+
+
+class PipelineTelemetry:
+    # Metrics of the live pipeline. count/gauge/timing may be called from any thread; sample()
+    # is called periodically (once a second from the GUI) and appends one row to a bounded
+    # history that export_csv writes out as a time series.
+
+    def __init__(self, history_length=3600):
+        self.lock = threading.Lock()
+        self.counters = collections.Counter()
+        self.reported = collections.Counter()
+        self.gauges = {}
+        self.timings = {}
+        self.peaks = {}
+        self.last_sample = time.monotonic()
+        self.history = collections.deque(maxlen=history_length)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def peak(self, name, value):
+        # Gauge that keeps the highest value seen until the next sample().
+        with self.lock:
+            self.peaks[name] = max(self.peaks.get(name, value), value)
+
+    def timing(self, name, seconds):
+        with self.lock:
+            total, calls, longest = self.timings.get(name, (0.0, 0, 0.0))
+            self.timings[name] = (total + seconds, calls + 1, max(longest, seconds))
+
+    def sample(self):
+        now = time.monotonic()
+        with self.lock:
+            elapsed = max(now - self.last_sample, 1e-9)
+            self.last_sample = now
+            counters = dict(self.counters)
+            timings, self.timings = self.timings, {}
+            peaks, self.peaks = self.peaks, {}
+        row = {"time": time.time()}
+        for name in COUNTERS:
+            total = counters.get(name, 0)
+            row[f"{name}_total"] = total
+            row[f"{name}_per_s"] = (total - self.reported[name]) / elapsed
+            self.reported[name] = total
+        for name in GAUGES:
+            row[name] = peaks.get(name, self.gauges.get(name))
+        for name in TIMINGS:
+            total, calls, longest = timings.get(name, (0.0, 0, 0.0))
+            row[f"{name}_ms"] = 1000 * total / calls if calls else None
+            row[f"{name}_max_ms"] = 1000 * longest if calls else None
+            row[f"{name}_per_s"] = calls / elapsed
+        self.history.append(row)
+        return row
+
+    def export_csv(self, path):
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(",".join(COLUMNS) + "\n")
+            for row in list(self.history):
+                file.write(",".join(format_value(column, row[column]) for column in COLUMNS) + "\n")
+
+
+def format_value(column, value):
+    if value is None:
+        return ""
+    return f"{value:.3f}" if column == "time" else f"{value:.6g}"
+
+
+def format_telemetry(row):
+    def value(name, fmt):
+        return "-" if row.get(name) is None else format(row[name], fmt)
+
+    return "\n".join([
+        f"ingest      {value('samples_per_s', '.0f')} samples/s",
+        f"queue       {value('queue_depth', '.0f')}",
+        f"ring fill   {value('ring_fill', '.0%')}",
+        f"dropped     {value('dropped_total', '.0f')} ({value('dropped_per_s', '.0f')}/s)",
+        f"filter      {value('filter_ms', '.2f')} ms/block (max {value('filter_max_ms', '.2f')})",
+        f"draw        {value('draw_ms', '.1f')} ms/frame (max {value('draw_max_ms', '.1f')}, {value('draw_per_s', '.0f')} fps)",
+        f"latency     {value('latency_ms', '.0f')} ms",
+    ])
@@ -0,0 +1,120 @@
+import time
+import numpy as np
+import pandas as pd
+import pytest
+from PyQt5.QtWidgets import QMainWindow, QCheckBox, QLineEdit, QSlider, QVBoxLayout, QWidget
+from PyQt5.QtCore import Qt
+
+import backend
+from backend import RedrawScheduler, handle_filter_toggle, update_plot
+from tile_cache import ViewportTileCache
+
+
+class FilterWindow(QMainWindow):
+    # The parts of the offline MainWindow that the redraw path touches.
+
+    def __init__(self, data):
+        super().__init__()
+        self.lowpass_filter = QCheckBox("Lowpass")
+        self.highpass_filter = QCheckBox("Highpass")
+        self.filter_50hz = QCheckBox("50Hz")
+        self.filter_100hz = QCheckBox("100Hz")
+        self.filter_150hz = QCheckBox("150Hz")
+        self.custom_filter_1_input = QLineEdit()
+        self.custom_filter_1_apply = QCheckBox("Apply")
+        self.custom_filter_2_input = QLineEdit()
+        self.custom_filter_2_apply = QCheckBox("Apply")
+        self.bandpass_apply = QCheckBox("Apply")
+        self.toggle_theme = QCheckBox()
+        self.threaded_rendering = QCheckBox()
+        self.pan_slider = QSlider(Qt.Horizontal)
+        central = QWidget()
+        self.canvas_layout = QVBoxLayout(central)
+        self.setCentralWidget(central)
+
+        self.redraw_scheduler = RedrawScheduler(self)
+        self.tile_cache = ViewportTileCache(self)
+        self.canvas_frame = None
+        self.current_time_from = None
+        self.current_time_to = None
+        self.original_data = data
+        self.data = data.copy()
+        for name in ("lowpass", "highpass", "50hz", "100hz", "150hz"):
+            checkbox = self.lowpass_filter if name == "lowpass" else self.highpass_filter if name == "highpass" \
+                else getattr(self, f"filter_{name}")
+            checkbox.stateChanged.connect(lambda _, name=name: handle_filter_toggle(self, name))
+
+
+def wait_for_flush(qapp, window, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    qapp.processEvents()
+    while window.redraw_scheduler.timer.isActive() and time.monotonic() < deadline:
+        qapp.processEvents()
+        time.sleep(0.001)
+    assert not window.redraw_scheduler.timer.isActive()
+
+
+@pytest.fixture
+def window(qapp, monkeypatch):
+    monkeypatch.setattr(backend, "MAINS_FILTER", "notch")
+    monkeypatch.setattr(backend, "BASELINE_FILTER", "butterworth")
+    fs = 480
+    t = np.arange(20 * fs) / fs
+    data = pd.DataFrame({'time': t, 'gradient.B': np.sin(2 * np.pi * 1.2 * t) + 0.1 * np.sin(2 * np.pi * 50 * t)})
+    window = FilterWindow(data)
+    update_plot(window, window.data)
+    yield window
+    window.redraw_scheduler.cancel()
+    window.canvas.stop_rendering()
+    window.close()
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    counts = {"lowpass": 0, "highpass": 0, "notch": 0}
+
+    def counting(name, original):
+        def wrapper(*args, **kwargs):
+            counts[name] += 1
+            return original(*args, **kwargs)
+        return wrapper
+
+    monkeypatch.setattr(backend, "lowpass_filter", counting("lowpass", backend.lowpass_filter))
+    monkeypatch.setattr(backend, "highpass_filter", counting("highpass", backend.highpass_filter))
+    monkeypatch.setattr(backend, "notch_filter", counting("notch", backend.notch_filter))
+    return counts
+
+
+def test_filter_toggle_runs_one_pass(qapp, window, calls):
+    window.lowpass_filter.setChecked(True)
+    wait_for_flush(qapp, window)
+    assert calls == {"lowpass": 1, "highpass": 0, "notch": 0}
+
+    # The next settings change filters the original data again, once, with both filters.
+    window.filter_50hz.setChecked(True)
+    wait_for_flush(qapp, window)
+    assert calls == {"lowpass": 2, "highpass": 0, "notch": 1}
+
+
+def test_zoom_and_pan_do_not_filter(qapp, window, calls):
+    window.highpass_filter.setChecked(True)
+    wait_for_flush(qapp, window)
+    assert calls["highpass"] == 1
+
+    for value in (10, 30, 50, 70):
+        window.redraw_scheduler.request_zoom(value)
+    wait_for_flush(qapp, window)
+    for value in (0, 25, 50, 100):
+        window.redraw_scheduler.request_pan(value)
+    wait_for_flush(qapp, window)
+    assert calls == {"lowpass": 0, "highpass": 1, "notch": 0}
+
+
+def test_changes_within_one_frame_are_coalesced(qapp, window, calls):
+    # Several toggles plus a zoom before the scheduler fires: one filter pass in total.
+    window.lowpass_filter.setChecked(True)
+    window.filter_50hz.setChecked(True)
+    window.filter_100hz.setChecked(True)
+    window.redraw_scheduler.request_zoom(40)
+    wait_for_flush(qapp, window)
+    assert calls == {"lowpass": 1, "highpass": 0, "notch": 2}
@@ -0,0 +1,39 @@
+import numpy as np
+
+from history import SampleHistory
+from ring_buffer import SAMPLE_RECORD
+
+FS = 480
+
+
+def session(seconds):
+    history = SampleHistory(FS, minutes=60)
+    records = np.empty(int(seconds * FS), dtype=SAMPLE_RECORD)
+    records['time'] = np.arange(len(records)) / FS
+    records['value'] = np.sin(2 * np.pi * records['time'])
+    for start in range(0, len(records), 48):
+        history.append(records[start:start + 48])
+    return history, records
+
+
+def test_session_shorter_than_the_span_uses_the_finest_level_that_fits():
+    history, records = session(30)
+    times, values = history.window(-30, 30, max_points=4000)
+    # Level 1 (16-sample buckets as min/max pairs) holds the whole session in 1800 points.
+    assert 2 * len(records) // 16 - 2 <= len(times) <= 4000
+    assert times[0] == records['time'][0]
+    assert np.diff(np.unique(times)).max() <= 16 / FS + 1e-9
+
+
+def test_session_younger_than_the_coarse_levels_still_shows_samples():
+    history, records = session(0.4)
+    times, values = history.window(-60, 0.4, max_points=4000)
+    assert len(times) > 0
+    assert times[0] == records['time'][0]
+
+
+def test_full_levels_still_need_to_reach_back():
+    history, records = session(120)
+    times, values = history.window(0, 120, max_points=4000)
+    assert times[0] <= 0
+    assert len(times) <= 4000
@@ -0,0 +1,72 @@
+from functools import partial
+import numpy as np
+import pytest
+
+import streaming_filters
+from ring_buffer import SAMPLE_RECORD
+from streaming_filters import LiveFilterChain
+
+FS = 480
+
+
+def use_baseline(monkeypatch, method):
+    # The stage builder takes MKG_BASELINE_FILTER as its default when the module loads.
+    monkeypatch.setattr(streaming_filters, "baseline_stage", partial(streaming_filters.baseline_stage, method))
+
+
+def impulse_records(count=3000, at=1000):
+    records = np.zeros(count, dtype=SAMPLE_RECORD)
+    records['time'] = np.arange(count) / FS
+    records['value'][at] = 1.0
+    return records
+
+
+@pytest.mark.parametrize("method", ["moving-average", "median"])
+def test_baseline_delay_is_taken_off_the_timestamps(monkeypatch, method):
+    use_baseline(monkeypatch, method)
+    chain = LiveFilterChain(FS)
+    records = impulse_records()
+    output = np.concatenate([chain.process_records(records[start:start + 48], (False, True, False, None))
+                             for start in range(0, len(records), 48)])
+    assert chain.delay > 0
+    peak = np.argmax(output['value'])
+    assert output['time'][peak] == pytest.approx(records['time'][1000])
+
+
+def test_added_delay_does_not_repeat_timestamps(monkeypatch):
+    use_baseline(monkeypatch, "moving-average")
+    chain = LiveFilterChain(FS)
+    records = impulse_records()
+    first = chain.process_records(records[:1500], (False, False, False, None))
+    second = chain.process_records(records[1500:], (False, True, False, None))
+    times = np.concatenate([first['time'], second['time']])
+    assert np.all(np.diff(times) > 0)
+    assert len(second) == 1500 - chain.delay
+
+
+def mains_left(output, times, frequency):
+    # Amplitude of what is left at frequency, by least squares over the block.
+    basis = np.column_stack((np.cos(2 * np.pi * frequency * times), np.sin(2 * np.pi * frequency * times)))
+    weights = np.linalg.lstsq(basis, output, rcond=None)[0]
+    return np.hypot(*weights)
+
+
+def test_other_settings_keep_the_canceller_locked(monkeypatch):
+    monkeypatch.setattr(streaming_filters, "MAINS_FILTER", "adaptive")
+    chain = LiveFilterChain(FS)
+    times = np.arange(30 * FS) / FS
+    signal = 0.05 * np.random.default_rng(1).normal(size=len(times)) + 0.3 * np.cos(2 * np.pi * 50.6 * times)
+    settings = [(False, False, True, None), (True, False, True, None), (True, False, True, 30.0),
+                (False, False, True, 30.0)]
+    canceller = None
+    for step, setting in enumerate(settings):
+        part = slice(step * 7 * FS, (step + 1) * 7 * FS)
+        output = np.concatenate([chain.process(signal[part][start:start + 48], setting)
+                                 for start in range(0, 7 * FS, 48)])
+        if canceller is None:
+            canceller = chain.stages[0]
+        else:
+            # Right after the change, not one time constant later.
+            assert chain.stages[0] is canceller
+            assert mains_left(output[:FS // 2], times[part][:FS // 2], 50.6) < 0.02
+        assert abs(canceller.frequency - 50.6) < 0.05
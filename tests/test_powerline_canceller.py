@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+import backend
+from streaming_filters import PowerlineCanceller
+
+FS = 480
+SECONDS = 20
+
+
+def recording(mains):
+    # Noise and baseline wander under mains interference (fundamental and 2nd harmonic) at
+    # about 0.22 rms; returns (signal, clean part).
+    t = np.arange(FS * SECONDS) / FS
+    rng = np.random.default_rng(1)
+    clean = 0.05 * rng.normal(size=len(t)) + 0.3 * np.sin(2 * np.pi * 0.3 * t)
+    phase = 2 * np.pi * mains * t
+    return clean + 0.3 * np.cos(phase + 0.4) + 0.1 * np.cos(2 * phase + 1), clean
+
+
+def stream(signal, size):
+    canceller = PowerlineCanceller(FS, 50)
+    output = np.concatenate([canceller.process(signal[start:start + size]) for start in range(0, len(signal), size)])
+    return output, canceller.frequency
+
+
+def rms(values):
+    return np.sqrt(np.mean(values ** 2))
+
+
+@pytest.mark.parametrize("mains", [49.0, 49.4, 50.0, 50.6, 51.0])
+def test_streaming_does_not_depend_on_block_size(mains):
+    signal, clean = recording(mains)
+    outputs = {size: stream(signal, size) for size in (1, 3, 48, 480)}
+    reference, _ = outputs[480]
+    for size, (output, frequency) in outputs.items():
+        np.testing.assert_allclose(output, reference, atol=1e-9, err_msg=f"{size}-sample blocks")
+        assert abs(frequency - mains) < 0.05, size
+        # Converged over the second half: what is left of the mains is down at the noise.
+        assert rms((output - clean)[len(clean) // 2:]) < 0.015, size
+
+
+@pytest.mark.parametrize("mains", [49.0, 49.4, 50.0, 50.5, 50.9, 51.0])
+def test_offline_cancels_mains_off_nominal(mains):
+    signal, clean = recording(mains)
+    output = backend.powerline_filter(signal, fs=FS)
+    # Including the opening seconds, which the backward fit covers.
+    assert rms(output - clean) < 0.015
+    assert rms(output[:FS] - clean[:FS]) < 0.02
@@ -0,0 +1,57 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+
+from chunked_recording import ChunkedRecordingWriter, open_recording, read_header, read_index, block_dtype
+from recording import record_dtype, recover_recording
+
+CHANNELS = ['gradient.B']
+
+
+def crashed_recording(path, samples=2000, block_samples=512):
+    # A .part file as a crash leaves it: whole blocks, then part of the next one, no index.
+    records = np.empty(samples, dtype=record_dtype(CHANNELS))
+    records['time'] = 1000 + np.arange(samples) / 480
+    records['gradient.B'] = np.sin(np.arange(samples))
+    writer = ChunkedRecordingWriter(path, 480, CHANNELS, 0.0, block_samples)
+    writer.append(records)
+    writer.file.write(b"BLK0 torn")
+    writer.file.close()
+    return records[:samples // block_samples * block_samples]
+
+
+def test_recover_binary(tmp_path):
+    part = str(tmp_path / "session.mkgb.part")
+    expected = crashed_recording(part)
+    path, samples = recover_recording(part)
+    assert path == str(tmp_path / "session.mkgb")
+    assert not os.path.exists(part)
+    assert samples == len(expected)
+    header, data_offset = read_header(path)
+    assert read_index(path, data_offset, block_dtype(header)) is not None
+    header, blocks, index = open_recording(path)
+    assert np.array_equal(blocks['records'].reshape(-1), expected)
+
+
+def test_recover_csv(tmp_path):
+    part = str(tmp_path / "session.csv.part")
+    expected = crashed_recording(part)
+    path, samples = recover_recording(part)
+    assert not os.path.exists(part)
+    data = pd.read_csv(path, skipinitialspace=True)
+    assert len(data) == samples == len(expected)
+    assert np.allclose(data['Value'], expected['gradient.B'])
+
+
+def test_command_line(tmp_path):
+    part = str(tmp_path / "session.mkgb.part")
+    expected = crashed_recording(part)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, os.path.join(root, "recording.py"), part, str(tmp_path / "missing.part")],
+                            capture_output=True, text=True, cwd=root)
+    assert result.returncode == 1
+    assert f"({len(expected)} samples)" in result.stdout
+    assert os.path.exists(tmp_path / "session.mkgb")
@@ -0,0 +1,128 @@
+import time
+import numpy as np
+import slip
+import tio
+
+from slip_decoder import SlipDecoder
+from sensor_emulator import STREAM0_ROW
+
+
+def stream0_packets(count, seed=0):
+    # STREAM0 rows as the sensor sends them; sample numbers and values are chosen so that
+    # plenty of them contain the SLIP END (0xC0) and ESC (0xDB) bytes that must be escaped.
+    rng = np.random.default_rng(seed)
+    rows = np.empty(count, dtype=STREAM0_ROW)
+    rows['type'] = tio.TL_PTYPE_STREAM0
+    rows['routing'] = 0
+    rows['size'] = 8
+    rows['sample'] = 0xC0DB00 + np.arange(count)
+    rows['value'] = rng.normal(size=count).astype(np.float32)
+    special = rng.random(count) < 0.3
+    raw = rows.view(np.uint8).reshape(count, STREAM0_ROW.itemsize)
+    raw[special, -1] = rng.choice([0xC0, 0xDB], size=special.sum())
+    return [row.tobytes() for row in raw]
+
+
+def encode_stream(packets):
+    return b"".join(bytes(slip.encode(bytearray(packet))) for packet in packets)
+
+
+def reference_decode(stream):
+    # What slip.decode makes of each frame between END bytes.
+    return [bytes(slip.decode(frame)) for frame in stream.split(slip.SLIP_END_CHAR) if frame]
+
+
+def test_matches_reference_decoder():
+    packets = stream0_packets(2000)
+    stream = encode_stream(packets)
+    assert stream.count(b"\xDB") > 100
+    decoder = SlipDecoder()
+    decoded = decoder.feed(stream)
+    assert decoded == reference_decode(stream) == packets
+    assert decoder.errors == 0
+    assert decoder.frames == len(packets)
+    assert decoder.pending() == 0
+
+
+def test_random_chunking():
+    packets = stream0_packets(3000, seed=1)
+    stream = encode_stream(packets)
+    rng = np.random.default_rng(2)
+    for max_chunk in (1, 3, 17, 256, 4096):
+        decoder = SlipDecoder(compact_threshold=1024)
+        decoded = []
+        position = 0
+        while position < len(stream):
+            size = int(rng.integers(1, max_chunk + 1))
+            decoded += decoder.feed(stream[position:position + size])
+            position += size
+        assert decoded == packets, max_chunk
+        assert decoder.errors == 0
+
+
+def test_splits_inside_escape_sequences():
+    packets = stream0_packets(500, seed=3)
+    stream = encode_stream(packets)
+    escapes = [index for index in range(len(stream)) if stream[index] == 0xDB]
+    assert escapes
+    # Cut right after every ESC byte, so each escape sequence spans two feeds.
+    cuts = [0] + [index + 1 for index in escapes] + [len(stream)]
+    decoder = SlipDecoder()
+    decoded = []
+    for start, end in zip(cuts, cuts[1:]):
+        decoded += decoder.feed(stream[start:end])
+    assert decoded == packets
+    assert decoder.errors == 0
+
+
+def test_corrupt_frames_do_not_desync():
+    packets = stream0_packets(300, seed=4)
+    frames = [bytes(slip.encode(bytearray(packet))) for packet in packets]
+    bad = {}
+    for index in range(10, 300, 25):
+        frame = bytearray(frames[index])
+        kind = index % 3
+        if kind == 0:
+            frame[3] ^= 0x55  # CRC mismatch
+        elif kind == 1:
+            frame[2:2] = b"\xDB\x00"  # ESC not followed by a valid escape code
+        else:
+            frame = bytearray(b"\xC0\x01\x02\xC0")  # shorter than the CRC
+        frames[index] = bytes(frame)
+        bad[index] = kind
+    stream = b"".join(frames)
+    decoder = SlipDecoder()
+    decoded = []
+    for start in range(0, len(stream), 7):
+        decoded += decoder.feed(stream[start:start + 7])
+    assert decoder.errors == len(bad)
+    assert decoded == [packet for index, packet in enumerate(packets) if index not in bad]
+
+
+def test_throughput():
+    packets = stream0_packets(200000, seed=5)
+    stream = encode_stream(packets)
+    chunks = [stream[start:start + 4096] for start in range(0, len(stream), 4096)]
+    decoder = SlipDecoder()
+    started = time.perf_counter()
+    count = sum(len(decoder.feed(chunk)) for chunk in chunks)
+    elapsed = time.perf_counter() - started
+    assert count == len(packets)
+    rate = len(stream) / elapsed / 1e6
+    print(f"SlipDecoder: {rate:.1f} MB/s, {count / elapsed / 1e3:.0f}k packets/s")
+    # The sensor sends about 7 kB/s per channel; anything near this floor is a regression.
+    assert rate > 1.0
+
+
+def test_long_frame_in_small_pieces_is_searched_once():
+    payload = np.random.default_rng(6).integers(0, 256, 200000, dtype=np.uint8).tobytes()
+    packets = stream0_packets(3, seed=6)
+    stream = encode_stream(packets[:1] + [payload] + packets[1:])
+    decoder = SlipDecoder(compact_threshold=16)
+    decoded = []
+    for start in range(0, len(stream), 64):
+        decoded += decoder.feed(stream[start:start + 64])
+        # Whatever is left has been searched up to the end; the next feed starts there.
+        assert decoder.scanned == len(decoder.buffer)
+    assert decoded == packets[:1] + [payload] + packets[1:]
+    assert decoder.errors == 0
@@ -0,0 +1,117 @@
+import math
+import threading
+from collections import OrderedDict
+import numpy as np
+from PyQt5.QtCore import QObject, QTimer
+
+
+class ViewportTileCache(QObject):
+    def __init__(self, parent=None, max_tiles=64, points_per_tile=4096, prefetch_radius=2, idle_ms=150):
+        super().__init__(parent)
+        self.max_tiles = max_tiles
+        self.points_per_tile = points_per_tile
+        self.prefetch_radius = prefetch_radius
+
+        self.time = None
+        self.values = None
+        self.generation = 0
+        self.tiles = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.prefetch_keys = []
+        self.prefetch_thread = None
+        self.idle_timer = QTimer(self)
+        self.idle_timer.setSingleShot(True)
+        self.idle_timer.setInterval(idle_ms)
+        self.idle_timer.timeout.connect(self.start_prefetch)
+
+    def set_signal(self, time, values):
+        self.idle_timer.stop()
+        with self.lock:
+            self.time = np.asarray(time, dtype=np.float64)
+            self.values = np.asarray(values, dtype=np.float64)
+            self.generation += 1
+            self.tiles.clear()
+
+    def tile_span(self, visible_range):
+        # Power-of-two spans let neighbouring zoom levels share tiles.
+        return 2.0 ** math.ceil(math.log2(max(visible_range, 1e-9)))
+
+    def tile_count(self, span):
+        return int((self.time[-1] - self.time[0]) // span) + 1
+
+    def build_tile(self, time, values, span, index):
+        origin = time[0]
+        start, stop = np.searchsorted(time, (origin + index * span, origin + (index + 1) * span))
+        tile_time = time[start:stop]
+        tile_values = values[start:stop]
+        if len(tile_values) == 0:
+            return tile_time, tile_values, None, None
+        if len(tile_values) > self.points_per_tile:
+            starts = np.linspace(0, len(tile_values), self.points_per_tile // 2, endpoint=False).astype(np.int64)
+            minimum = np.minimum.reduceat(tile_values, starts)
+            maximum = np.maximum.reduceat(tile_values, starts)
+            tile_time = np.repeat(tile_time[starts], 2)
+            tile_values = np.column_stack((minimum, maximum)).ravel()
+        return tile_time, tile_values, tile_values.min(), tile_values.max()
+
+    def get_tile(self, span, index):
+        key = (span, index)
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is not None:
+                self.tiles.move_to_end(key)
+                return tile
+            time, values, generation = self.time, self.values, self.generation
+        tile = self.build_tile(time, values, span, index)
+        self.store_tile(key, tile, generation)
+        return tile
+
+    def store_tile(self, key, tile, generation):
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.tiles[key] = tile
+            self.tiles.move_to_end(key)
+            while len(self.tiles) > self.max_tiles:
+                self.tiles.popitem(last=False)
+
+    def viewport(self, time_from, time_to):
+        if self.time is None or len(self.time) == 0:
+            return np.empty(0), np.empty(0), None
+
+        span = self.tile_span(time_to - time_from)
+        count = self.tile_count(span)
+        origin = self.time[0]
+        first = min(max(int((time_from - origin) // span), 0), count - 1)
+        last = min(max(int((time_to - origin) // span), 0), count - 1)
+
+        tiles = [self.get_tile(span, index) for index in range(first, last + 1)]
+        time = np.concatenate([tile[0] for tile in tiles])
+        values = np.concatenate([tile[1] for tile in tiles])
+
+        visible = values[(time >= time_from) & (time <= time_to)]
+        y_range = (visible.min(), visible.max()) if len(visible) else None
+
+        self.prefetch_keys = [(span, index) for distance in range(1, self.prefetch_radius + 1)
+                              for index in (last + distance, first - distance) if 0 <= index < count]
+        self.idle_timer.start()
+        return time, values, y_range
+
+    def start_prefetch(self):
+        if self.prefetch_thread is not None and self.prefetch_thread.is_alive():
+            self.idle_timer.start()
+            return
+        with self.lock:
+            keys = [key for key in self.prefetch_keys if key not in self.tiles]
+            time, values, generation = self.time, self.values, self.generation
+        if not keys:
+            return
+        self.prefetch_thread = threading.Thread(target=self.prefetch, args=(keys, time, values, generation), daemon=True)
+        self.prefetch_thread.start()
+
+    def prefetch(self, keys, time, values, generation):
+        for span, index in keys:
+            if generation != self.generation:
+                return
+            self.store_tile((span, index), self.build_tile(time, values, span, index), generation)